@@ -9,8 +9,11 @@ from aiogram import types
 from pydub import AudioSegment
 
 import settings
+from app.bot.cancellation_manager import CancellationToken
+from app.bot.chat_actions import ChatActionService
 from app.bot.message_processor import MessageProcessor
-from app.bot.utils import TypingWorker, message_is_forward, get_username, Timer, generate_document_id
+from app.bot.turn_scheduler import TurnScheduler
+from app.bot.utils import message_is_forward, get_username, Timer, generate_document_id
 from app.llm_models import get_model_by_name
 from app.openai_helpers.utils import calculate_whisper_usage_price
 from app.openai_helpers.whisper import get_audio_speech_to_text
@@ -27,18 +30,16 @@ class BatchedInputHandler:
     Handles input messages (context and prompt) in batches. If batch has prompt, sends it to OpenAI and sends response
     to user. If batch has no prompt, adds it to context.
     """
-    def __init__(self, bot, db, cancellation_manager):
+    def __init__(self, bot, db, turn_scheduler: TurnScheduler, chat_actions: ChatActionService):
         self.bot = bot
         self.db = db
-        self.cancellation_manager = cancellation_manager
+        self.turn_scheduler = turn_scheduler
+        self.chat_actions = chat_actions
 
         self.user_batches = {}
         self.user_locks = {}
         self.user_timers = {}
 
-        self.user_batch_queues = {}
-        self.user_batch_locks = {}
-
     async def handle(self, message: types.Message, user: User):
         """Collects messages in batches and handles them one by one in order they were received"""
         if user.id not in self.user_batches:
@@ -61,25 +62,11 @@ class BatchedInputHandler:
             await self.handle_batch(messages_batch, user)
 
     async def handle_batch(self, messages_batch: List[types.Message], user: User):
-        """Handles batches one by one in order they were received"""
-        if user.id not in self.user_batch_queues:
-            self.user_batch_queues[user.id] = asyncio.Queue()
-            self.user_batch_locks[user.id] = asyncio.Lock()
-
-        queue = self.user_batch_queues[user.id]
-
-        await queue.put(messages_batch)
-
-        # If lock is already acquired, exit
-        if not self.user_batch_locks[user.id].locked():
-            try:
-                async with self.user_batch_locks[user.id]:
-                    while not queue.empty():
-                        messages_batch = queue.get_nowait()
-                        await self.process_batch(messages_batch, user)
-            finally:
-                del self.user_batch_queues[user.id]
-                del self.user_batch_locks[user.id]
+        """Handles batches one by one in order they were received, waits until the batch is processed"""
+        await self.turn_scheduler.run(
+            user.id, user.role, user.telegram_id,
+            lambda is_cancelled: self.process_batch(messages_batch, user, is_cancelled),
+        )
 
     @staticmethod
     def batch_is_prompt(messages_batch: List[types.Message], user: User):
@@ -104,7 +91,7 @@ class BatchedInputHandler:
         # no prompt messages in batch
         return False
 
-    async def process_batch(self, messages_batch: List[types.Message], user: User):
+    async def process_batch(self, messages_batch: List[types.Message], user: User, is_cancelled: CancellationToken):
         """
         Processes batch of messages. If batch has prompt, sends it to OpenAI and sends response to user.
         """
@@ -137,8 +124,8 @@ class BatchedInputHandler:
                 await message_processor.add_context_only(user_input)
                 return
 
-            async with TypingWorker(self.bot, first_message.chat.id).typing_context():
-                await self.answer_message(first_message, user, user_input)
+            async with self.chat_actions.active(first_message.chat.id):
+                await self.answer_message(first_message, user, user_input, is_cancelled)
         except Exception as e:
             logger.exception(f"An error occurred while processing input: %s", e)
             await messages_batch[-1].answer(f'Something went wrong:\n{str(type(e))}\n{e}')
@@ -163,7 +150,7 @@ class BatchedInputHandler:
             await message.reply('Document file is too big')
             return
 
-        async with TypingWorker(self.bot, message.chat.id, TypingWorker.ACTION_UPLOAD_DOCUMENT).typing_context():
+        async with self.chat_actions.active(message.chat.id, ChatActionService.ACTION_UPLOAD_DOCUMENT):
             with tempfile.TemporaryDirectory() as temp_dir:
                 document_id = generate_document_id(message.chat.id, message.message_id)
 
@@ -198,7 +185,7 @@ class BatchedInputHandler:
             await message.reply('Voice file is too big')
             return
 
-        async with TypingWorker(self.bot, message.chat.id).typing_context():
+        async with self.chat_actions.active(message.chat.id):
             with tempfile.TemporaryDirectory() as temp_dir:
                 voice_filepath = os.path.join(temp_dir, f'voice_{file_id}')
                 mp3_filename = os.path.join(temp_dir, f'voice_{file_id}.mp3')
@@ -276,11 +263,10 @@ class BatchedInputHandler:
             tg_message_id=message.message_id,
         ))
 
-    async def answer_message(self, first_message: types.Message, user: User, user_input: UserInput):
+    async def answer_message(self, first_message: types.Message, user: User, user_input: UserInput,
+                             is_cancelled: CancellationToken):
         """
         Sends prompt to OpenAI, sends response to user, adds response to context.
         """
-        # TODO: fix memory leak (if message not cancelelled, the token is not deleted)
-        is_cancelled = self.cancellation_manager.get_token(user.telegram_id)
         message_processor = MessageProcessor(self.db, user, first_message)
         await message_processor.process(is_cancelled, user_input)
@@ -1,3 +1,5 @@
+from contextlib import contextmanager
+
 from aiogram import types
 
 
@@ -20,7 +22,8 @@ class CancellationToken:
 
 class CancellationManager:
     """
-    Class that manages the cancellation of message processing for streaming messages
+    Class that manages the cancellation of message processing for streaming messages.
+    A token lives as long as the turn it belongs to, see turn().
     """
     def __init__(self, bot, dispatcher):
         self._cancellation_tokens = {}
@@ -35,14 +38,19 @@ class CancellationManager:
         self.cancel(chat_id)
         await self.bot.answer_callback_query(callback_query.id)
 
-    def get_token(self, tg_user_id):
+    @contextmanager
+    def turn(self, tg_user_id):
         """
-        Get a cancellation token for the user
+        Cancellation token of the user's turn, registered while the turn runs and disposed when it ends
         """
         key = str(tg_user_id)
-        if key not in self._cancellation_tokens:
-            self._cancellation_tokens[key] = CancellationToken()
-        return self._cancellation_tokens[key]
+        token = CancellationToken()
+        self._cancellation_tokens[key] = token
+        try:
+            yield token
+        finally:
+            if self._cancellation_tokens.get(key) is token:
+                del self._cancellation_tokens[key]
 
     def cancel(self, tg_user_id):
         """
@@ -51,7 +59,9 @@ class CancellationManager:
         key = str(tg_user_id)
         if key in self._cancellation_tokens:
             self._cancellation_tokens[key].cancel()
-            del self._cancellation_tokens[key]
+
+    def __len__(self):
+        return len(self._cancellation_tokens)
 
 
 def get_cancel_button():
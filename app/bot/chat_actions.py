@@ -0,0 +1,117 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager, suppress
+from typing import Dict, List, Optional
+
+from app.tasks import cancel_task
+
+logger = logging.getLogger(__name__)
+
+CHAT_ACTION_INTERVAL = 2  # Telegram shows an action for ~5 seconds
+CHAT_ACTION_TIMEOUT = 180
+
+
+class _ChatState:
+    def __init__(self):
+        self.actions: List[str] = []  # one per active reason, the latest one is shown
+        self.started = 0.0
+        self.next_send = 0.0
+
+
+class ChatActionService:
+    """
+    Shows chat actions ("typing", "record_voice", ...) while something is being done for a chat.
+    Every `active()` context is a reason to show an action: reasons of a chat are refcounted, the action of the
+    latest one is shown and a chat gets one sendChatAction per interval however many reasons it has.
+    A single task starts the due sends of all chats, it runs only while some chat has a reason. Every send is
+    a task of its own, a chat waiting for the rate limiter or flood control does not hold back the others.
+    A chat stops getting actions `timeout` seconds after its latest reason started.
+    """
+    ACTION_TYPING = 'typing'
+    ACTION_UPLOAD_PHOTO = 'upload_photo'
+    ACTION_UPLOAD_DOCUMENT = 'upload_document'
+    ACTION_RECORD_VOICE = 'record_voice'
+
+    def __init__(self, bot, interval: float = CHAT_ACTION_INTERVAL, timeout: float = CHAT_ACTION_TIMEOUT):
+        self.bot = bot
+        self.interval = interval
+        self.timeout = timeout
+        self._chats: Dict[int, _ChatState] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._sends: Dict[int, asyncio.Task] = {}  # by chat, a chat gets no new send while one is in flight
+
+    @asynccontextmanager
+    async def active(self, chat_id: int, action: str = ACTION_TYPING):
+        self._add_reason(chat_id, action)
+        try:
+            yield
+        finally:
+            self._remove_reason(chat_id, action)
+
+    def _add_reason(self, chat_id: int, action: str):
+        state = self._chats.get(chat_id)
+        if state is None:
+            state = self._chats[chat_id] = _ChatState()
+        now = asyncio.get_running_loop().time()
+        if not state.actions or state.actions[-1] != action:
+            # a new action is shown right away
+            state.next_send = now
+        state.actions.append(action)
+        state.started = now
+        self._wakeup.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def _remove_reason(self, chat_id: int, action: str):
+        state = self._chats[chat_id]
+        # the latest reason with this action, nested contexts exit in reverse order
+        del state.actions[len(state.actions) - 1 - state.actions[::-1].index(action)]
+        if not state.actions:
+            del self._chats[chat_id]
+            self._wakeup.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self._chats:
+                # reasons added while the actions are sent wake the next iteration
+                self._wakeup.clear()
+                now = loop.time()
+                due = []
+                next_send = None
+                for chat_id, state in self._chats.items():
+                    if now - state.started > self.timeout:
+                        continue
+                    if state.next_send <= now:
+                        state.next_send = now + self.interval
+                        due.append((chat_id, state.actions[-1]))
+                    next_send = state.next_send if next_send is None else min(next_send, state.next_send)
+                for chat_id, action in due:
+                    if chat_id not in self._sends:
+                        send = self._sends[chat_id] = asyncio.create_task(self._send(chat_id, action))
+                        send.add_done_callback(lambda _, chat_id=chat_id: self._sends.pop(chat_id, None))
+
+                timeout = None if next_send is None else max(next_send - loop.time(), 0)
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+        finally:
+            self._task = None
+
+    async def _send(self, chat_id: int, action: str):
+        try:
+            await self.bot.send_chat_action(chat_id, action)
+        except Exception as e:
+            # the indicator is best effort, the work it is shown for goes on
+            logger.warning('Failed to send chat action to %s: %s', chat_id, e)
+
+    def __len__(self):
+        return len(self._chats)
+
+    async def stop(self):
+        await cancel_task(self._task)
+        self._task = None
+        sends = list(self._sends.values())
+        for send in sends:
+            send.cancel()
+        await asyncio.gather(*sends, return_exceptions=True)
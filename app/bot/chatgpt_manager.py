@@ -1,7 +1,7 @@
-from typing import List, AsyncGenerator, Callable
+from typing import List, AsyncGenerator, Callable, Union
 
 from app.llm_models import get_model_by_name
-from app.openai_helpers.chatgpt import DialogMessage
+from app.openai_helpers.chatgpt import DialogMessage, StreamAccumulator
 from app.openai_helpers.utils import calculate_completion_usage_price
 from app.storage.db import DB, User
 
@@ -11,7 +11,7 @@ class ChatGptManager:
         self.chatgpt = chatgpt
         self.db: DB = db
 
-    async def send_user_message(self, user: User, messages: List[DialogMessage], is_cancelled: Callable[[], bool]) -> AsyncGenerator[DialogMessage, None]:
+    async def send_user_message(self, user: User, messages: List[DialogMessage], is_cancelled: Callable[[], bool]) -> AsyncGenerator[Union[DialogMessage, StreamAccumulator], None]:
         llm_model = get_model_by_name(user.current_model)
         if user.streaming_answers and llm_model.capabilities.streaming_responses:
             return self.send_user_message_streaming(user, messages, is_cancelled)
@@ -24,15 +24,18 @@ class ChatGptManager:
         await self.db.create_completion_usage(user.id, completion_usage.prompt_tokens, completion_usage.completion_tokens, completion_usage.total_tokens, completion_usage.model, price)
         yield dialog_message
 
-    async def send_user_message_streaming(self, user: User, messages: List[DialogMessage], is_cancelled: Callable[[], bool]) -> AsyncGenerator[DialogMessage, None]:
-        dialog_message = None
+    async def send_user_message_streaming(self, user: User, messages: List[DialogMessage], is_cancelled: Callable[[], bool]) -> AsyncGenerator[StreamAccumulator, None]:
+        """
+        Yields the same StreamAccumulator on every update, call snapshot() to get current DialogMessage
+        """
+        accumulator = None
         completion_usage = None
-        async for dialog_message, completion_usage in self.chatgpt.send_messages_streaming(messages, is_cancelled):
-            yield dialog_message
+        async for accumulator, completion_usage in self.chatgpt.send_messages_streaming(messages, is_cancelled):
+            yield accumulator
 
-        if dialog_message is None or completion_usage is None:
+        if accumulator is None or completion_usage is None:
             raise ValueError("Call to ChatGPT failed")
 
         price = calculate_completion_usage_price(completion_usage.prompt_tokens, completion_usage.completion_tokens, completion_usage.model)
         await self.db.create_completion_usage(user.id, completion_usage.prompt_tokens, completion_usage.completion_tokens, completion_usage.total_tokens, completion_usage.model, price)
-        yield dialog_message
+        yield accumulator
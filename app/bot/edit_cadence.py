@@ -0,0 +1,39 @@
+import time
+from typing import Callable, Optional
+
+import settings
+
+
+class EditCadence:
+    """
+    Decides when a streamed Telegram message is worth editing again.
+    The interval starts at `min_interval` and stretches with the length of the message (every `length_step`
+    characters add one more `min_interval`) and with the outbound pressure (calls waiting for the rate limiter,
+    every `pressure_step` of them doubles the interval), never beyond `max_interval`.
+    """
+    def __init__(self, pressure: Optional[Callable[[], int]] = None, min_interval: Optional[float] = None,
+                 max_interval: Optional[float] = None, length_step: Optional[int] = None,
+                 pressure_step: Optional[int] = None):
+        self.pressure = pressure
+        self.min_interval = settings.STREAMING_EDIT_MIN_INTERVAL if min_interval is None else min_interval
+        self.max_interval = settings.STREAMING_EDIT_MAX_INTERVAL if max_interval is None else max_interval
+        self.length_step = settings.STREAMING_EDIT_LENGTH_STEP if length_step is None else length_step
+        self.pressure_step = settings.STREAMING_EDIT_PRESSURE_STEP if pressure_step is None else pressure_step
+        self._last_time: Optional[float] = None
+
+    def interval(self, content_length: int) -> float:
+        interval = self.min_interval * (1 + content_length / self.length_step)
+        if self.pressure is not None:
+            interval *= 2 ** (self.pressure() / self.pressure_step)
+        return min(interval, self.max_interval)
+
+    def is_due(self, content_length: int) -> bool:
+        if self._last_time is None:
+            return True
+        return time.monotonic() - self._last_time >= self.interval(content_length)
+
+    def mark(self):
+        self._last_time = time.monotonic()
+
+    def reset(self):
+        self._last_time = None
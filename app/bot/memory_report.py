@@ -0,0 +1,48 @@
+import logging
+import os
+import resource
+from typing import Callable, Dict
+
+from app.tasks import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+
+def get_rss_kb() -> int:
+    """Resident set size of the process, peak RSS where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class MemoryReport:
+    """
+    Sizes of the long-lived in-process registries next to the process RSS, logged every interval seconds
+    once started. Every registry is expected to stay bounded, a size growing with uptime points at a leak.
+    """
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.registries: Dict[str, Callable[[], int]] = {}
+        self._reporting = PeriodicTask(self.report, interval)
+
+    def register(self, name: str, size: Callable[[], int]):
+        self.registries[name] = size
+
+    def collect(self) -> Dict[str, int]:
+        result = {'rss_kb': get_rss_kb()}
+        for name, size in self.registries.items():
+            result[name] = size()
+        return result
+
+    def report(self):
+        sizes = self.collect()
+        logger.info('Memory: %s', ', '.join(f'{name}={size}' for name, size in sizes.items()))
+
+    def start(self):
+        self._reporting.start()
+
+    async def stop(self):
+        await self._reporting.stop()
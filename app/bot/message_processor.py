@@ -1,3 +1,5 @@
+import datetime
+
 from app.bot.telegram_runtime_adapter import TelegramRuntimeAdapter
 from app.bot.telegram_side_effects import TelegramSideEffectHandler
 from app.bot.utils import message_is_forward
@@ -19,11 +21,14 @@ class MessageProcessor:
 
     def _build_session(self) -> ConversationSession:
         reply_to_id = None
+        reply_to_date = None
         if self.message.reply_to_message is not None:
             reply_to_id = self.message.reply_to_message.message_id
+            reply_to_date = self.message.reply_to_message.date.astimezone(datetime.timezone.utc)
         return ConversationSession(
             chat_id=self.message.chat.id,
             reply_to_message_id=reply_to_id,
+            reply_to_message_date=reply_to_date,
             is_forwarded=message_is_forward(self.message),
         )
 
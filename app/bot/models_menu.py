@@ -78,6 +78,8 @@ class ModelsMenu:
             await self.bot.answer_callback_query(callback_query.id)
         else:
             model_name = command
+            # always toggle the stored state, the cached user might be outdated
+            self.db.invalidate_user(callback_query.from_user.id)
             user = await self.db.get_or_create_user(callback_query.from_user.id)
             llm_model = get_model_by_name(model_name)
             user = self.set_model(user, llm_model)
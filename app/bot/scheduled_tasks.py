@@ -3,8 +3,12 @@ import datetime
 import pytz
 import logging
 
+from dateutil.relativedelta import relativedelta
+
 import settings
 from app.bot.utils import get_usage_response_all_users
+from app.storage.db import PARTITIONED_TABLES
+from app.tasks import cancel_task
 
 FAIL_LIMIT = 5
 WAIT_BETWEEN_RETRIES = 5
@@ -13,9 +17,10 @@ logger = logging.getLogger(__name__)
 
 
 class MonthlyTask:
-    def __init__(self, task, timezone='UTC'):
+    def __init__(self, task, timezone='UTC', run_on_start=False):
         self.timezone = pytz.timezone(timezone)
-        self.current_month = datetime.datetime.now(self.timezone).month
+        # without the current month the task is executed right after start
+        self.current_month = None if run_on_start else datetime.datetime.now(self.timezone).month
         self.task_function = task
         self.fail_counter = 0
         self.task = None
@@ -50,13 +55,8 @@ class MonthlyTask:
         self.task = asyncio.create_task(self._check_date_and_execute())
 
     async def stop(self):
-        if self.task is not None:
-            self.task.cancel()
-            try:
-                await self.task
-            except asyncio.CancelledError:
-                pass
-            self.task = None
+        await cancel_task(self.task)
+        self.task = None
 
 
 def build_monthly_usage_task(bot, db) -> MonthlyTask:
@@ -71,3 +71,28 @@ def build_monthly_usage_task(bot, db) -> MonthlyTask:
             settings.USER_ROLE_MANAGER_CHAT_ID, result
         )
     return MonthlyTask(get_monthly_usage)
+
+
+def build_partition_maintenance_task(db) -> MonthlyTask:
+    async def maintain_partitions():
+        current_month = datetime.datetime.now(pytz.UTC).date().replace(day=1)
+        months = [current_month + relativedelta(months=i) for i in range(settings.PARTITION_PREMAKE_MONTHS + 1)]
+        for table in PARTITIONED_TABLES:
+            await db.create_month_partitions(table, months)
+
+        for table in PARTITIONED_TABLES:
+            if table == 'message':
+                retention_months = settings.MESSAGE_RETENTION_MONTHS
+            else:
+                retention_months = settings.USAGE_RETENTION_MONTHS
+            if retention_months is None:
+                continue
+
+            oldest_kept_month = current_month - relativedelta(months=retention_months)
+            partitions = await db.get_month_partitions(table)
+            for month, partition in partitions.items():
+                if month >= oldest_kept_month:
+                    break
+                await db.remove_month_partition(table, partition, settings.PARTITION_RETENTION_ARCHIVE)
+                logger.info('Partition %s is %s', partition, 'archived' if settings.PARTITION_RETENTION_ARCHIVE else 'dropped')
+    return MonthlyTask(maintain_partitions, run_on_start=True)
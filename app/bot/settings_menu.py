@@ -152,6 +152,8 @@ class Settings:
             await self.bot.answer_callback_query(callback_query.id)
         else:
             setting = command
+            # always toggle the stored state, the cached user might be outdated
+            self.db.invalidate_user(callback_query.from_user.id)
             user = await self.db.get_or_create_user(callback_query.from_user.id)
             user = self.toggle_setting(user, setting)
             await self.db.update_user(user)
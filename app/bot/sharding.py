@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+from functools import partial
+from typing import List, Optional
+
+from aiogram import Bot, Dispatcher, types
+
+import settings
+from app.tasks import cancel_task
+
+logger = logging.getLogger(__name__)
+
+# updates of these kinds carry the user in 'from', callback queries include the Stop button of a streamed answer
+USER_UPDATE_FIELDS = (
+    'message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+    'shipping_query', 'pre_checkout_query', 'my_chat_member', 'chat_member', 'chat_join_request',
+)
+QUEUE_POLL_INTERVAL = 1  # seconds, how often a waiting worker checks for shutdown
+
+
+def get_update_user_id(update: types.Update) -> Optional[int]:
+    for field in USER_UPDATE_FIELDS:
+        event = getattr(update, field, None)
+        if event is not None and getattr(event, 'from_user', None) is not None:
+            return event.from_user.id
+    return None
+
+
+def get_shard(user_id: Optional[int], shards: int) -> int:
+    # updates without a user (channel posts, polls) go to the first worker
+    return user_id % shards if user_id is not None else 0
+
+
+class ShardingDispatcher(Dispatcher):
+    """
+    Dispatcher of the ingress process: every update received by polling or webhook is passed to the worker process
+    of its user instead of being handled here. A user's messages always reach the same worker in the order they were
+    received, so batching and turn order stay in one process. Callback queries, including the Stop button of a
+    streamed answer, go to the same worker through its control queue, which is not held back by running turns.
+    """
+    def __init__(self, bot: Bot, worker_queues: List[multiprocessing.Queue],
+                 control_queues: List[multiprocessing.Queue], **kwargs):
+        super().__init__(bot, **kwargs)
+        self.worker_queues = worker_queues
+        self.control_queues = control_queues
+        # updates waiting for room in a full queue keep their order
+        self._put_locks = [asyncio.Lock() for _ in worker_queues]
+
+    def _get_shard(self, update: types.Update) -> int:
+        return get_shard(get_update_user_id(update), len(self.worker_queues))
+
+    async def process_update(self, update: types.Update):
+        shard = self._get_shard(update)
+        data = update.to_python()
+        if update.callback_query is not None:
+            self.control_queues[shard].put_nowait(data)
+            return
+        # polling waits for room in a full queue, only users of that worker are held back
+        async with self._put_locks[shard]:
+            try:
+                self.worker_queues[shard].put_nowait(data)
+            except queue.Full:
+                await asyncio.get_running_loop().run_in_executor(None, self.worker_queues[shard].put, data)
+
+    def try_route(self, update: types.Update) -> bool:
+        """Queues the update without waiting, False if its worker's queue is full (the webhook answers 503)."""
+        shard = self._get_shard(update)
+        if update.callback_query is not None:
+            self.control_queues[shard].put_nowait(update.to_python())
+            return True
+        if self._put_locks[shard].locked():
+            return False
+        try:
+            self.worker_queues[shard].put_nowait(update.to_python())
+        except queue.Full:
+            return False
+        return True
+
+
+def _on_update_done(tasks: set, in_flight: asyncio.Semaphore, task: asyncio.Task):
+    tasks.discard(task)
+    in_flight.release()
+
+
+async def _consume_updates(dispatcher: Dispatcher, worker_queue: multiprocessing.Queue, stopping: asyncio.Event,
+                           max_in_flight: int):
+    loop = asyncio.get_running_loop()
+    tasks = set()
+    # a busy worker leaves updates in its bounded queue, so the ingress process sees it full
+    in_flight = asyncio.Semaphore(max_in_flight)
+    while not stopping.is_set():
+        await in_flight.acquire()
+        try:
+            data = await loop.run_in_executor(None, worker_queue.get, True, QUEUE_POLL_INTERVAL)
+        except queue.Empty:
+            in_flight.release()
+            continue
+        if data is None:
+            in_flight.release()
+            break
+        # tasks start in the order updates were received, like the updates of one polling batch
+        task = asyncio.create_task(dispatcher.updates_handler.notify(types.Update(**data)))
+        tasks.add(task)
+        task.add_done_callback(partial(_on_update_done, tasks, in_flight))
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _run_worker(shard: int, shards: int, worker_queue: multiprocessing.Queue,
+                      control_queue: multiprocessing.Queue):
+    # imported here, telegram_bot imports this module
+    from app.bot.telegram_bot import TelegramBot
+    from app.bot.telegram_rate_limiter import RateLimitedBot
+    from app.openai_helpers.utils import OpenAIAsync
+
+    # needed for whisper and tts capabilities
+    OpenAIAsync.init(settings.OPENAI_TOKEN, settings.OPENAI_BASE_URL)
+
+    # the global Bot API limit is shared by all workers
+    settings.TELEGRAM_GLOBAL_RATE_LIMIT = settings.TELEGRAM_GLOBAL_RATE_LIMIT / shards
+    bot = RateLimitedBot(token=settings.TELEGRAM_BOT_TOKEN)
+    dispatcher = Dispatcher(bot)
+    Dispatcher.set_current(dispatcher)
+    Bot.set_current(bot)
+    telegram_bot = TelegramBot(bot, dispatcher, primary=shard == 0)
+
+    # Ctrl+C reaches the whole process group, workers are stopped by the ingress process after queued updates
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stopping = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopping.set)
+
+    await telegram_bot.on_startup(dispatcher)
+    logger.info('Worker %d/%d started', shard + 1, shards)
+    try:
+        # callback queries are handled while turns hold every slot of the update queue, Stop cancels a running turn
+        await asyncio.gather(
+            _consume_updates(dispatcher, worker_queue, stopping, settings.BOT_WORKER_MAX_IN_FLIGHT_UPDATES),
+            _consume_updates(dispatcher, control_queue, stopping, settings.BOT_WORKER_MAX_IN_FLIGHT_UPDATES),
+        )
+    finally:
+        await telegram_bot.on_shutdown(dispatcher)
+        await (await bot.get_session()).close()
+        logger.info('Worker %d/%d stopped', shard + 1, shards)
+
+
+def run_worker(shard: int, shards: int, worker_queue: multiprocessing.Queue, control_queue: multiprocessing.Queue):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_run_worker(shard, shards, worker_queue, control_queue))
+
+
+class WorkerPool:
+    """Worker processes of the sharded mode, one bounded update queue and one control queue per worker."""
+    def __init__(self, shards: int, queue_size: int):
+        self._watch_task = None
+        context = multiprocessing.get_context('spawn')
+        self.queues = [context.Queue(queue_size) for _ in range(shards)]
+        # callback queries are few and handled quickly, their queues are not bounded
+        self.control_queues = [context.Queue() for _ in range(shards)]
+        self.processes = [
+            context.Process(
+                target=run_worker, args=(shard, shards, self.queues[shard], self.control_queues[shard]),
+                name=f'bot-worker-{shard}',
+            )
+            for shard in range(shards)
+        ]
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    def check_alive(self):
+        dead = [process.name for process in self.processes if not process.is_alive()]
+        if dead:
+            raise RuntimeError(f'Bot worker processes exited: {", ".join(dead)}')
+
+    async def _watch(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.check_alive()
+            except RuntimeError:
+                # a worker's users would get no answers, the bot is stopped as on Ctrl+C
+                logger.exception('Stopping the bot')
+                signal.raise_signal(signal.SIGINT)
+                return
+
+    def start_watching(self, interval: float):
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch(interval))
+
+    async def stop_watching(self):
+        await cancel_task(self._watch_task)
+        self._watch_task = None
+
+    def stop(self, timeout: float):
+        # workers finish the updates queued before the stop marker
+        for control_queue in self.control_queues:
+            control_queue.put(None)
+        for worker_queue in self.queues:
+            try:
+                worker_queue.put(None, timeout=timeout)
+            except queue.Full:
+                # a stuck worker is terminated below
+                pass
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning('Bot worker %s did not stop in %s seconds, terminating', process.name, timeout)
+                process.terminate()
@@ -1,5 +1,7 @@
 import os
+import asyncio
 import datetime
+import logging
 import tempfile
 
 from aiogram.utils.exceptions import BadRequest
@@ -8,25 +10,38 @@ from dateutil.relativedelta import relativedelta
 import settings
 from app.bot.batched_input_handler import BatchedInputHandler
 from app.bot.cancellation_manager import CancellationManager
+from app.bot.chat_actions import ChatActionService
+from app.bot.memory_report import MemoryReport
 from app.bot.models_menu import ModelsMenu
-from app.bot.scheduled_tasks import build_monthly_usage_task
+from app.bot.scheduled_tasks import build_monthly_usage_task, build_partition_maintenance_task
 from app.bot.settings_menu import Settings
+from app.bot.sharding import ShardingDispatcher, WorkerPool
+from app.bot.telegram_rate_limiter import RateLimitedBot
+from app.bot.turn_scheduler import TurnScheduler
 from app.bot.user_middleware import UserMiddleware
 from app.bot.user_role_manager import UserRoleManager
-from app.bot.utils import (get_hide_button, get_usage_response_all_users, TypingWorker)
-from app.bot.utils import send_telegram_message
-from app.openai_helpers.utils import (calculate_whisper_usage_price, OpenAIAsync,
-                                      calculate_image_generation_usage_price, calculate_tts_usage_price)
+from app.bot.webhook import BackpressureWebhookHandler, ReplicaRouter, build_webhook_app, WEBHOOK_BACKPRESSURE_KEY
+from app.bot.utils import get_hide_button, get_usage_response_all_users, calculate_monthly_usage_price
+from app.bot.utils import send_telegram_message, get_image_base64
+from app.openai_helpers.count_tokens import warm_up_encoders
+from app.openai_helpers.llm_client_factory import LLMClientFactory
+from app.openai_helpers.utils import OpenAIAsync, calculate_tts_usage_price
 from app.storage.db import DBFactory, User
+from app.storage.usage_type import UsageType
 from app.storage.user_role import check_access_conditions, UserRole
 
 from aiogram import types, Bot, Dispatcher
 from aiogram.utils import executor
 
+logger = logging.getLogger(__name__)
+
 
 class TelegramBot:
-    def __init__(self, bot: Bot, dispatcher: Dispatcher):
+    def __init__(self, bot: Bot, dispatcher: Dispatcher, primary: bool = True):
         self.db = None
+        # bot-wide tasks (monthly report, partitions, commands) are run by the primary instance only,
+        # by its first worker process in the sharded mode
+        self.primary = primary and settings.BOT_PRIMARY_INSTANCE
         self.bot = bot
         self.dispatcher = dispatcher
         self.dispatcher.register_message_handler(self.open_settings, commands=['settings'])
@@ -43,7 +58,13 @@ class TelegramBot:
         self.cancellation_manager = None
         self.role_manager = None
         self.monthly_usage_task = None
+        self.partition_maintenance_task = None
+        self.turn_scheduler = None
         self.batched_handler = None
+        self.memory_report = None
+        self.chat_actions = ChatActionService(bot)
+        self.webhook_backpressure = None  # set by run() in webhook mode
+        self.rate_limiter = bot.rate_limiter if isinstance(bot, RateLimitedBot) else None
 
     async def on_startup(self, _):
         self.db = await DBFactory.create_database(
@@ -56,27 +77,141 @@ class TelegramBot:
         self.role_manager = UserRoleManager(self.bot, self.dispatcher, self.db)
         self.dispatcher.middleware.setup(UserMiddleware(self.db))
 
-        self.monthly_usage_task = build_monthly_usage_task(self.bot, self.db)
-        self.monthly_usage_task.start()
-
-        self.batched_handler = BatchedInputHandler(self.bot, self.db, self.cancellation_manager)
+        # load tokenizers before the first request instead of during it
+        await asyncio.get_running_loop().run_in_executor(None, warm_up_encoders)
+        logger.info('Tokenizers are warmed up')
+
+        if self.primary:
+            self.monthly_usage_task = build_monthly_usage_task(self.bot, self.db)
+            self.monthly_usage_task.start()
+            self.partition_maintenance_task = build_partition_maintenance_task(self.db)
+            self.partition_maintenance_task.start()
+        self.db.usage_recorder.start()
+        self.db.pool_metrics.start()
+        if self.rate_limiter:
+            self.rate_limiter.start()
+
+        self.turn_scheduler = TurnScheduler(
+            settings.TURN_SCHEDULER_WORKERS, settings.TURN_SCHEDULER_ROLE_WEIGHTS, self.cancellation_manager,
+            settings.TURN_SCHEDULER_METRICS_INTERVAL,
+        )
+        self.turn_scheduler.start()
+        self.batched_handler = BatchedInputHandler(self.bot, self.db, self.turn_scheduler, self.chat_actions)
+        self.memory_report = self.build_memory_report()
+        self.memory_report.start()
         self.dispatcher.register_message_handler(self.batched_handler.handle, content_types=[
             types.ContentType.TEXT, types.ContentType.VIDEO, types.ContentType.PHOTO, types.ContentType.VOICE,
             types.ContentType.DOCUMENT, types.ContentType.AUDIO,
         ])
 
-        # all commands are added to global scope by default, except for admin commands
-        commands = self.role_manager.get_role_commands(UserRole.ADVANCED)
-        await self.bot.set_my_commands(commands)
+        if self.primary:
+            # all commands are added to global scope by default, except for admin commands
+            commands = self.role_manager.get_role_commands(UserRole.ADVANCED)
+            await self.bot.set_my_commands(commands)
+
+        if self.webhook_backpressure is not None:
+            await self.register_webhook()
 
     async def on_shutdown(self, _):
+        if self.webhook_backpressure is not None:
+            # accepted updates are handled before the services they use are stopped
+            await self.webhook_backpressure.wait_closed()
         if self.monthly_usage_task:
             await self.monthly_usage_task.stop()
+        if self.partition_maintenance_task:
+            await self.partition_maintenance_task.stop()
+        if self.turn_scheduler:
+            await self.turn_scheduler.stop()
+        if self.memory_report:
+            await self.memory_report.stop()
+        await self.chat_actions.stop()
+        if self.rate_limiter:
+            await self.rate_limiter.stop()
+        if self.db is not None:
+            # pending usage rows are written before the pool is closed
+            await self.db.usage_recorder.stop()
+            await self.db.pool_metrics.stop()
         await DBFactory().close_database()
         self.db = None
 
+    def build_memory_report(self) -> MemoryReport:
+        memory_report = MemoryReport(settings.MEMORY_REPORT_INTERVAL)
+        memory_report.register('user_cache', lambda: self.db.user_cache.stats()['size'])
+        memory_report.register('branch_cache', lambda: self.db.branch_cache.stats()['size'])
+        memory_report.register('pending_usage_rows', lambda: len(self.db.usage_recorder))
+        memory_report.register('batching_users', lambda: len(self.batched_handler.user_batches))
+        memory_report.register('scheduled_users', lambda: len(self.turn_scheduler))
+        memory_report.register('cancellation_tokens', lambda: len(self.cancellation_manager))
+        memory_report.register('chat_action_chats', lambda: len(self.chat_actions))
+        memory_report.register('llm_clients', lambda: len(LLMClientFactory._model_clients))
+        memory_report.register('image_base64_cache', lambda: get_image_base64.cache_info().currsize)
+        if self.rate_limiter:
+            memory_report.register('rate_limited_chats', lambda: len(self.rate_limiter))
+        if self.webhook_backpressure is not None:
+            memory_report.register('webhook_updates_in_flight', lambda: self.webhook_backpressure.in_flight)
+        return memory_report
+
     def run(self):
-        executor.start_polling(self.dispatcher, on_startup=self.on_startup, on_shutdown=self.on_shutdown)
+        if settings.BOT_WORKER_PROCESSES > 1:
+            self.run_sharded()
+        else:
+            self.run_transport(self.dispatcher, self.on_startup, self.on_shutdown)
+
+    def run_transport(self, dispatcher: Dispatcher, on_startup, on_shutdown):
+        if settings.TELEGRAM_TRANSPORT == 'webhook':
+            self.run_webhook(dispatcher, on_startup, on_shutdown)
+        elif settings.TELEGRAM_TRANSPORT == 'polling':
+            executor.start_polling(dispatcher, on_startup=on_startup, on_shutdown=on_shutdown)
+        else:
+            raise ValueError(f'Unknown TELEGRAM_TRANSPORT: {settings.TELEGRAM_TRANSPORT}')
+
+    def run_webhook(self, dispatcher: Dispatcher, on_startup, on_shutdown):
+        replica_router = None
+        if len(settings.WEBHOOK_REPLICA_URLS) > 1:
+            replica_router = ReplicaRouter(
+                settings.WEBHOOK_REPLICA_URLS, settings.WEBHOOK_REPLICA_INDEX, settings.BOT_WORKER_PROCESSES,
+                settings.WEBHOOK_REPLICA_FORWARD_TIMEOUT,
+            )
+        web_app = build_webhook_app(
+            settings.WEBHOOK_MAX_IN_FLIGHT_UPDATES, settings.WEBHOOK_RETRY_AFTER, settings.WEBHOOK_SECRET_TOKEN,
+            replica_router,
+        )
+        self.webhook_backpressure = web_app[WEBHOOK_BACKPRESSURE_KEY]
+        webhook_executor = executor.Executor(dispatcher)
+        webhook_executor.on_startup(on_startup, polling=False)
+        webhook_executor.on_shutdown(on_shutdown, polling=False)
+        webhook_executor.set_webhook(settings.WEBHOOK_PATH, request_handler=BackpressureWebhookHandler, web_app=web_app)
+        webhook_executor.run_app(host=settings.WEBHOOK_HOST, port=settings.WEBHOOK_PORT)
+
+    async def register_webhook(self):
+        if settings.WEBHOOK_URL:
+            # every replica registers the same URL of the load balancer
+            await self.bot.set_webhook(
+                f'{settings.WEBHOOK_URL}{settings.WEBHOOK_PATH}', max_connections=settings.WEBHOOK_MAX_CONNECTIONS,
+                secret_token=settings.WEBHOOK_SECRET_TOKEN or None,
+            )
+
+    def run_sharded(self):
+        """
+        This process only receives updates (polling or webhook) and passes them to BOT_WORKER_PROCESSES workers
+        by user id, every worker runs its own TelegramBot with its own DB pool.
+        """
+        worker_pool = WorkerPool(settings.BOT_WORKER_PROCESSES, settings.BOT_WORKER_QUEUE_SIZE)
+        ingress = ShardingDispatcher(self.bot, worker_pool.queues, worker_pool.control_queues)
+
+        async def on_startup(_):
+            worker_pool.start()
+            worker_pool.start_watching(settings.BOT_WORKER_CHECK_INTERVAL)
+            if self.webhook_backpressure is not None:
+                await self.register_webhook()
+
+        async def on_shutdown(_):
+            await worker_pool.stop_watching()
+            if self.webhook_backpressure is not None:
+                await self.webhook_backpressure.wait_closed()
+            await asyncio.get_running_loop().run_in_executor(None, worker_pool.stop, settings.BOT_WORKER_STOP_TIMEOUT)
+
+        self.run_transport(ingress, on_startup, on_shutdown)
 
     async def process_hide_callback(self, callback_query: types.CallbackQuery):
         await self.bot.delete_message(
@@ -95,30 +230,19 @@ class TelegramBot:
         total = 0
         result = []
 
-        completion_usages = await self.db.get_user_current_month_completion_usage(user.id)
-        for usage in completion_usages:
-            total += usage.price
-            result.append(f'*{usage.model}:* {usage.prompt_tokens} prompt, {usage.completion_tokens} completion, ${usage.price}')
-
-        whisper_usage = await self.db.get_user_current_month_whisper_usage(user.id)
-        whisper_price = calculate_whisper_usage_price(whisper_usage)
-        total += whisper_price
-        if whisper_price:
-            result.append(f'*Speech2Text:* {whisper_usage} seconds, ${whisper_price}')
-
-        image_generation_usage = await self.db.get_user_current_month_image_generation_usage(user.id)
-        for usage in image_generation_usage:
-            price = calculate_image_generation_usage_price(
-                usage['model'], usage['resolution'], usage['usage_count']
-            )
-            total += price
-            result.append(f'*{usage["model"]}:* {usage["usage_count"]} images, {usage["resolution"]} resolution, ${price}')
-
-        tts_usages = await self.db.get_user_current_month_tts_usage(user.id)
-        for tts_usage in tts_usages:
-            price = calculate_tts_usage_price(tts_usage['characters_count'], tts_usage['model'])
+        usages = await self.db.get_user_current_month_usage(user.id)
+        for usage in usages:
+            price = calculate_monthly_usage_price(usage)
             total += price
-            result.append(f'*{tts_usage["model"]}:* {tts_usage["characters_count"]} characters, ${price}')
+            if usage.usage_type == UsageType.COMPLETION:
+                result.append(f'*{usage.model}:* {usage.prompt_tokens} prompt, {usage.completion_tokens} completion, ${price}')
+            elif usage.usage_type == UsageType.WHISPER:
+                if price:
+                    result.append(f'*Speech2Text:* {usage.audio_seconds} seconds, ${price}')
+            elif usage.usage_type == UsageType.IMAGE_GENERATION:
+                result.append(f'*{usage.model}:* {usage.usage_count} images, {usage.resolution} resolution, ${price}')
+            elif usage.usage_type == UsageType.TTS:
+                result.append(f'*{usage.model}:* {usage.characters_count} characters, ${price}')
 
         result.append(f'*Total:* ${total}')
         await send_telegram_message(
@@ -167,16 +291,23 @@ class TelegramBot:
         chat_id = message.chat.id
 
         if message.reply_to_message:
-            db_message = await self.db.get_telegram_message(chat_id, message.reply_to_message.message_id)
+            db_message = await self.db.get_telegram_message(
+                chat_id, message.reply_to_message.message_id,
+                message.reply_to_message.date.astimezone(datetime.timezone.utc),
+            )
         else:
-            db_message = await self.db.get_last_message(user.id, chat_id)
+            # the last message of the current dialog
+            since = datetime.datetime.now(settings.POSTGRES_TIMEZONE) - datetime.timedelta(
+                seconds=settings.MESSAGE_EXPIRATION_WINDOW
+            )
+            db_message = await self.db.get_last_message(user.id, chat_id, since)
 
         if not db_message:
             await message.answer('No text to generate speech')
             return
 
         text = db_message.message.get_text_content()
-        async with TypingWorker(self.bot, message.chat.id, TypingWorker.ACTION_RECORD_VOICE).typing_context():
+        async with self.chat_actions.active(message.chat.id, ChatActionService.ACTION_RECORD_VOICE):
             # TODO: decide if tts-1-hd is needed in user settings
             model = 'tts-1'
             response = await OpenAIAsync.instance().audio.speech.create(
@@ -0,0 +1,253 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+
+from aiogram import Bot
+from aiogram.utils.exceptions import RetryAfter
+
+import settings
+from app.tasks import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+# only the latest call matters for these: a newer edit of the same message or chat action in the same chat
+# replaces the one still waiting for its turn
+COALESCED_METHODS = {
+    'editMessageText': ('chat_id', 'message_id'),
+    'sendChatAction': ('chat_id',),
+}
+# not counted against the per-chat limit, they are not messages
+CHAT_UNLIMITED_METHODS = {'sendChatAction'}
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = None
+
+    def _refill(self, now: float):
+        if self.updated is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def full_at(self, now: float) -> float:
+        self._refill(now)
+        return now + (self.capacity - self.tokens) / self.rate
+
+
+class _Call:
+    def __init__(self, send: Callable[[], Awaitable], key: Optional[tuple]):
+        self.send = send
+        self.key = key
+        self.waiters = 0
+        self.task: Optional[asyncio.Task] = None
+
+
+class _Chat:
+    def __init__(self, bucket: _TokenBucket):
+        self.bucket = bucket
+        self.lock = asyncio.Lock()
+        self.users = 0
+        self.blocked_until = 0.0
+        self.discard_handle = None
+
+
+class TelegramRateLimiter:
+    """
+    Outbound scheduler of Bot API calls addressed to a chat: one global and one per-chat token bucket,
+    calls of a chat are sent one at a time in the order they were made.
+    A waiting edit of a message or chat action is replaced by a newer one, the callers of the replaced call
+    get the result of the call that replaced it. RetryAfter blocks the chat for the given time and the call
+    is retried up to max_retries times. Calls without chat_id (getUpdates, getMe, ...) are not limited.
+    A call is sent by a task of the limiter, it is cancelled only when every caller waiting for it is cancelled.
+    """
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float, max_retries: int,
+                 metrics_interval: float = 0):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.metrics_interval = metrics_interval
+        self._global_bucket = _TokenBucket(global_rate, global_rate)
+        self._chats: Dict[object, _Chat] = {}
+        self._pending: Dict[tuple, _Call] = {}
+        self._metrics_reporting = PeriodicTask(self.report, metrics_interval)
+        self.queued = 0
+        self.reset_metrics()
+
+    async def call(self, method: str, data: Optional[dict], send: Callable[[], Awaitable]):
+        chat_id = data.get('chat_id') if data else None
+        if chat_id is None:
+            return await send()
+
+        key = self._coalesce_key(method, data)
+        call = self._pending.get(key) if key is not None else None
+        if call is not None:
+            call.send = send
+            self.superseded_count += 1
+        else:
+            call = _Call(send, key)
+            if key is not None:
+                self._pending[key] = call
+            chat = self._acquire_chat(chat_id)
+            call.task = asyncio.create_task(self._run(chat_id, chat, method not in CHAT_UNLIMITED_METHODS, call))
+        return await self._wait(call)
+
+    async def _wait(self, call: _Call):
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # nobody needs the result anymore, a newer caller must not join the cancelled call
+                self._forget(call)
+                call.task.cancel()
+
+    async def _run(self, chat_id, chat: _Chat, chat_limited: bool, call: _Call):
+        loop = asyncio.get_running_loop()
+        submitted = loop.time()
+        self.queued += 1
+        try:
+            async with chat.lock:
+                await self._wait_turn(chat, chat_limited)
+                self._record_wait(loop.time() - submitted)
+                return await self._send(chat, chat_limited, call)
+        finally:
+            self.queued -= 1
+            self._forget(call)
+            self._release_chat(chat_id, chat)
+
+    def _forget(self, call: _Call):
+        if call.key is not None and self._pending.get(call.key) is call:
+            del self._pending[call.key]
+
+    @staticmethod
+    def _coalesce_key(method: str, data: dict) -> Optional[tuple]:
+        fields = COALESCED_METHODS.get(method)
+        if fields is None or any(data.get(field) is None for field in fields):
+            return None
+        return (method, *(data[field] for field in fields))
+
+    async def _wait_turn(self, chat: _Chat, chat_limited: bool):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            delay = max(chat.blocked_until - now, self._global_bucket.delay(now))
+            if chat_limited:
+                delay = max(delay, chat.bucket.delay(now))
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        self._global_bucket.take(now)
+        if chat_limited:
+            chat.bucket.take(now)
+
+    async def _send(self, chat: _Chat, chat_limited: bool, call: _Call):
+        attempt = 0
+        while True:
+            # from here on a newer call with the same key is sent after this one
+            self._forget(call)
+            try:
+                result = await call.send()
+            except RetryAfter as e:
+                self.retry_after_count += 1
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                logger.warning('Telegram flood control, retry %d in %s seconds', attempt, e.timeout)
+                chat.blocked_until = asyncio.get_running_loop().time() + e.timeout
+                await self._wait_turn(chat, chat_limited)
+                continue
+            self.sent_count += 1
+            return result
+
+    def _acquire_chat(self, chat_id) -> _Chat:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(_TokenBucket(self.chat_rate, self.chat_burst))
+        if chat.discard_handle is not None:
+            chat.discard_handle.cancel()
+            chat.discard_handle = None
+        chat.users += 1
+        return chat
+
+    def _release_chat(self, chat_id, chat: _Chat):
+        chat.users -= 1
+        if chat.users == 0:
+            # the chat is forgotten once forgetting it can not let a burst above the limit through
+            loop = asyncio.get_running_loop()
+            discard_at = max(chat.bucket.full_at(loop.time()), chat.blocked_until)
+            chat.discard_handle = loop.call_at(discard_at, self._discard_chat, chat_id, chat)
+
+    def _discard_chat(self, chat_id, chat: _Chat):
+        if chat.users == 0 and self._chats.get(chat_id) is chat:
+            del self._chats[chat_id]
+
+    def __len__(self):
+        return len(self._chats)
+
+    def _record_wait(self, wait: float):
+        self.started_count += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+    def stats(self) -> dict:
+        return {
+            'queued': self.queued,
+            'chats': len(self._chats),
+            'sent_count': self.sent_count,
+            'superseded_count': self.superseded_count,
+            'retry_after_count': self.retry_after_count,
+            'wait_avg': self.wait_total / self.started_count if self.started_count else 0.0,
+            'wait_max': self.wait_max,
+        }
+
+    def reset_metrics(self):
+        self.sent_count = 0
+        self.superseded_count = 0
+        self.retry_after_count = 0
+        self.started_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def report(self):
+        stats = self.stats()
+        logger.info(
+            'Telegram API: %d queued in %d chats, %d sent, %d superseded, %d retry after, '
+            'wait avg %.1f ms, max %.1f ms',
+            stats['queued'], stats['chats'], stats['sent_count'], stats['superseded_count'],
+            stats['retry_after_count'], stats['wait_avg'] * 1000, stats['wait_max'] * 1000,
+        )
+        self.reset_metrics()
+
+    def start(self):
+        self._metrics_reporting.start()
+
+    async def stop(self):
+        await self._metrics_reporting.stop()
+
+
+class RateLimitedBot(Bot):
+    """aiogram Bot sending every Bot API request through a TelegramRateLimiter configured from settings."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rate_limiter = TelegramRateLimiter(
+            settings.TELEGRAM_GLOBAL_RATE_LIMIT, settings.TELEGRAM_CHAT_RATE_LIMIT,
+            settings.TELEGRAM_CHAT_BURST, settings.TELEGRAM_RETRY_AFTER_MAX_RETRIES,
+            settings.TELEGRAM_RATE_LIMITER_METRICS_INTERVAL,
+        )
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        async def send():
+            return await super(RateLimitedBot, self).request(method, data, files, **kwargs)
+        return await self.rate_limiter.call(method, data, send)
@@ -1,11 +1,12 @@
 from contextlib import suppress
-from datetime import datetime
-from typing import Callable
+from typing import Callable, List
 
 from aiogram.types import Message, ParseMode, InlineKeyboardMarkup
-from aiogram.utils.exceptions import BadRequest
+from aiogram.utils.exceptions import BadRequest, MessageNotModified
 
 from app.bot.cancellation_manager import get_cancel_button
+from app.bot.edit_cadence import EditCadence
+from app.bot.telegram_rate_limiter import RateLimitedBot
 from app.bot.utils import send_telegram_message, edit_telegram_message
 from app.context.context_manager import ContextManager
 from app.runtime.conversation_session import ConversationSession
@@ -17,7 +18,6 @@ from app.runtime.runtime import LLMRuntime
 from app.runtime.user_input import UserInput
 from app.storage.db import User
 
-WAIT_BETWEEN_MESSAGE_UPDATES = 1
 TELEGRAM_MESSAGE_LENGTH_CUTOFF = 4080
 THINKING_EMOJI = '\U0001f9e0'
 THINKING_MAX_CHARS = 300
@@ -57,12 +57,12 @@ class TelegramRuntimeAdapter:
         session: ConversationSession,
         is_cancelled: Callable[[], bool],
     ):
-        message_id = None
-        chat_id = None
+        # messages of the answer streamed in this round, a long answer continues in new messages
+        message_ids = []
+        chat_id = self.message.chat.id
         previous_content = None
-        previous_time = None
-        message_too_long_for_telegram = False
         was_thinking = False
+        cadence = self._build_edit_cadence()
 
         keyboard = InlineKeyboardMarkup()
         keyboard.add(get_cancel_button())
@@ -71,76 +71,81 @@ class TelegramRuntimeAdapter:
 
         async for event in runtime.process_turn(user_input, session, is_cancelled):
             if isinstance(event, StreamingContentDelta):
-                if message_too_long_for_telegram:
-                    continue
-
                 if event.is_thinking:
                     was_thinking = True
                     thinking_display = _format_thinking_display(event.thinking_text)
-                    if not message_id:
+                    if not message_ids:
                         resp = await send_telegram_message(self.message, thinking_display, reply_markup=keyboard)
-                        chat_id = self.message.chat.id
                         await self.message.bot.send_chat_action(chat_id, 'typing')
-                        message_id = resp.message_id
+                        message_ids.append(resp.message_id)
                         previous_content = thinking_display
-                        previous_time = datetime.now()
+                        cadence.mark()
                         continue
 
-                    time_passed_seconds = (datetime.now() - previous_time).seconds
-                    if previous_content != thinking_display and time_passed_seconds >= WAIT_BETWEEN_MESSAGE_UPDATES:
-                        await self.message.bot.edit_message_text(thinking_display, chat_id, message_id, reply_markup=keyboard)
+                    if previous_content != thinking_display and cadence.is_due(len(thinking_display)):
+                        await self.message.bot.edit_message_text(thinking_display, chat_id, message_ids[-1], reply_markup=keyboard)
                         previous_content = thinking_display
-                        previous_time = datetime.now()
+                        cadence.mark()
                     continue
 
                 # Transition from thinking to normal content
                 if was_thinking:
                     was_thinking = False
-                    previous_time = None
+                    cadence.reset()
 
                 new_content = ' '.join(event.visible_text.strip().split(' ')[:-1]) if event.visible_text else ''
                 if len(new_content) < 50:
                     continue
 
-                if not message_id:
-                    resp = await send_telegram_message(self.message, new_content, reply_markup=keyboard)
-                    chat_id = self.message.chat.id
-                    await self.message.bot.send_chat_action(chat_id, 'typing')
-                    message_id = resp.message_id
-                    previous_content = new_content
-                    previous_time = datetime.now()
+                parts = self._split_text(new_content)
+                if len(parts) > len(message_ids):
+                    if message_ids:
+                        # the filled message gets its final text and loses the cancel button,
+                        # its last edit may already have exactly this text
+                        with suppress(MessageNotModified):
+                            await self.message.bot.edit_message_text(parts[len(message_ids) - 1], chat_id, message_ids[-1])
+                    for part in parts[len(message_ids):]:
+                        is_last_part = len(message_ids) == len(parts) - 1
+                        resp = await send_telegram_message(self.message, part, reply_markup=keyboard if is_last_part else None)
+                        message_ids.append(resp.message_id)
+                    if len(message_ids) == 1:
+                        await self.message.bot.send_chat_action(chat_id, 'typing')
+                    previous_content = parts[-1]
+                    cadence.mark()
                     continue
 
-                time_passed_seconds = (datetime.now() - previous_time).seconds if previous_time else WAIT_BETWEEN_MESSAGE_UPDATES
-                if previous_content != new_content and time_passed_seconds >= WAIT_BETWEEN_MESSAGE_UPDATES:
-                    if len(new_content) > TELEGRAM_MESSAGE_LENGTH_CUTOFF:
-                        message_too_long_for_telegram = True
-                        new_content = f'{new_content[:TELEGRAM_MESSAGE_LENGTH_CUTOFF]} \u23f3...'
-                    await self.message.bot.edit_message_text(new_content, chat_id, message_id, reply_markup=keyboard)
-                    previous_content = new_content
-                    previous_time = datetime.now()
+                current_content = parts[-1]
+                if previous_content != current_content and cadence.is_due(len(current_content)):
+                    await self.message.bot.edit_message_text(current_content, chat_id, message_ids[-1], reply_markup=keyboard)
+                    previous_content = current_content
+                    cadence.mark()
 
             elif isinstance(event, FinalResponse):
                 final_dialog_message = event.dialog_message
                 if final_dialog_message and final_dialog_message.content:
                     dialog_messages = self._split_dialog_message(final_dialog_message)
-                    for dm in dialog_messages:
+                    for index, dm in enumerate(dialog_messages):
                         parse_mode = ParseMode.MARKDOWN
-                        if message_id is not None:
-                            response = await edit_telegram_message(self.message, dm.content, message_id, parse_mode)
-                            message_id = None
+                        if index < len(message_ids):
+                            response_message_id = message_ids[index]
+                            # a continuation part may already have exactly this text
+                            with suppress(MessageNotModified):
+                                await edit_telegram_message(self.message, dm.content, response_message_id, parse_mode)
                         else:
                             response = await send_telegram_message(self.message, dm.content, parse_mode)
+                            response_message_id = response.message_id
                         # Save content message to context with real Telegram message_id
                         if event.needs_context_save:
-                            await self.context_manager.add_message(dm, response.message_id)
+                            await self.context_manager.add_message(dm, response_message_id)
+                    for extra_message_id in message_ids[len(dialog_messages):]:
+                        with suppress(BadRequest):
+                            await self.message.bot.delete_message(chat_id, extra_message_id)
 
                 # Reset streaming state for next round (after tool calls)
-                message_id = None
-                message_too_long_for_telegram = False
+                message_ids = []
                 was_thinking = False
                 previous_content = None
-                previous_time = None
+                cadence.reset()
 
             elif isinstance(event, FunctionCallCompleted):
                 if self.user.function_call_verbose:
@@ -149,11 +154,25 @@ class TelegramRuntimeAdapter:
                         function_response_text = function_response_text[:TELEGRAM_MESSAGE_LENGTH_CUTOFF]
                         await send_telegram_message(self.message, function_response_text)
 
+    def _build_edit_cadence(self) -> EditCadence:
+        bot = self.message.bot
+        if isinstance(bot, RateLimitedBot):
+            return EditCadence(lambda: bot.rate_limiter.queued)
+        return EditCadence()
+
+    @classmethod
+    def _split_dialog_message(cls, dialog_message, max_content_length=TELEGRAM_MESSAGE_LENGTH_CUTOFF):
+        parts = cls._split_text(dialog_message.content, max_content_length)
+        if len(parts) == 1:
+            return [dialog_message]
+        return [dialog_message.copy(update={"content": part}) for part in parts]
+
     @staticmethod
-    def _split_dialog_message(dialog_message, max_content_length=TELEGRAM_MESSAGE_LENGTH_CUTOFF):
-        content = dialog_message.content
+    def _split_text(content: str, max_content_length=TELEGRAM_MESSAGE_LENGTH_CUTOFF) -> List[str]:
+        """Splits at the last line break, dot or space before the limit, the parts of a prefix do not change
+        as the text grows, so streamed messages keep the parts the final answer is split into."""
         if len(content) <= max_content_length:
-            return [dialog_message]
+            return [content]
 
         parts = []
         while len(content) > max_content_length:
@@ -168,4 +187,4 @@ class TelegramRuntimeAdapter:
                 parts.append(content[:last_space_index])
                 content = content[last_space_index + 1:]
         parts.append(content)
-        return [dialog_message.copy(update={"content": part}) for part in parts]
+        return parts
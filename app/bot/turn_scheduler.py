@@ -0,0 +1,153 @@
+import asyncio
+import heapq
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional
+
+from app.bot.cancellation_manager import CancellationManager, CancellationToken
+from app.storage.user_role import UserRole
+from app.tasks import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+
+class _Job:
+    def __init__(self, run: Callable[[CancellationToken], Awaitable], cancellation_key, future: asyncio.Future):
+        self.run = run
+        self.cancellation_key = cancellation_key
+        self.future = future
+        self.submitted = time.monotonic()
+
+
+class _UserQueue:
+    def __init__(self, weight: float):
+        self.weight = weight
+        self.jobs = deque()
+        self.finish_tag = 0.0
+        self.running = False
+
+
+class TurnScheduler:
+    """
+    Runs users' turns (input batches) on a bounded number of workers.
+    Turns of one user run one at a time in the order they were submitted. Users waiting for a worker are served
+    by self-clocked weighted fair queuing: every turn advances the user's finish tag by 1 / weight of the user role,
+    and the user with the smallest tag is served next, so a user with weight 2 gets twice the turns of a user
+    with weight 1 while both have turns pending.
+    Every turn gets its own cancellation token from the cancellation manager, disposed when the turn ends.
+    """
+    def __init__(self, workers: int, role_weights: Dict[UserRole, float], cancellation_manager: CancellationManager,
+                 metrics_interval: float = 0):
+        self.workers = workers
+        self.cancellation_manager = cancellation_manager
+        self.role_weights = role_weights
+        self.metrics_interval = metrics_interval
+        self._users: Dict[int, _UserQueue] = {}
+        self._ready = []  # heap of (finish_tag, sequence, user_id) of users waiting for a worker
+        self._sequence = 0
+        self._virtual_time = 0.0
+        self._running = 0
+        self._tasks = set()
+        self._metrics_reporting = PeriodicTask(self.report, metrics_interval)
+        self.reset_metrics()
+
+    async def run(self, user_id: int, role: Optional[UserRole], cancellation_key,
+                  turn: Callable[[CancellationToken], Awaitable]):
+        """
+        Schedules the turn and waits for its result, exceptions of the turn are raised here.
+        The turn is called with the token cancelled by cancellation_manager.cancel(cancellation_key).
+        """
+        future = asyncio.get_running_loop().create_future()
+        user_queue = self._users.get(user_id)
+        if user_queue is None:
+            user_queue = self._users[user_id] = _UserQueue(self.role_weights.get(role, 1))
+        user_queue.jobs.append(_Job(turn, cancellation_key, future))
+        if len(user_queue.jobs) == 1 and not user_queue.running:
+            self._make_ready(user_id, user_queue)
+        self._dispatch()
+        return await future
+
+    def _make_ready(self, user_id: int, user_queue: _UserQueue):
+        user_queue.finish_tag = max(self._virtual_time, user_queue.finish_tag) + 1 / user_queue.weight
+        self._sequence += 1
+        heapq.heappush(self._ready, (user_queue.finish_tag, self._sequence, user_id))
+
+    def _dispatch(self):
+        while self._running < self.workers and self._ready:
+            finish_tag, _, user_id = heapq.heappop(self._ready)
+            self._virtual_time = finish_tag
+            user_queue = self._users[user_id]
+            job = user_queue.jobs.popleft()
+            user_queue.running = True
+            self._running += 1
+
+            wait = time.monotonic() - job.submitted
+            self.started_count += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+            task = asyncio.create_task(self._run_job(user_id, user_queue, job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_job(self, user_id: int, user_queue: _UserQueue, job: _Job):
+        try:
+            if job.future.cancelled():
+                # the submitter stopped waiting before the turn started
+                return
+            with self.cancellation_manager.turn(job.cancellation_key) as is_cancelled:
+                result = await job.run(is_cancelled)
+        except BaseException as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._running -= 1
+            user_queue.running = False
+            if user_queue.jobs:
+                self._make_ready(user_id, user_queue)
+            else:
+                del self._users[user_id]
+            self._dispatch()
+
+    def __len__(self):
+        return len(self._users)
+
+    def queue_depth(self) -> int:
+        return sum(len(user_queue.jobs) for user_queue in self._users.values())
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'running': self._running,
+            'waiting_users': len(self._ready),
+            'queue_depth': self.queue_depth(),
+            'started_count': self.started_count,
+            'wait_avg': self.wait_total / self.started_count if self.started_count else 0.0,
+            'wait_max': self.wait_max,
+        }
+
+    def reset_metrics(self):
+        self.started_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def report(self):
+        stats = self.stats()
+        logger.info(
+            'Turns: %d/%d running, %d queued for %d users, %d started, wait avg %.1f ms, max %.1f ms',
+            stats['running'], stats['workers'], stats['queue_depth'], stats['waiting_users'],
+            stats['started_count'], stats['wait_avg'] * 1000, stats['wait_max'] * 1000,
+        )
+        self.reset_metrics()
+
+    def start(self):
+        self._metrics_reporting.start()
+
+    async def stop(self):
+        await self._metrics_reporting.stop()
@@ -100,6 +100,7 @@ class UserRoleManager:
     async def setrole_callback(self, callback_query: types.CallbackQuery):
         command, tg_user_id, role_value = callback_query.data.split('.')
         tg_user_id = int(tg_user_id)
+        self.db.invalidate_user(tg_user_id)
         user = await self.db.get_user(tg_user_id)
         user_had_access = check_access_conditions(settings.USER_ROLE_BOT_ACCESS, user.role)
         user.role = UserRole(role_value)
@@ -113,6 +114,7 @@ class UserRoleManager:
     async def updaterole_callback(self, callback_query: types.CallbackQuery):
         command, tg_user_id = callback_query.data.split('.')
         tg_user_id = int(tg_user_id)
+        self.db.invalidate_user(tg_user_id)
         user = await self.db.get_user(tg_user_id)
         await self.bot.answer_callback_query(callback_query.id)
         await self.update_message(callback_query.message, user)
@@ -3,9 +3,9 @@ import dataclasses
 import re
 import asyncio
 from datetime import date
+from decimal import Decimal
 from functools import lru_cache
 from typing import List
-from contextlib import asynccontextmanager
 
 import httpx
 import requests
@@ -16,73 +16,41 @@ from async_lru import alru_cache
 import settings
 from app.openai_helpers.utils import (calculate_whisper_usage_price,
                                       calculate_image_generation_usage_price, calculate_tts_usage_price)
-
-TYPING_TIMEOUT = 180
-TYPING_DELAY = 2
-TYPING_QUERIES_LIMIT = TYPING_TIMEOUT // TYPING_DELAY
-
-
-class TypingWorker:
-    ACTION_TYPING = 'typing'
-    ACTION_UPLOAD_PHOTO = 'upload_photo'
-    ACTION_UPLOAD_DOCUMENT = 'upload_document'
-    ACTION_RECORD_VOICE = 'record_voice'
-
-    def __init__(self, bot, chat_id, action='typing'):
-        self.bot = bot
-        self.chat_id = chat_id
-        self.action = action
-        self.typing_task = None
-        self.typing_queries_count = 0
-
-    @asynccontextmanager
-    async def typing_context(self):
-        try:
-            await self.start_typing()
-            yield
-        finally:
-            await self.stop_typing()
-
-    async def start_typing(self):
-        async def typing_worker():
-            while self.typing_queries_count < TYPING_QUERIES_LIMIT:
-                await self.bot.send_chat_action(self.chat_id, self.action)
-                await asyncio.sleep(TYPING_DELAY)
-                self.typing_queries_count += 1
-
-        self.typing_task = asyncio.create_task(typing_worker())
-        return self
-
-    async def stop_typing(self):
-        if self.typing_task is None:
-            return
-
-        self.typing_task.cancel()
-        try:
-            await self.typing_task
-        except asyncio.CancelledError:
-            pass
-        self.typing_task = None
+from app.storage.usage_type import UsageType
 
 
 class Timer:
     """
-    Async timer with reset method
+    Async debounce timer: sleep returns once timeout seconds passed since the last reset.
+    Reset only moves the deadline, the single scheduled loop callback is rescheduled when it fires too early,
+    so a window costs one wakeup plus one per reset instead of polling.
     """
     def __init__(self, timeout=0.3):
         self.timeout = timeout
-        self._current_timeout = timeout
-        self.step = timeout / 100
+        self._deadline = None
+        self._handle = None
+        self._expired = None
 
     async def sleep(self):
-        while True:
-            await asyncio.sleep(self.step)
-            self._current_timeout -= self.step
-            if self._current_timeout <= 0:
-                break
+        loop = asyncio.get_running_loop()
+        if self._deadline is None:
+            self.reset()
+        self._expired = loop.create_future()
+        self._handle = loop.call_at(self._deadline, self._on_deadline)
+        try:
+            await self._expired
+        finally:
+            self._handle.cancel()
 
     def reset(self):
-        self._current_timeout = self.timeout
+        self._deadline = asyncio.get_running_loop().time() + self.timeout
+
+    def _on_deadline(self):
+        loop = self._expired.get_loop()
+        if loop.time() < self._deadline:
+            self._handle = loop.call_at(self._deadline, self._on_deadline)
+        elif not self._expired.done():
+            self._expired.set_result(None)
 
 
 @dataclasses.dataclass
@@ -162,52 +130,24 @@ async def send_photo(message: types.Message, photo_bytes, caption=None, reply_ma
     return await send_message(photo_bytes, caption=caption, reply_markup=reply_markup)
 
 
-def merge_dicts(dict_1, dict_2):
-    """
-    This function merge two dicts containing strings using plus operator on each key
-    """
-    result = dict_1.copy()
-    for key, value in dict_2.items():
-        if isinstance(value, str):
-            if not key in result:
-                result[key] = "" if value is not None else None
-            if value is not None:
-                result[key] += value
-        elif isinstance(value, dict):
-            if not key in result:
-                result[key] = {} if value is not None else None
-            if isinstance(result[key], dict):
-                result[key] = merge_dicts(result[key], value)
-        else:
-            continue
-
-    return result
+def calculate_monthly_usage_price(usage) -> Decimal:
+    # completions are billed with the stored price, other usage with the current price lists
+    if usage.usage_type == UsageType.COMPLETION:
+        return usage.price
+    if usage.usage_type == UsageType.WHISPER:
+        return calculate_whisper_usage_price(usage.audio_seconds)
+    if usage.usage_type == UsageType.IMAGE_GENERATION:
+        return calculate_image_generation_usage_price(usage.model, usage.resolution, usage.usage_count)
+    if usage.usage_type == UsageType.TTS:
+        return calculate_tts_usage_price(usage.characters_count, usage.model)
+    raise ValueError(f'Unknown usage type: {usage.usage_type}')
 
 
 async def get_usage_response_all_users(db, month_date: date = None) -> str:
-    completion_usages = await db.get_all_users_completion_usage(month_date)
-    whisper_usages = await db.get_all_users_whisper_usage(month_date)
-    image_generation_usages = await db.get_all_users_image_generation_usage(month_date)
-    tts_usages = await db.get_all_users_tts_usage(month_date)
+    usages = await db.get_all_users_usage(month_date)
     result = []
-    # TODO: this will work incorrectly if user never used chat completion but used other features
-    for name, user_completion_usages in completion_usages.items():
-        user_usage_price = 0
-
-        for usage in user_completion_usages:
-            user_usage_price += usage.price
-
-        for usage in image_generation_usages.get(name, []):
-            user_usage_price += calculate_image_generation_usage_price(
-                usage['model'], usage['resolution'], usage['usage_count']
-            )
-
-        for usage in tts_usages.get(name, []):
-            user_usage_price += calculate_tts_usage_price(usage['characters_count'], usage['model'])
-
-        user_whisper_usage = whisper_usages.get(name, 0)
-        user_usage_price += calculate_whisper_usage_price(user_whisper_usage)
-
+    for name, user_usages in usages.items():
+        user_usage_price = sum(calculate_monthly_usage_price(usage) for usage in user_usages)
         result.append((name, user_usage_price))
     result.sort(key=lambda x: x[1], reverse=True)
     total_price = sum([price for _, price in result])
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+from functools import partial
+from typing import List, Optional
+
+import aiohttp
+from aiogram import types
+from aiogram.dispatcher.webhook import WebhookRequestHandler
+from aiohttp import web
+
+from app.bot.sharding import ShardingDispatcher, get_shard, get_update_user_id
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_BACKPRESSURE_KEY = 'WEBHOOK_BACKPRESSURE'
+WEBHOOK_REPLICA_ROUTER_KEY = 'WEBHOOK_REPLICA_ROUTER'
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+# set on updates forwarded by another replica, they are handled where they arrive
+FORWARDED_HEADER = 'X-Bot-Forwarded-By-Replica'
+
+
+class WebhookBackpressure:
+    """
+    Bound of updates accepted by one replica and not handled yet. Updates over the bound are refused with 503,
+    Telegram delivers them again later, so a load balancer can pass them to a less busy replica.
+    Callback queries are not counted and never refused, the Stop button has to reach the turn it cancels.
+    """
+    def __init__(self, max_in_flight: int, retry_after: int, secret_token: str = ''):
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.secret_token = secret_token
+        self.in_flight = 0
+        self.accepted_count = 0
+        self.rejected_count = 0
+        self._tasks = set()
+
+    def is_full(self) -> bool:
+        return self.in_flight >= self.max_in_flight
+
+    def reject(self) -> web.Response:
+        self.rejected_count += 1
+        return web.Response(status=503, headers={'Retry-After': str(self.retry_after)})
+
+    def track(self, task: asyncio.Task, counted: bool = True):
+        if counted:
+            self.in_flight += 1
+        self.accepted_count += 1
+        self._tasks.add(task)
+        task.add_done_callback(partial(self._on_done, counted))
+
+    def _on_done(self, counted: bool, task: asyncio.Task):
+        if counted:
+            self.in_flight -= 1
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Webhook update failed', exc_info=task.exception())
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': self.in_flight,
+            'max_in_flight': self.max_in_flight,
+            'accepted_count': self.accepted_count,
+            'rejected_count': self.rejected_count,
+        }
+
+    async def wait_closed(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+class ReplicaRouter:
+    """
+    Keeps all updates of a user in one replica: a replica is chosen by user id from the webhook endpoints of all
+    replicas, an update of another replica's user is forwarded to it and its answer (200, 503) is passed on.
+    Worker processes of a replica are chosen by user_id % workers, replicas by user_id // workers, so every
+    worker of every replica gets users.
+    """
+    def __init__(self, replica_urls: List[str], replica_index: int, workers: int = 1, timeout: float = 5):
+        self.replica_urls = replica_urls
+        self.replica_index = replica_index
+        self.workers = workers
+        self.timeout = timeout
+        self.forwarded_count = 0
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def get_owner_url(self, update: types.Update) -> Optional[str]:
+        user_id = get_update_user_id(update)
+        replica = get_shard(user_id // self.workers if user_id is not None else None, len(self.replica_urls))
+        return None if replica == self.replica_index else self.replica_urls[replica]
+
+    async def forward(self, url: str, body: bytes, secret_token: str, retry_after: int) -> web.Response:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        headers = {'Content-Type': 'application/json', FORWARDED_HEADER: str(self.replica_index)}
+        if secret_token:
+            headers[SECRET_TOKEN_HEADER] = secret_token
+        try:
+            async with self._session.post(url, data=body, headers=headers) as response:
+                response_body = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Telegram delivers the update again later
+            logger.warning('Failed to forward update to replica %s: %s', url, e)
+            return web.Response(status=503, headers={'Retry-After': str(retry_after)})
+        self.forwarded_count += 1
+        # 503 of a busy owner replica is passed on, so Telegram retries the update
+        headers = {'Retry-After': response.headers['Retry-After']} if 'Retry-After' in response.headers else None
+        return web.Response(status=response.status, body=response_body, headers=headers)
+
+    async def close(self, _=None):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class BackpressureWebhookHandler(WebhookRequestHandler):
+    """
+    Webhook endpoint answering as soon as the update is accepted: the update is handled in a background task
+    counted by the WebhookBackpressure of the app, instead of holding the Telegram connection for the whole turn.
+    """
+    async def post(self):
+        self.validate_ip()
+        backpressure: WebhookBackpressure = self.request.app[WEBHOOK_BACKPRESSURE_KEY]
+        if backpressure.secret_token and \
+                self.request.headers.get(SECRET_TOKEN_HEADER) != backpressure.secret_token:
+            raise web.HTTPForbidden()
+
+        dispatcher = self.get_dispatcher()
+        update = await self.parse_update(dispatcher.bot)
+        router: Optional[ReplicaRouter] = self.request.app.get(WEBHOOK_REPLICA_ROUTER_KEY)
+        if router is not None and FORWARDED_HEADER not in self.request.headers:
+            owner_url = router.get_owner_url(update)
+            if owner_url is not None:
+                return await router.forward(
+                    owner_url, await self.request.read(), backpressure.secret_token, backpressure.retry_after,
+                )
+
+        if isinstance(dispatcher, ShardingDispatcher):
+            # the ingress of the sharded mode only queues the update, a worker with a full queue refuses it
+            if not dispatcher.try_route(update):
+                return backpressure.reject()
+            backpressure.accepted_count += 1
+            return web.Response(text='ok')
+
+        counted = update.callback_query is None
+        if counted and backpressure.is_full():
+            return backpressure.reject()
+
+        backpressure.track(asyncio.create_task(self.handle_update(dispatcher, update)), counted)
+        return web.Response(text='ok')
+
+    @staticmethod
+    async def handle_update(dispatcher, update: types.Update):
+        await dispatcher.updates_handler.notify(update)
+
+
+def build_webhook_app(max_in_flight: int, retry_after: int, secret_token: str = '',
+                      replica_router: Optional[ReplicaRouter] = None) -> web.Application:
+    app = web.Application()
+    app[WEBHOOK_BACKPRESSURE_KEY] = WebhookBackpressure(max_in_flight, retry_after, secret_token)
+    if replica_router is not None:
+        app[WEBHOOK_REPLICA_ROUTER_KEY] = replica_router
+        app.on_cleanup.append(replica_router.close)
+    return app
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 import settings
 from app.context.dialog_manager import DialogManager
@@ -36,6 +36,10 @@ class ContextManager:
         dialog_messages = await self.dialog_manager.add_message_to_dialog(dialog_message, tg_message_id, message_type)
         return dialog_messages
 
+    async def add_messages(self, messages: List[Tuple[DialogMessage, int, MessageType]]) -> List[DialogMessage]:
+        dialog_messages = await self.dialog_manager.add_messages_to_dialog(messages)
+        return dialog_messages
+
     async def get_system_prompt(self):
         gpt_mode = settings.gpt_mode.get(self.user.gpt_mode)
         if not gpt_mode:
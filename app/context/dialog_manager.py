@@ -1,10 +1,14 @@
 import datetime
-from typing import List, Optional, Union
+from bisect import bisect_left
+from itertools import accumulate
+from typing import Dict, List, Optional, Union, Tuple
 
 import settings
 from app.runtime.conversation_session import ConversationSession
 from app.openai_helpers.chatgpt import DialogMessage, summarize_messages, DialogMessageContentPart
-from app.openai_helpers.count_tokens import count_dialog_messages_tokens
+from app.openai_helpers.count_tokens import (count_stored_messages_tokens, get_stored_message_tokens,
+                                            build_message_tokens_count, get_encoder_family,
+                                            REPLY_PRIMING_TOKENS)
 from app.openai_helpers.utils import calculate_completion_usage_price
 from app.storage.db import User, DB, Message, MessageType
 
@@ -22,11 +26,14 @@ class DialogManager:
 
         if session.reply_to_message_id is not None and not session.is_forwarded:
             is_reply = True
-            db_message = await self.db.get_telegram_message(self.chat_id, session.reply_to_message_id)
+            db_message = await self.db.get_telegram_message(
+                self.chat_id, session.reply_to_message_id, session.reply_to_message_date,
+            )
         else:
             is_reply = False
-            db_message = await self.db.get_last_message(self.user.id, self.chat_id)
             message_expiration_dtime = datetime.datetime.now(settings.POSTGRES_TIMEZONE) - datetime.timedelta(seconds=settings.MESSAGE_EXPIRATION_WINDOW)
+            # the dialog is continued from messages created in the window only
+            db_message = await self.db.get_last_message(self.user.id, self.chat_id, message_expiration_dtime)
             if db_message is not None and db_message.activation_dtime < message_expiration_dtime:
                 # last message is too old, starting new dialog
                 db_message = None
@@ -35,28 +42,28 @@ class DialogManager:
             self.messages = []
             return []
 
-        dialog_messages = await self.db.get_messages_by_ids(db_message.previous_message_ids)
-        dialog_messages.append(db_message)
+        dialog_messages = await self.db.get_message_branch(db_message)
 
         if is_reply:
             # if it's a reply, we need to update activation time of dialog messages to be included in context next time
-            await self.db.update_activation_dtime([m.id for m in dialog_messages])
+            await self.db.update_activation_dtime(dialog_messages)
 
         self.messages = await self.summarize_messages_if_needed(dialog_messages)
         return self.get_dialog_messages()
 
     def split_context_by_token_length(self, messages: List[Message]):
         token_length = self.context_configuration.short_term_memory_tokens / 2
-        for split_point in range(len(messages)):
-            right_dialog_messages = (d.message for d in messages[split_point:])
-            right_length = count_dialog_messages_tokens(right_dialog_messages, self.user.current_model)
-            if right_length <= token_length:
-                return messages[:split_point], messages[split_point:]
-        else:
+        messages_tokens = [get_stored_message_tokens(m, self.user.current_model) for m in messages]
+        # suffix_tokens[i] is a token count of messages[i:], it is non-increasing, so the first
+        # split point with right part fitting into token_length can be found with binary search
+        suffix_tokens = list(accumulate(reversed(messages_tokens), initial=REPLY_PRIMING_TOKENS))[::-1]
+        split_point = bisect_left(range(len(messages)), True, key=lambda i: suffix_tokens[i] <= token_length)
+        if split_point == len(messages):
             return messages, []
+        return messages[:split_point], messages[split_point:]
 
     async def summarize_messages_if_needed(self, messages: List[Message]):
-        message_tokens_count = count_dialog_messages_tokens((m.message for m in messages), self.user.current_model)
+        message_tokens_count = count_stored_messages_tokens(messages, self.user.current_model)
         if message_tokens_count > self.context_configuration.hard_max_context_size:
             # this is safety measure, we should never get here
             # if hard limit is exceeded, the context is too big to summarize or to process
@@ -64,12 +71,12 @@ class DialogManager:
 
         if self.user.auto_summarize and message_tokens_count >= self.context_configuration.short_term_memory_tokens:
             to_summarize, to_process = self.split_context_by_token_length(messages)
-            summarized_message = await self.summarize_messages(to_summarize)
+            summarized_message = await self.summarize_messages(to_summarize, to_process)
             return [summarized_message] + to_process
         else:
             return messages
 
-    async def summarize_messages(self, messages: List[Message]):
+    async def summarize_messages(self, messages: List[Message], next_messages: List[Message]):
         summarized, completion_usage = await summarize_messages(
             [m.message for m in messages], self.user.current_model, self.context_configuration.summary_length
         )
@@ -80,21 +87,52 @@ class DialogManager:
         )
 
         summarized_message = DialogUtils.prepare_user_message(f"Summarized previous conversation:\n{summarized}")
-        tg_message_id = -1
-        message = await self.db.create_message(
-            self.user.id, self.chat_id, tg_message_id, summarized_message, [], MessageType.SUMMARY
+        tokens_count = build_message_tokens_count(summarized_message, self.user.current_model)
+        # summary replaces ancestors of the first message kept after it
+        last_covered_message_id = next_messages[0].parent_id if next_messages else messages[-1].id
+        message = await self.db.create_summary_message(
+            self.user.id, self.chat_id, summarized_message, last_covered_message_id, tokens_count
         )
         return message
 
     async def add_message_to_dialog(self, message: DialogMessage, tg_message_id: id,
                                     message_type: MessageType = MessageType.MESSAGE) -> List[DialogMessage]:
+        tokens_count = build_message_tokens_count(message, self.user.current_model)
         message = await self.db.create_message(
-            self.user.id, self.chat_id, tg_message_id, message, self.messages, message_type
+            self.user.id, self.chat_id, tg_message_id, message, self.messages, message_type, tokens_count
         )
         self.messages.append(message)
         self.messages = await self.summarize_messages_if_needed(self.messages)
         return self.get_dialog_messages()
 
+    async def add_messages_to_dialog(self, messages: List[Tuple[DialogMessage, int, MessageType]]) -> List[DialogMessage]:
+        """
+        Adds (message, tg_message_id, message_type) items with one insert per chunk. A chunk ends where adding
+        the items one by one would trigger summarization, so a large batch never exceeds the hard limit.
+        """
+        encoder_family = get_encoder_family(self.user.current_model)
+        items = [
+            (tg_message_id, message, message_type, build_message_tokens_count(message, self.user.current_model))
+            for message, tg_message_id, message_type in messages
+        ]
+        chunk = []
+        context_tokens = count_stored_messages_tokens(self.messages, self.user.current_model)
+        for item in items:
+            chunk.append(item)
+            context_tokens += item[3][encoder_family]
+            if self.user.auto_summarize and context_tokens >= self.context_configuration.short_term_memory_tokens:
+                await self._add_messages_chunk(chunk)
+                chunk = []
+                context_tokens = count_stored_messages_tokens(self.messages, self.user.current_model)
+        if chunk:
+            await self._add_messages_chunk(chunk)
+        return self.get_dialog_messages()
+
+    async def _add_messages_chunk(self, items: List[Tuple[int, DialogMessage, MessageType, Dict[str, int]]]):
+        created_messages = await self.db.create_messages(self.user.id, self.chat_id, items, self.messages)
+        self.messages.extend(created_messages)
+        self.messages = await self.summarize_messages_if_needed(self.messages)
+
     def get_dialog_messages(self) -> List[DialogMessage]:
         if self.messages is None:
             raise ValueError('You must call process_dialog first')
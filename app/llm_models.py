@@ -1,6 +1,7 @@
 import dataclasses
 from decimal import Decimal
 from functools import lru_cache
+from typing import Callable, Sequence
 
 import settings
 from app.openai_helpers.llm_client import (GenericAsyncOpenAIClient, OpenAISpecificAsyncOpenAIClient,
@@ -35,6 +36,13 @@ class LLMCapabilities:
     image_input_format: str = 'url'  # 'url' or 'base64'
 
 
+@dataclasses.dataclass(frozen=True)
+class LLMTokenizer:
+    # encoder family name, token counts stored with messages are keyed by it
+    name: str
+    encode: Callable[[str], Sequence]
+
+
 class LLModel:
     GPT_35_TURBO = 'gpt-3.5-turbo'
     GPT_41 = 'gpt-4.1'
@@ -42,7 +50,7 @@ class LLModel:
     OPENROUTER_WIZARDLM2 = 'microsoft/wizardlm-2-8x22b'
 
     def __init__(self, *, model_name: str, api_key, context_configuration, model_readable_name=None, model_price=None, base_url=None,
-                 capabilities=None, minimum_user_role=UserRole.STRANGER, api_client=None):
+                 capabilities=None, minimum_user_role=UserRole.STRANGER, api_client=None, tokenizer=None):
         if model_readable_name is None:
             model_readable_name = model_name
 
@@ -64,6 +72,8 @@ class LLModel:
         self.capabilities = capabilities
         self.minimum_user_role = minimum_user_role
         self.api_client = api_client
+        # tiktoken encoding name or LLMTokenizer, if not set tokenizer is guessed by model name
+        self.tokenizer = tokenizer
 
 
 @lru_cache
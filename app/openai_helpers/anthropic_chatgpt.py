@@ -4,8 +4,8 @@ from typing import List, Any, Optional, Callable, Union
 import pydantic
 
 import settings
-from app.bot.utils import get_image_base64, merge_dicts
-from app.openai_helpers.chatgpt import DialogMessage, CompletionUsage, FunctionCall, ToolCall
+from app.bot.utils import get_image_base64
+from app.openai_helpers.chatgpt import DialogMessage, CompletionUsage, FunctionCall, ToolCall, StreamAccumulator
 from app.openai_helpers.function_storage import FunctionStorage
 
 from app.openai_helpers.llm_client_factory import LLMClientFactory
@@ -120,7 +120,7 @@ class AnthropicChatGPT:
 
         return anthropic_dialog_message.to_dialog_message(), completion_usage
 
-    async def send_messages_streaming(self, messages_to_send: List[DialogMessage], is_cancelled: Callable[[], bool]) -> (DialogMessage, CompletionUsage):
+    async def send_messages_streaming(self, messages_to_send: List[DialogMessage], is_cancelled: Callable[[], bool]) -> (StreamAccumulator, CompletionUsage):
         additional_fields = self.create_additional_fields()
 
         messages = await self.create_context(messages_to_send, self.system_prompt)
@@ -131,38 +131,40 @@ class AnthropicChatGPT:
             stream=True,
             **additional_fields,
         )
-        result_dict = {}
-        usage_dict = {}
+        accumulator = StreamAccumulator()
+        completion_usage = None
+        tool_use_inputs = {}
         async for resp_part in resp_generator:
             if resp_part.type == 'message_start':
-                if resp_part.message.usage is not None:
-                    usage_dict = {
-                        'model': self.llm_model.model_name,
-                        'prompt_tokens': resp_part.message.usage.input_tokens,
-                        'completion_tokens': resp_part.message.usage.output_tokens,
-                        'total_tokens': resp_part.message.usage.input_tokens + resp_part.message.usage.output_tokens,
-                    }
-
-                message = resp_part.message
-                result_dict = merge_dicts(result_dict, message.dict())
-                if result_dict.get('content') is None:
-                    result_dict['content'] = []
+                usage = resp_part.message.usage
+                if usage is not None:
+                    completion_usage = CompletionUsage(
+                        model=self.llm_model.model_name,
+                        prompt_tokens=usage.input_tokens,
+                        completion_tokens=usage.output_tokens,
+                        total_tokens=usage.input_tokens + usage.output_tokens,
+                    )
             elif resp_part.type == 'content_block_start':
-                while resp_part.index >= len(result_dict['content']):
-                    result_dict['content'].append({})
-                result_dict['content'][resp_part.index] = merge_dicts(result_dict['content'][resp_part.index], resp_part.content_block.dict())
+                content_block = resp_part.content_block
+                if content_block.type == 'text':
+                    accumulator.add_content(content_block.text, resp_part.index)
+                elif content_block.type == 'tool_use':
+                    accumulator.add_tool_call(resp_part.index, content_block.id, content_block.name)
+                    tool_use_inputs[resp_part.index] = content_block.input
             elif resp_part.type == 'content_block_delta':
-                delta_dict = resp_part.delta.dict()
-                del delta_dict['type']
-                result_dict['content'][resp_part.index] = merge_dicts(result_dict['content'][resp_part.index], delta_dict)
+                delta = resp_part.delta
+                if delta.type == 'text_delta':
+                    accumulator.add_content(delta.text, resp_part.index)
+                elif delta.type == 'input_json_delta':
+                    accumulator.add_tool_call(resp_part.index, arguments=delta.partial_json)
             elif resp_part.type == 'content_block_stop':
-                partial_json = result_dict['content'][resp_part.index].get('partial_json')
-                if partial_json:
-                    result_dict['content'][resp_part.index]['input'] = json.loads(partial_json)
+                if resp_part.index in tool_use_inputs and not accumulator.has_tool_call_arguments(resp_part.index):
+                    # tool without streamed input, use input from block start
+                    accumulator.add_tool_call(resp_part.index, arguments=json.dumps(tool_use_inputs[resp_part.index]))
             elif resp_part.type == 'message_delta':
                 if resp_part.usage is not None and hasattr(resp_part.usage, 'output_tokens'):
-                    usage_dict['completion_tokens'] = resp_part.usage.output_tokens
-                    usage_dict['total_tokens'] = usage_dict['prompt_tokens'] + usage_dict['completion_tokens']
+                    completion_usage.completion_tokens = resp_part.usage.output_tokens
+                    completion_usage.total_tokens = completion_usage.prompt_tokens + completion_usage.completion_tokens
             elif resp_part.type == 'end_turn':
                 pass
             elif resp_part.type == 'message_stop':
@@ -172,9 +174,7 @@ class AnthropicChatGPT:
             else:
                 raise NotImplementedError
 
-            dialog_message = AnthropicDialogMessage(**result_dict)
-            completion_usage = CompletionUsage(**usage_dict)
-            yield dialog_message.to_dialog_message(), completion_usage
+            yield accumulator, completion_usage
 
     def create_additional_fields(self):
         additional_fields = {}
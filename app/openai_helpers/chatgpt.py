@@ -1,12 +1,11 @@
-import json
 import re
 from contextlib import suppress
 from decimal import Decimal
-from typing import List, Any, Optional, Callable, Union
+from typing import List, Any, Optional, Callable, Union, Dict
 
 import settings
-from app.bot.utils import merge_dicts, get_image_base64
-from app.openai_helpers.count_tokens import count_messages_tokens, count_tokens_from_functions, count_string_tokens
+from app.bot.utils import get_image_base64
+from app.openai_helpers.count_tokens import count_messages_tokens, count_tokens_from_functions, StreamingTokenCounter
 from app.openai_helpers.function_storage import FunctionStorage
 
 import pydantic
@@ -132,6 +131,86 @@ def _find_think_close(content: str) -> tuple:
     return best, best_len
 
 
+def _partial_tag_length(text: str, tags: tuple) -> int:
+    """Length of the longest suffix of text which is a beginning of one of tags (but not the whole tag)."""
+    max_length = min(len(text), max(len(tag) for tag in tags) - 1)
+    for length in range(max_length, 0, -1):
+        suffix = text[-length:]
+        if any(tag.startswith(suffix) for tag in tags):
+            return length
+    return 0
+
+
+class ThinkingParser:
+    """
+    Incremental parser of <think>/<thinking> tags: feed() consumes only new text, tags split between chunks
+    are kept in a short pending tail until they can be decided. Only the first thinking block is extracted,
+    the same way parse_thinking does.
+    """
+    _BEFORE, _THINKING, _DONE = range(3)
+
+    def __init__(self):
+        self._state = self._BEFORE
+        self._visible_parts: List[str] = []
+        self._thinking_parts: List[str] = []
+        self._after_parts: List[str] = []
+        self._pending = ''
+        self._result: Optional[tuple] = None
+
+    @property
+    def is_thinking(self) -> bool:
+        return self._state == self._THINKING
+
+    def feed(self, text: str):
+        if not text:
+            return
+        self._result = None
+        if self._state == self._DONE:
+            self._after_parts.append(text)
+            return
+
+        text = self._pending + text
+        self._pending = ''
+        if self._state == self._BEFORE:
+            open_idx, open_len = _find_think_open(text)
+            if open_idx == -1:
+                self._hold_partial_tag(text, self._visible_parts, _THINK_OPEN_TAGS)
+                return
+            self._visible_parts.append(text[:open_idx])
+            self._state = self._THINKING
+            text = text[open_idx + open_len:]
+
+        close_idx, close_len = _find_think_close(text)
+        if close_idx == -1:
+            self._hold_partial_tag(text, self._thinking_parts, _THINK_CLOSE_TAGS)
+            return
+        self._thinking_parts.append(text[:close_idx])
+        self._after_parts.append(text[close_idx + close_len:])
+        self._state = self._DONE
+
+    def _hold_partial_tag(self, text: str, parts: List[str], tags: tuple):
+        partial_length = _partial_tag_length(text, tags)
+        if partial_length:
+            self._pending = text[-partial_length:]
+            text = text[:-partial_length]
+        parts.append(text)
+
+    def result(self) -> tuple:
+        """Returns: (visible_content, thinking_text, is_thinking)"""
+        if self._result is not None:
+            return self._result
+
+        visible = ''.join(self._visible_parts)
+        if self._state == self._BEFORE:
+            self._result = visible + self._pending, '', False
+        elif self._state == self._THINKING:
+            self._result = visible, ''.join(self._thinking_parts) + self._pending, True
+        else:
+            visible += ''.join(self._after_parts)
+            self._result = visible.strip(), ''.join(self._thinking_parts), False
+        return self._result
+
+
 def parse_thinking(content: str) -> tuple:
     """
     Parse <think>/<thinking> tags in accumulated content.
@@ -140,21 +219,99 @@ def parse_thinking(content: str) -> tuple:
     if not content:
         return '', '', False
 
-    open_idx, open_len = _find_think_open(content)
-    if open_idx == -1:
-        return content, '', False
+    parser = ThinkingParser()
+    parser.feed(content)
+    return parser.result()
 
-    close_idx, close_len = _find_think_close(content)
-    if close_idx == -1:
-        # Tag opened but not closed — model is still thinking
-        thinking_text = content[open_idx + open_len:]
-        visible = content[:open_idx]
-        return visible, thinking_text, True
 
-    # Tag closed — thinking is complete
-    thinking_text = content[open_idx + open_len:close_idx]
-    visible = content[:open_idx] + content[close_idx + close_len:]
-    return visible.strip(), thinking_text, False
+class StreamAccumulator:
+    """
+    Accumulates streamed response parts as lists of fragments: per content block, for legacy function call
+    and per tool call index. Adding a part costs O(part) regardless of the answer length, DialogMessage is
+    materialized only when snapshot() is called and is reused until the next part is added.
+    """
+    def __init__(self, role: str = 'assistant'):
+        self.role = role
+        self._content_blocks: Dict[int, List[str]] = {}
+        self._function_call: Optional[Dict[str, List[str]]] = None
+        self._tool_calls: Dict[int, Dict[str, Any]] = {}
+        self._snapshot: Optional[DialogMessage] = None
+        self.content_length = 0
+        # content blocks are streamed one after another, so thinking tags are parsed in arrival order
+        self.thinking_parser = ThinkingParser()
+
+    def add_content(self, text: Optional[str], block_index: int = 0):
+        if not text:
+            return
+        self._content_blocks.setdefault(block_index, []).append(text)
+        self.content_length += len(text)
+        self.thinking_parser.feed(text)
+        self._snapshot = None
+
+    def add_function_call(self, name: Optional[str] = None, arguments: Optional[str] = None):
+        if self._function_call is None:
+            self._function_call = {'name': [], 'arguments': []}
+        if name:
+            self._function_call['name'].append(name)
+        if arguments:
+            self._function_call['arguments'].append(arguments)
+        self._snapshot = None
+
+    def add_tool_call(self, index: int, tool_call_id: Optional[str] = None, name: Optional[str] = None,
+                      arguments: Optional[str] = None):
+        if index not in self._tool_calls:
+            self._tool_calls[index] = {'id': '', 'name': [], 'arguments': []}
+        tool_call = self._tool_calls[index]
+        if tool_call_id:
+            tool_call['id'] = tool_call_id
+        if name:
+            tool_call['name'].append(name)
+        if arguments:
+            tool_call['arguments'].append(arguments)
+        self._snapshot = None
+
+    def has_function_calls(self) -> bool:
+        return self._function_call is not None or bool(self._tool_calls)
+
+    def has_tool_call_arguments(self, index: int) -> bool:
+        return bool(self._tool_calls.get(index, {}).get('arguments'))
+
+    def get_content(self) -> Optional[str]:
+        if not self._content_blocks:
+            return None
+        return ''.join(''.join(self._content_blocks[i]) for i in sorted(self._content_blocks))
+
+    def snapshot(self) -> DialogMessage:
+        if self._snapshot is not None:
+            return self._snapshot
+
+        content = self.get_content()
+        function_call = None
+        if self._function_call is not None:
+            function_call = FunctionCall.model_construct(
+                name=''.join(self._function_call['name']),
+                arguments=''.join(self._function_call['arguments']),
+            )
+        tool_calls = None
+        if self._tool_calls:
+            tool_calls = [
+                ToolCall.model_construct(
+                    id=self._tool_calls[i]['id'],
+                    type='function',
+                    function=FunctionCall.model_construct(
+                        name=''.join(self._tool_calls[i]['name']),
+                        arguments=''.join(self._tool_calls[i]['arguments']),
+                    ),
+                )
+                for i in sorted(self._tool_calls)
+            ]
+        _, thinking, _ = self.thinking_parser.result()
+        # parts are already validated by the API client, so validation is skipped
+        self._snapshot = DialogMessage.model_construct(
+            role=self.role, content=content, function_call=function_call, tool_calls=tool_calls,
+            thinking=thinking or None,
+        )
+        return self._snapshot
 
 
 class ChatGPT:
@@ -203,7 +360,7 @@ class ChatGPT:
         response = DialogMessage(**message.dict())
         return response, completion_usage
 
-    async def send_messages_streaming(self, messages_to_send: List[DialogMessage], is_cancelled: Callable[[], bool]) -> (DialogMessage, CompletionUsage):
+    async def send_messages_streaming(self, messages_to_send: List[DialogMessage], is_cancelled: Callable[[], bool]) -> (StreamAccumulator, CompletionUsage):
         additional_fields = self.create_additional_fields()
 
         # count tokens before base64 conversion to preserve proxy URL token parsing
@@ -220,10 +377,13 @@ class ChatGPT:
             stream=True,
             **additional_fields,
         )
-        result_dict = {}
-        tool_calls_accumulator = {}
+        accumulator = StreamAccumulator()
+        tokens_counter = StreamingTokenCounter(self.llm_model.model_name)
+        last_completion_usage = None
+        completion_usage_is_estimated = False
+        is_stream_cancelled = False
         async for resp_part in resp_generator:
-            dialog_message = None
+            has_updates = False
             completion_usage = None
             completion_tokens = None
 
@@ -232,108 +392,57 @@ class ChatGPT:
 
             delta = resp_part.choices[0].delta if resp_part.choices else None
             if delta and delta.content:
-                result_dict = merge_dicts(result_dict, dict(delta))
-                dialog_message = DialogMessage(**result_dict)
-                completion_tokens = count_messages_tokens([result_dict], model=self.llm_model.model_name)
+                accumulator.add_content(delta.content)
+                completion_tokens = tokens_counter.add(delta.content)
+                has_updates = True
             if delta and delta.function_call is not None:
-                if 'function_call' not in result_dict or result_dict['function_call'] is None:
-                    result_dict['function_call'] = {}
-                function_call_dict = merge_dicts(result_dict['function_call'], dict(delta.function_call))
-                result_dict['function_call'] = function_call_dict
-                dialog_message = DialogMessage(function_call=result_dict)
-                # TODO: find more accurate way to calculate completion length for function calls
-                completion_tokens = count_string_tokens(json.dumps(result_dict), model=self.llm_model.model_name)
-            if delta and delta.tool_calls is not None:
+                accumulator.add_function_call(delta.function_call.name, delta.function_call.arguments)
+                completion_tokens = tokens_counter.add(delta.function_call.arguments or '')
+                has_updates = True
+            if delta and delta.tool_calls:
                 for tool_call_chunk in delta.tool_calls:
-                    idx = tool_call_chunk.index
-
-                    # Инициализируем аккумулятор для этого tool call
-                    if idx not in tool_calls_accumulator:
-                        tool_calls_accumulator[idx] = {
-                            "id": "",
-                            "type": "function",
-                            "function": {
-                                "name": "",
-                                "arguments": "",
-                            }
-                        }
-
-                    # Аккумулируем данные
-                    if tool_call_chunk.id:
-                        tool_calls_accumulator[idx]["id"] = tool_call_chunk.id
-
+                    name, arguments = None, None
                     if tool_call_chunk.function:
-                        if tool_call_chunk.function.name:
-                            tool_calls_accumulator[idx]["function"]["name"] += tool_call_chunk.function.name
-                        if tool_call_chunk.function.arguments:
-                            tool_calls_accumulator[idx]["function"]["arguments"] += tool_call_chunk.function.arguments
-
-                tool_calls_list = []
-                for idx in sorted(tool_calls_accumulator.keys()):
-                    tc = tool_calls_accumulator[idx]
-                    tool_calls_list.append(
-                        ToolCall(
-                            id=tc["id"],
-                            type="function",
-                            function=FunctionCall(
-                                name=tc["function"]["name"],
-                                arguments=tc["function"]["arguments"]
-                            )
-                        )
-                    )
-
-                dialog_message = DialogMessage(tool_calls=tool_calls_list)
-                # TODO: find more accurate way to calculate completion length for function calls
-                completion_tokens = count_string_tokens(json.dumps(result_dict), model=self.llm_model.model_name)
-
-            if not dialog_message and not completion_usage:
+                        name, arguments = tool_call_chunk.function.name, tool_call_chunk.function.arguments
+                    accumulator.add_tool_call(tool_call_chunk.index, tool_call_chunk.id, name, arguments)
+                    completion_tokens = tokens_counter.add(arguments or '')
+                has_updates = True
+
+            if not has_updates and not completion_usage:
                 # no updates at all, nothing to return
                 continue
-            elif not dialog_message:
-                # no updates only in dialog message, create it from last result
-                kwargs = dict(result_dict)
-                if tool_calls_accumulator:
-                    tool_calls_list = []
-                    for idx in sorted(tool_calls_accumulator.keys()):
-                        tc = tool_calls_accumulator[idx]
-                        tool_calls_list.append(
-                            ToolCall(
-                                id=tc["id"],
-                                type="function",
-                                function=FunctionCall(
-                                    name=tc["function"]["name"],
-                                    arguments=tc["function"]["arguments"]
-                                )
-                            )
-                        )
-                    kwargs['tool_calls'] = tool_calls_list
-                dialog_message = DialogMessage(**kwargs)
             elif not completion_usage:
-                # no updates only in completion usage, calculate it from dialog message result
+                # no updates only in completion usage, estimate it from accumulated response
                 completion_usage = CompletionUsage(
                     model=self.llm_model.model_name,
                     prompt_tokens=prompt_tokens,
                     completion_tokens=completion_tokens,
                     total_tokens=prompt_tokens + completion_tokens,
                 )
+                completion_usage_is_estimated = True
+            else:
+                completion_usage_is_estimated = False
 
-            # openai doesn't return this field in streaming mode somewhy
-            dialog_message.role = 'assistant'
-
-            if isinstance(dialog_message.content, str):
-                visible, thinking, is_thinking = parse_thinking(dialog_message.content)
-                if thinking:
-                    dialog_message.thinking = thinking
-
-            yield dialog_message, completion_usage
+            last_completion_usage = completion_usage
+            yield accumulator, completion_usage
             if is_cancelled():
-                # some more tokens may be generated after cancellation
-                completion_usage.completion_tokens += 20
+                is_stream_cancelled = True
                 with suppress(BaseException):
                     # sometimes this call throws an exception since python 3.8
                     await resp_generator.response.aclose()
                 break
 
+        # consumers use the last yielded usage, so it is corrected in place after the stream is finished
+        if completion_usage_is_estimated:
+            # provider didn't return usage, exact count is calculated once instead of on every delta
+            response_message = accumulator.snapshot().openai_message()
+            last_completion_usage.completion_tokens = count_messages_tokens([response_message], model=self.llm_model.model_name)
+            last_completion_usage.total_tokens = prompt_tokens + last_completion_usage.completion_tokens
+
+        if is_stream_cancelled:
+            # some more tokens may be generated after cancellation
+            last_completion_usage.completion_tokens += 20
+
     def create_additional_fields(self):
         additional_fields = {}
         if self.function_storage is not None:
@@ -1,8 +1,11 @@
 import logging
+from functools import lru_cache
 
-from typing import Iterable, List
+from typing import Iterable, List, Dict, Optional, Callable, Sequence, Tuple
 import tiktoken
 
+from app.llm_models import get_models, LLMTokenizer
+
 
 LOW_DETAIL_COST = 85
 HIGH_DETAIL_SQUARE_COST = 170
@@ -11,27 +14,82 @@ HIGH_DETAIL_ADDITIONAL_COST = 85
 FIRST_SCALE_TO_PX = 2048
 SECOND_SCALE_TO_PX = 768
 
+# numbers for currently actual models (gpt-3.5-turbo-0613, gpt-4-0314 and older)
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+# every reply is primed with <|start|>assistant<|message|>
+REPLY_PRIMING_TOKENS = 3
+
+# encoder family name for models without tokenizer, tokens are counted as characters
+STRING_LENGTH_ENCODER_FAMILY = 'len'
+
+# streamed text without whitespace longer than this is considered stable and is not re-tokenized
+STREAMING_MAX_UNSTABLE_TAIL_LENGTH = 256
+
 
 logger = logging.getLogger(__name__)
 
 
-def get_encoder_for_model(model="gpt-3.5-turbo"):
+def _get_tiktoken_model_name(model) -> Optional[str]:
     if "gpt-3.5-turbo" in model:
-        model = "gpt-3.5-turbo"
+        return "gpt-3.5-turbo"
     elif "gpt-4o" in model:
-        model = "gpt-4o"
+        return "gpt-4o"
     elif "gpt-4" in model:
-        model = "gpt-4"
+        return "gpt-4"
     elif 'claude' in model:
         # HACK: TODO: implement true token count for anthropic models
-        model = "gpt-4"
+        return "gpt-4"
     else:
-        # TODO: implement custom tokenizers support
-        # HACK: fallback to len(str) token counting for unknown models
-        return str
+        # models without tiktoken support can set custom tokenizer in LLModel
+        return None
 
-    encoding = tiktoken.encoding_for_model(model)
-    return encoding.encode
+
+@lru_cache
+def _get_model_encoder(model: str) -> Tuple[str, Callable[[str], Sequence]]:
+    """
+    Resolves (encoder family, encode function) for model, result is memoized per model name
+    """
+    llm_model = get_models().get(model)
+    tokenizer = llm_model.tokenizer if llm_model is not None else None
+    if isinstance(tokenizer, LLMTokenizer):
+        return tokenizer.name, tokenizer.encode
+    elif isinstance(tokenizer, str):
+        # tiktoken encoding name, e.g. o200k_base
+        encoding = tiktoken.get_encoding(tokenizer)
+        return encoding.name, encoding.encode
+
+    tiktoken_model = _get_tiktoken_model_name(model)
+    if tiktoken_model is None:
+        # HACK: fallback to len(str) token counting for unknown models without tokenizer
+        return STRING_LENGTH_ENCODER_FAMILY, str
+
+    encoding = tiktoken.encoding_for_model(tiktoken_model)
+    return encoding.name, encoding.encode
+
+
+def get_encoder_for_model(model="gpt-3.5-turbo"):
+    _, encoder = _get_model_encoder(model)
+    return encoder
+
+
+def get_encoder_family(model="gpt-3.5-turbo") -> str:
+    """
+    Name of the encoding used for model, models with the same encoder family have equal token counts
+    """
+    encoder_family, _ = _get_model_encoder(model)
+    return encoder_family
+
+
+def warm_up_encoders():
+    """
+    Resolves encoders of all configured models, so BPE ranks are loaded before the first user request
+    """
+    for model_name in get_models():
+        try:
+            get_encoder_for_model(model_name)('warm up')
+        except Exception as e:
+            logger.warning(f"Can't warm up tokenizer for model {model_name}: {e}")
 
 
 def count_string_tokens(string: str, model="gpt-3.5-turbo") -> int:
@@ -51,39 +109,40 @@ def extract_tokens_count_from_image_url(image_url):
     return tokens
 
 
-def count_messages_tokens(messages: List[dict], model="gpt-3.5-turbo") -> int:
-    # numbers for currently actual models (gpt-3.5-turbo-0613, gpt-4-0314 and older)
-    tokens_per_message = 3
-    tokens_per_name = 1
+def _count_message_tokens(message: dict, encoder) -> int:
+    num_tokens = TOKENS_PER_MESSAGE
+    content = message.get('content')
+    if content:
+        if isinstance(content, str):
+            num_tokens += len(encoder(content))
+        elif isinstance(content, list):
+            for part in content:
+                if part['type'] == 'text':
+                    num_tokens += len(encoder(part['text']))
+                elif part['type'] == 'image_url':
+                    num_tokens += extract_tokens_count_from_image_url(part['image_url']['url'])
+                else:
+                    ValueError('Unknown content type')
+
+    for key, value in message.items():
+        if key == 'content':
+            continue
+        if value is None:
+            continue
+        num_tokens += len(encoder(str(value)))
+        if key == "name":
+            num_tokens += TOKENS_PER_NAME
+    return num_tokens
 
+
+def count_messages_tokens(messages: List[dict], model="gpt-3.5-turbo") -> int:
     encoder = get_encoder_for_model(model)
 
     num_tokens = 0
     for message in messages:
-        num_tokens += tokens_per_message
-        content = message.get('content')
-        if content:
-            if isinstance(content, str):
-                num_tokens += len(encoder(content))
-            elif isinstance(content, list):
-                for part in content:
-                    if part['type'] == 'text':
-                        num_tokens += len(encoder(part['text']))
-                    elif part['type'] == 'image_url':
-                        num_tokens += extract_tokens_count_from_image_url(part['image_url']['url'])
-                    else:
-                        ValueError('Unknown content type')
-
-        for key, value in message.items():
-            if key == 'content':
-                continue
-            if value is None:
-                continue
-            num_tokens += len(encoder(str(value)))
-            if key == "name":
-                num_tokens += tokens_per_name
-
-    num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
+        num_tokens += _count_message_tokens(message, encoder)
+
+    num_tokens += REPLY_PRIMING_TOKENS
     return num_tokens
 
 
@@ -91,6 +150,70 @@ def count_dialog_messages_tokens(messages: Iterable['DialogMessage'], model="gpt
     return count_messages_tokens([m.openai_message() for m in messages], model)
 
 
+def count_dialog_message_tokens(message: 'DialogMessage', model="gpt-3.5-turbo") -> int:
+    """
+    Tokens of a single message without reply priming, sum of these plus REPLY_PRIMING_TOKENS
+    is equal to count_dialog_messages_tokens
+    """
+    encoder = get_encoder_for_model(model)
+    return _count_message_tokens(message.openai_message(), encoder)
+
+
+def build_message_tokens_count(message: 'DialogMessage', model="gpt-3.5-turbo") -> Dict[str, int]:
+    """
+    Token count of message keyed by encoder family, stored alongside message in DB
+    """
+    return {get_encoder_family(model): count_dialog_message_tokens(message, model)}
+
+
+def get_stored_message_tokens(message: 'Message', model="gpt-3.5-turbo") -> int:
+    """
+    Token count of stored message, tokenizes message only if there is no count for model encoder family yet
+    """
+    encoder_family = get_encoder_family(model)
+    tokens = message.tokens_count.get(encoder_family)
+    if tokens is None:
+        tokens = count_dialog_message_tokens(message.message, model)
+        message.tokens_count[encoder_family] = tokens
+    return tokens
+
+
+def count_stored_messages_tokens(messages: Iterable['Message'], model="gpt-3.5-turbo") -> int:
+    """
+    Same as count_dialog_messages_tokens, but reuses token counts stored with messages
+    """
+    num_tokens = sum(get_stored_message_tokens(message, model) for message in messages)
+    num_tokens += REPLY_PRIMING_TOKENS
+    return num_tokens
+
+
+class StreamingTokenCounter:
+    """
+    Incremental token counter for streamed completion text. Text before the last whitespace is tokenized
+    once, only the tail after it is re-tokenized on every delta. Tokenizing text in pieces may slightly
+    differ from tokenizing it at once, so the result is an estimate, exact count should be calculated
+    once the stream is finished.
+    """
+    def __init__(self, model="gpt-3.5-turbo"):
+        self.encoder = get_encoder_for_model(model)
+        self.stable_tokens = 0
+        self.tail = ''
+
+    def add(self, text: str) -> int:
+        """
+        Adds text delta, returns estimated token count of all text added so far
+        """
+        tail = self.tail + text
+        split_index = max(tail.rfind(' '), tail.rfind('\n'))
+        if split_index <= 0 and len(tail) > STREAMING_MAX_UNSTABLE_TAIL_LENGTH:
+            split_index = len(tail)
+        if split_index > 0:
+            self.stable_tokens += len(self.encoder(tail[:split_index]))
+            tail = tail[split_index:]
+        self.tail = tail
+        return self.stable_tokens + len(self.encoder(self.tail))
+
+
 def count_tokens_from_functions(functions, model="gpt-3.5-turbo"):
     encoder = get_encoder_for_model(model)
     num_tokens = 0
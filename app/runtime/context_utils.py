@@ -11,16 +11,19 @@ from app.storage.db import MessageType
 
 async def add_user_input_to_context(user_input: UserInput, context_manager: ContextManager):
     """Add all items from UserInput to context. Used by both runtime and context-only path."""
+    # items are collected first and added with one insert, order of the items is preserved
+    messages = []
+
     # Add voice transcriptions
     for vt in user_input.voice_transcriptions:
         dialog_message = DialogUtils.prepare_user_message(vt.text)
-        await context_manager.add_message(dialog_message, vt.tg_message_id)
+        messages.append((dialog_message, vt.tg_message_id, MessageType.MESSAGE))
 
     # Add documents
     for doc in user_input.documents:
         doc_info = json.dumps({"document_id": doc.document_id, "document_name": doc.document_name})
         dialog_message = DialogUtils.prepare_user_message(doc_info)
-        await context_manager.add_message(dialog_message, doc.tg_message_id, MessageType.DOCUMENT)
+        messages.append((dialog_message, doc.tg_message_id, MessageType.DOCUMENT))
 
     # Add text/image messages
     for text_input in user_input.text_inputs:
@@ -40,4 +43,7 @@ async def add_user_input_to_context(user_input: UserInput, context_manager: Cont
             dialog_message = DialogUtils.prepare_user_message(text_input.text)
         else:
             continue
-        await context_manager.add_message(dialog_message, text_input.tg_message_id)
+        messages.append((dialog_message, text_input.tg_message_id, MessageType.MESSAGE))
+
+    if messages:
+        await context_manager.add_messages(messages)
@@ -1,3 +1,4 @@
+import datetime
 from dataclasses import dataclass
 from typing import Optional
 
@@ -7,4 +8,5 @@ class ConversationSession:
     """Transport-agnostic conversation identification."""
     chat_id: int
     reply_to_message_id: Optional[int] = None
+    reply_to_message_date: Optional[datetime.datetime] = None
     is_forwarded: bool = False
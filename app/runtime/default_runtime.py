@@ -6,7 +6,7 @@ from app.context.context_manager import ContextManager, build_context_manager
 from app.context.dialog_manager import DialogUtils
 from app.llm_models import get_model_by_name
 from app.openai_helpers.anthropic_chatgpt import AnthropicChatGPT
-from app.openai_helpers.chatgpt import ChatGPT, parse_thinking
+from app.openai_helpers.chatgpt import ChatGPT, parse_thinking, StreamAccumulator
 from app.runtime.conversation_session import ConversationSession
 from app.runtime.events import (
     RuntimeEvent, StreamingContentDelta, FinalResponse,
@@ -14,6 +14,7 @@ from app.runtime.events import (
 )
 from app.runtime.context_utils import add_user_input_to_context
 from app.runtime.side_effects import SideEffectHandler
+from app.runtime.snapshot_throttle import SnapshotThrottle
 from app.runtime.user_input import UserInput
 from app.storage.db import DB, User
 
@@ -67,19 +68,34 @@ class DefaultLLMRuntime:
         if recursive_count >= settings.SUCCESSIVE_FUNCTION_CALLS_LIMIT:
             raise ValueError('Model makes too many successive function calls')
 
-        # Consume the streaming response and yield deltas
-        dialog_message = None
+        # Consume the streaming response and yield deltas, coalesced by the snapshot throttle
+        response = None
         first_iteration = True
-        async for dialog_message in response_generator:
+        throttle = SnapshotThrottle()
+        async for response in response_generator:
             if first_iteration:
                 first_iteration = False
                 continue
 
-            if dialog_message.function_call is not None or dialog_message.tool_calls is not None:
+            # streaming responses are accumulated, dialog message is materialized from accumulator only at the end
+            if isinstance(response, StreamAccumulator):
+                if response.has_function_calls():
+                    continue
+                content_length = response.content_length
+            else:
+                if response.function_call is not None or response.tool_calls is not None:
+                    continue
+                content_length = len(response.content) if isinstance(response.content, str) else 0
+
+            if not throttle.is_due(content_length):
                 continue
+            throttle.mark(content_length)
 
-            if isinstance(dialog_message.content, str):
-                visible, thinking, is_thinking = parse_thinking(dialog_message.content)
+            if isinstance(response, StreamAccumulator):
+                # thinking tags are parsed incrementally as the content arrives
+                visible, thinking, is_thinking = response.thinking_parser.result()
+            elif isinstance(response.content, str):
+                visible, thinking, is_thinking = parse_thinking(response.content)
             else:
                 visible, thinking, is_thinking = '', '', False
 
@@ -89,6 +105,9 @@ class DefaultLLMRuntime:
                 is_thinking=is_thinking,
             )
 
+        # The final snapshot is always materialized regardless of the throttle
+        dialog_message = response.snapshot() if isinstance(response, StreamAccumulator) else response
+
         # Strip thinking content before saving
         if dialog_message is not None:
             dialog_message = dialog_message.strip_thinking()
@@ -0,0 +1,28 @@
+import time
+from typing import Optional
+
+import settings
+
+
+class SnapshotThrottle:
+    """
+    Decides when a streamed answer is worth materializing into a StreamingContentDelta.
+    The first snapshot is due immediately, next ones when `interval` seconds passed
+    or `max_chars` new characters arrived since the previous snapshot.
+    """
+    def __init__(self, interval: Optional[float] = None, max_chars: Optional[int] = None):
+        self.interval = settings.STREAMING_SNAPSHOT_INTERVAL if interval is None else interval
+        self.max_chars = settings.STREAMING_SNAPSHOT_MAX_CHARS if max_chars is None else max_chars
+        self._last_time: Optional[float] = None
+        self._last_length = 0
+
+    def is_due(self, content_length: int) -> bool:
+        if self._last_time is None:
+            return True
+        if content_length - self._last_length >= self.max_chars:
+            return True
+        return time.monotonic() - self._last_time >= self.interval
+
+    def mark(self, content_length: int):
+        self._last_time = time.monotonic()
+        self._last_length = content_length
@@ -1,16 +1,99 @@
 import json
-from collections import defaultdict
-from datetime import datetime, date
+import re
+import time
+from collections import defaultdict, OrderedDict
+from datetime import datetime, date, timedelta
+from decimal import Decimal
 from enum import Enum
-from typing import List, Optional
+from typing import List, Optional, Dict, Tuple
 
 import settings
-from app.openai_helpers.chatgpt import DialogMessage, CompletionUsage
+from app.openai_helpers.chatgpt import DialogMessage
+from app.storage.pool import MeteredPool
+from app.storage.usage_recorder import UsageRecorder, USAGE_TABLES_COLUMNS
+from app.storage.usage_type import UsageType
 from app.storage.user_role import UserRole
 
 import asyncpg
 import pydantic
 
+try:
+    # optional faster JSON backend for jsonb columns
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_dumps(value) -> str:
+    if orjson is not None:
+        return orjson.dumps(value).decode()
+    return json.dumps(value)
+
+
+def _json_loads(value: str):
+    if orjson is not None:
+        return orjson.loads(value)
+    return json.loads(value)
+
+
+# statements of the per-update path, prepared on every pool connection by init_connection
+HOT_STATEMENTS = {
+    'get_user': 'SELECT * FROM chatgpttg.user WHERE telegram_id = $1',
+    # the cdate lower bounds let partitions of earlier months be skipped
+    'get_telegram_message': 'SELECT * FROM chatgpttg.message WHERE tg_chat_id = $1 AND tg_message_id = $2 AND cdate >= $3',
+    'get_last_message': 'SELECT * FROM chatgpttg.message WHERE user_id = $1 AND tg_chat_id = $2 AND cdate >= $3 ORDER BY cdate DESC, id DESC LIMIT 1',
+    # ancestors are walked up to the summary heading the branch or to the last message covered by it,
+    # then the summary is added if it is not a direct ancestor
+    # ancestors are older than their descendants, the cdate bounds let partitions of later months be skipped
+    'get_message_branch': '''WITH RECURSIVE branch AS (
+            SELECT m.*, 1 AS depth FROM chatgpttg.message m WHERE m.id = $1 AND m.cdate <= $3
+            UNION ALL
+            SELECT m.*, b.depth + 1 FROM chatgpttg.message m JOIN branch b ON m.id = b.parent_id AND m.cdate <= b.cdate
+            WHERE b.message_type <> 'summary'
+            AND m.id IS DISTINCT FROM (SELECT s.parent_id FROM chatgpttg.message s WHERE s.id = $2 AND s.cdate <= $3)
+        )
+        SELECT * FROM (
+            SELECT * FROM branch
+            UNION ALL
+            SELECT m.*, (SELECT MAX(depth) + 1 FROM branch) FROM chatgpttg.message m
+            WHERE m.id = $2 AND m.cdate <= $3 AND m.id NOT IN (SELECT id FROM branch)
+        ) AS b ORDER BY depth DESC''',
+    'update_activation_dtime': 'UPDATE chatgpttg.message SET activation_dtime = NOW() WHERE id = ANY($1::bigint[]) AND cdate >= $2',
+    'create_message': 'INSERT INTO chatgpttg.message (user_id, message, parent_id, summary_id, tg_chat_id, tg_message_id, message_type, tokens_count) VALUES ($1, $2, $3, $4, $5, $6, $7, $8) RETURNING *',
+}
+
+
+class DBConnection(asyncpg.Connection):
+    """Pool connection with HOT_STATEMENTS prepared by init_connection."""
+    hot_statements: Dict[str, asyncpg.prepared_stmt.PreparedStatement]
+
+
+async def init_connection(connection: DBConnection):
+    """Pool connection init hook: jsonb values are encoded and decoded by asyncpg itself, hot statements are prepared."""
+    await connection.set_type_codec('jsonb', encoder=_json_dumps, decoder=_json_loads, schema='pg_catalog')
+    connection.hot_statements = {}
+    for name, sql in HOT_STATEMENTS.items():
+        connection.hot_statements[name] = await connection.prepare(sql)
+
+
+async def create_connection_pool(dsn: str) -> MeteredPool:
+    pool = MeteredPool(
+        dsn,
+        min_size=settings.POSTGRES_POOL_MIN_SIZE,
+        max_size=settings.POSTGRES_POOL_MAX_SIZE,
+        max_queries=50000,
+        max_inactive_connection_lifetime=settings.POSTGRES_POOL_MAX_INACTIVE_CONNECTION_LIFETIME,
+        setup=None,
+        init=init_connection,
+        loop=None,
+        connection_class=DBConnection,
+        record_class=asyncpg.Record,
+        statement_cache_size=settings.POSTGRES_STATEMENT_CACHE_SIZE,
+        metrics_interval=settings.POSTGRES_POOL_METRICS_INTERVAL,
+    )
+    await pool
+    return pool
+
 
 class User(pydantic.BaseModel):
     id: int
@@ -39,21 +122,145 @@ class MessageType(Enum):
     DOCUMENT = 'document'
 
 
+class MonthlyUsage(pydantic.BaseModel):
+    # row of the monthly_usage rollup, counters not relevant to usage_type are 0
+    month: date
+    user_id: int
+    usage_type: UsageType
+    model: str  # empty for whisper
+    resolution: str  # empty for everything except image generation
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
+    audio_seconds: int
+    characters_count: int
+    usage_count: int
+    price: Decimal
+
+
 class Message(pydantic.BaseModel):
     id: int
     user_id: int
     message: DialogMessage
     cdate: datetime  # message creation date
     activation_dtime: datetime  # last interaction with message
-    previous_message_ids: List[int]  # ids of previous messages in the branch of subdialog
+    parent_id: Optional[int] = None  # previous message in the branch of subdialog, last summarized one for summary
+    summary_id: Optional[int] = None  # summary heading the branch of subdialog, replaces ancestors it covers
     tg_chat_id: int
     tg_message_id: int
     message_type: MessageType
+    tokens_count: Dict[str, int] = {}  # message token counts keyed by encoder family
+
+
+# tables range partitioned by month on cdate, see migration 0018
+PARTITIONED_TABLES = ('message', *USAGE_TABLES_COLUMNS)
+TELEGRAM_MESSAGE_CDATE_MARGIN = timedelta(days=1)
+
+
+class UserCache:
+    """
+    Bounded LRU cache of User records keyed by telegram id, entries expire after ttl seconds.
+    Stored and returned users are copies, so callers may mutate them freely.
+    """
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._users: OrderedDict = OrderedDict()  # telegram_id -> (expiration time, user)
+
+    def get(self, telegram_user_id: int) -> Optional[User]:
+        entry = self._users.get(telegram_user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            del self._users[telegram_user_id]
+            self.misses += 1
+            return None
+
+        self._users.move_to_end(telegram_user_id)
+        self.hits += 1
+        return user.copy()
+
+    def put(self, user: User):
+        if self.max_size <= 0:
+            return
+        self._users[user.telegram_id] = (time.monotonic() + self.ttl, user.copy())
+        self._users.move_to_end(user.telegram_id)
+        while len(self._users) > self.max_size:
+            self._users.popitem(last=False)
+
+    def invalidate(self, telegram_user_id: int):
+        self._users.pop(telegram_user_id, None)
+
+    def stats(self) -> dict:
+        return {'size': len(self._users), 'hits': self.hits, 'misses': self.misses}
+
+
+class BranchCache:
+    """
+    Bounded LRU cache of recently written and loaded subdialog branches keyed by (chat id, tip message id).
+    Branch ending with a message never changes: new messages, summaries and replies create new tips,
+    so entries only have to be dropped to free memory, e.g. when the chat is reset.
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._branches: OrderedDict = OrderedDict()  # (tg_chat_id, tip message id) -> tuple of messages
+
+    def get(self, tg_chat_id: int, tip_message_id: int) -> Optional[List[Message]]:
+        branch = self._branches.get((tg_chat_id, tip_message_id))
+        if branch is None:
+            self.misses += 1
+            return None
+
+        self._branches.move_to_end((tg_chat_id, tip_message_id))
+        self.hits += 1
+        return list(branch)
+
+    def put(self, tg_chat_id: int, branch: List[Message]):
+        if self.max_size <= 0 or not branch:
+            return
+        key = (tg_chat_id, branch[-1].id)
+        self._branches[key] = tuple(branch)
+        self._branches.move_to_end(key)
+        while len(self._branches) > self.max_size:
+            self._branches.popitem(last=False)
+
+    def invalidate_chat(self, tg_chat_id: int):
+        for key in [key for key in self._branches if key[0] == tg_chat_id]:
+            del self._branches[key]
+
+    def stats(self) -> dict:
+        return {'size': len(self._branches), 'hits': self.hits, 'misses': self.misses}
 
 
 class DB:
-    def __init__(self, connection_pool: asyncpg.Pool):
+    def __init__(self, connection_pool: MeteredPool):
         self.connection_pool = connection_pool
+        self.pool_metrics = connection_pool.metrics
+        # the cache is per process, a role set by an admin handled in another worker process or replica
+        # would not be seen there until the entry expires
+        single_process = settings.BOT_WORKER_PROCESSES == 1 and len(settings.WEBHOOK_REPLICA_URLS) <= 1
+        self.user_cache = UserCache(settings.USER_CACHE_SIZE if single_process else 0, settings.USER_CACHE_TTL)
+        self.branch_cache = BranchCache(settings.BRANCH_CACHE_SIZE)
+        self.usage_recorder = UsageRecorder(
+            connection_pool, settings.USAGE_FLUSH_BATCH_SIZE, settings.USAGE_FLUSH_INTERVAL,
+            settings.USAGE_FLUSH_MAX_ATTEMPTS,
+        )
+
+    async def _run_hot_statement(self, name: str, method: str, *args):
+        async with self.connection_pool.acquire() as connection:
+            try:
+                return await getattr(connection.hot_statements[name], method)(*args)
+            except asyncpg.InvalidCachedStatementError:
+                # result types changed with the schema after the statement was prepared
+                connection.hot_statements[name] = await connection.prepare(HOT_STATEMENTS[name])
+                return await getattr(connection.hot_statements[name], method)(*args)
 
     async def iterate_users(self):
         sql = 'SELECT * FROM chatgpttg.user'
@@ -68,11 +275,19 @@ class DB:
         return user
 
     async def get_user(self, telegram_user_id):
-        sql = 'SELECT * FROM chatgpttg.user WHERE telegram_id = $1'
-        record = await self.connection_pool.fetchrow(sql, telegram_user_id)
+        user = self.user_cache.get(telegram_user_id)
+        if user is not None:
+            return user
+
+        record = await self._run_hot_statement('get_user', 'fetchrow', telegram_user_id)
         if record is None:
             return None
-        return User(**record)
+        user = User(**record)
+        self.user_cache.put(user)
+        return user
+
+    def invalidate_user(self, telegram_user_id):
+        self.user_cache.invalidate(telegram_user_id)
 
     async def update_user(self, user: User):
         sql = '''UPDATE chatgpttg.user 
@@ -81,172 +296,177 @@ class DB:
         full_name = $7, username = $8, role = $9, streaming_answers = $10,
         function_call_verbose = $11, image_generation = $12, tts_voice = $13,
         system_prompt_settings = $14, system_prompt_settings_enabled = $15 WHERE id = $16 RETURNING *'''
-        return User(**await self.connection_pool.fetchrow(
+        user = User(**await self.connection_pool.fetchrow(
             sql, user.current_model, user.gpt_mode, user.forward_as_prompt,
             user.voice_as_prompt, user.use_functions, user.auto_summarize,
             user.full_name, user.username, user.role.value, user.streaming_answers,
             user.function_call_verbose, user.image_generation, user.tts_voice,
             user.system_prompt_settings, user.system_prompt_settings_enabled, user.id,
         ))
+        self.user_cache.put(user)
+        return user
 
     async def create_user(self, telegram_user_id: int, role: UserRole):
         sql = 'INSERT INTO chatgpttg.user (telegram_id, role) VALUES ($1, $2) RETURNING *'
-        return User(**await self.connection_pool.fetchrow(sql, telegram_user_id, role.value))
+        user = User(**await self.connection_pool.fetchrow(sql, telegram_user_id, role.value))
+        self.user_cache.put(user)
+        return user
 
-    async def get_telegram_message(self, tg_chat_id: int, tg_message_id: int):
-        sql = 'SELECT * FROM chatgpttg.message WHERE tg_chat_id = $1 AND tg_message_id = $2'
-        tg_message_record = await self.connection_pool.fetchrow(sql, tg_chat_id, tg_message_id)
+    async def get_telegram_message(self, tg_chat_id: int, tg_message_id: int, sent_date: datetime):
+        # a message is stored after telegram has sent it, the margin covers clock skew
+        tg_message_record = await self._run_hot_statement(
+            'get_telegram_message', 'fetchrow', tg_chat_id, tg_message_id, sent_date - TELEGRAM_MESSAGE_CDATE_MARGIN,
+        )
         if tg_message_record is None:
             return None
-        tg_message_record = dict(tg_message_record)
-        tg_message_record['message'] = json.loads(tg_message_record['message'])
         return Message(**tg_message_record)
 
-    async def get_messages_by_ids(self, message_ids: List[int]):
-        sql = 'SELECT * FROM chatgpttg.message WHERE id = ANY($1::bigint[]) ORDER BY cdate ASC'
-        records = await self.connection_pool.fetch(sql, message_ids)
-        if records is None:
-            return []
-
-        result = []
-        for record in records:
-            record = dict(record)
-            record['message'] = json.loads(record['message'])
-            result.append(record)
-
-        result = [Message(**record) for record in result]
-        return result
-
-    async def get_last_message(self, user_id, tg_chat_id) -> Message:
-        sql = 'SELECT * FROM chatgpttg.message WHERE user_id = $1 AND tg_chat_id = $2 ORDER BY cdate DESC LIMIT 1'
-        record = await self.connection_pool.fetchrow(sql, user_id, tg_chat_id)
+    async def get_last_message(self, user_id, tg_chat_id, since: datetime) -> Message:
+        """Returns the last message of the chat created since the given time."""
+        record = await self._run_hot_statement('get_last_message', 'fetchrow', user_id, tg_chat_id, since)
         if record is None:
             return None
-        record = dict(record)
-        record['message'] = json.loads(record['message'])
         return Message(**record)
 
-    async def update_activation_dtime(self, message_ids: List[int]):
-        sql = 'UPDATE chatgpttg.message SET activation_dtime = NOW() WHERE id = ANY($1::bigint[])'
-        await self.connection_pool.execute(sql, message_ids)
+    async def get_message_branch(self, message: Message) -> List[Message]:
+        """Returns branch of subdialog ending with the message, in chronological order."""
+        if message.message_type == MessageType.SUMMARY or message.parent_id is None:
+            return [message]
+
+        branch = self.branch_cache.get(message.tg_chat_id, message.id)
+        if branch is not None:
+            # the tip is usually just read from DB, it has the actual activation time
+            branch[-1] = message
+            return branch
+
+        records = await self._run_hot_statement(
+            'get_message_branch', 'fetch', message.parent_id, message.summary_id, message.cdate
+        )
+        result = [Message(**record) for record in records]
+        result.append(message)
+        self.branch_cache.put(message.tg_chat_id, result)
+        return result
+
+    async def update_activation_dtime(self, messages: List[Message]):
+        await self._run_hot_statement(
+            'update_activation_dtime', 'fetch', [m.id for m in messages], min(m.cdate for m in messages)
+        )
 
     async def create_message(self, user_id, tg_chat_id, tg_message_id, message: DialogMessage,
-                             previous_messages: List[Message] = None, message_type: MessageType = MessageType.MESSAGE):
+                             previous_messages: List[Message] = None, message_type: MessageType = MessageType.MESSAGE,
+                             tokens_count: Optional[Dict[str, int]] = None):
         if previous_messages is None:
             previous_messages = []
 
-        sql = 'INSERT INTO chatgpttg.message (user_id, message, previous_message_ids, tg_chat_id, tg_message_id, message_type) VALUES ($1, $2, $3, $4, $5, $6) RETURNING *'
-        openai_message = json.dumps(message.openai_message())
-        previous_message_ids = [m.id for m in previous_messages]
+        if tokens_count is None:
+            tokens_count = {}
+
+        # only the links to the branch are stored: its last message and the summary heading it
+        parent_id = previous_messages[-1].id if previous_messages else None
+        summary_id = None
+        if previous_messages and previous_messages[0].message_type == MessageType.SUMMARY:
+            summary_id = previous_messages[0].id
+
+        record = await self._run_hot_statement(
+            'create_message', 'fetchrow', user_id, message.openai_message(), parent_id, summary_id,
+            tg_chat_id, tg_message_id, message_type.value, tokens_count,
+        )
+        message = Message(**record)
+        self.branch_cache.put(tg_chat_id, previous_messages + [message])
+        return message
+
+    async def create_messages(self, user_id, tg_chat_id, messages: List[Tuple[int, DialogMessage, MessageType, Dict[str, int]]],
+                              previous_messages: List[Message] = None) -> List[Message]:
+        """
+        Inserts (tg_message_id, message, message_type, tokens_count) items with one statement,
+        each of them continues the branch of the previous one.
+        """
+        if previous_messages is None:
+            previous_messages = []
 
-        record = await self.connection_pool.fetchrow(sql, user_id, openai_message, previous_message_ids,
-                                                     tg_chat_id, tg_message_id, message_type.value)
-        record = dict(record)
-        record['message'] = json.loads(record['message'])
+        parent_id = previous_messages[-1].id if previous_messages else None
+        summary_id = None
+        if previous_messages and previous_messages[0].message_type == MessageType.SUMMARY:
+            summary_id = previous_messages[0].id
+
+        # ids are taken from the sequence in items order beforehand, so every row can reference the previous one
+        sql = '''WITH items AS (
+            SELECT ord, item, nextval(pg_get_serial_sequence('chatgpttg.message', 'id')) AS id
+            FROM (SELECT ord, item FROM jsonb_array_elements($5::jsonb) WITH ORDINALITY AS i(item, ord) ORDER BY ord) AS i
+        )
+        INSERT INTO chatgpttg.message (id, user_id, message, parent_id, summary_id, tg_chat_id, tg_message_id, message_type, tokens_count)
+        SELECT id, $1::bigint, item->'message', COALESCE(LAG(id) OVER (ORDER BY ord), $2::bigint), $3::bigint, $4::bigint,
+            (item->>'tg_message_id')::bigint, (item->>'message_type')::chatgpttg.message_types, item->'tokens_count'
+        FROM items
+        RETURNING *'''
+        items = [
+            {
+                'tg_message_id': tg_message_id,
+                'message': message.openai_message(),
+                'message_type': message_type.value,
+                'tokens_count': tokens_count or {},
+            }
+            for tg_message_id, message, message_type, tokens_count in messages
+        ]
+        records = await self.connection_pool.fetch(sql, user_id, parent_id, summary_id, tg_chat_id, items)
+        result = sorted((Message(**record) for record in records), key=lambda m: m.id)
+        self.branch_cache.put(tg_chat_id, previous_messages + result)
+        return result
+
+    async def create_summary_message(self, user_id, tg_chat_id, message: DialogMessage, last_covered_message_id: Optional[int],
+                                     tokens_count: Optional[Dict[str, int]] = None):
+        # summary is linked to the last branch message it covers, loading of branches headed by it stops there
+        if tokens_count is None:
+            tokens_count = {}
+
+        tg_message_id = -1
+        sql = 'INSERT INTO chatgpttg.message (user_id, message, parent_id, tg_chat_id, tg_message_id, message_type, tokens_count) VALUES ($1, $2, $3, $4, $5, $6, $7) RETURNING *'
+        record = await self.connection_pool.fetchrow(sql, user_id, message.openai_message(), last_covered_message_id,
+                                                     tg_chat_id, tg_message_id, MessageType.SUMMARY.value, tokens_count)
         return Message(**record)
 
     async def create_reset_message(self, user_id, tg_chat_id):
         tg_message_id = -1
-        message = '{}'
+        message = {}
         sql = 'INSERT INTO chatgpttg.message (user_id, tg_chat_id, tg_message_id, message, message_type) VALUES ($1, $2, $3, $4, $5) RETURNING *'
         await self.connection_pool.fetchrow(sql, user_id, tg_chat_id, tg_message_id, message, 'reset')
+        self.branch_cache.invalidate_chat(tg_chat_id)
         return
 
+    # usage rows are written behind by the usage recorder
     async def create_completion_usage(self, user_id, prompt_tokens, completion_tokens, total_tokens, model, price) -> None:
-        sql = 'INSERT INTO chatgpttg.completion_usage (user_id, prompt_tokens, completion_tokens, total_tokens, model, price) VALUES ($1, $2, $3, $4, $5, $6)'
-        await self.connection_pool.fetchrow(sql, user_id, prompt_tokens, completion_tokens, total_tokens, model, price)
+        await self.usage_recorder.add('completion_usage', user_id, prompt_tokens, completion_tokens, total_tokens, model, price)
 
     async def create_whisper_usage(self, user_id, audio_seconds, price) -> None:
-        sql = 'INSERT INTO chatgpttg.whisper_usage (user_id, audio_seconds, price) VALUES ($1, $2, $3)'
-        await self.connection_pool.fetchrow(sql, user_id, audio_seconds, price)
+        await self.usage_recorder.add('whisper_usage', user_id, audio_seconds, price)
 
     async def create_image_generation_usage(self, user_id, model, resolution, price):
-        sql = 'INSERT INTO chatgpttg.image_generation_usage (user_id, model, resolution, price) VALUES ($1, $2, $3, $4)'
-        await self.connection_pool.fetchrow(sql, user_id, model, resolution, price)
+        await self.usage_recorder.add('image_generation_usage', user_id, model, resolution, price)
 
     async def create_tts_usage(self, user_id: int, model: str, characters_count: int, price):
-        sql = 'INSERT INTO chatgpttg.tts_usage (user_id, model, characters_count, price) VALUES ($1, $2, $3, $4)'
-        await self.connection_pool.fetchrow(sql, user_id, model, characters_count, price)
+        await self.usage_recorder.add('tts_usage', user_id, model, characters_count, price)
 
-    async def get_user_current_month_whisper_usage(self, user_id):
-        sql = '''SELECT SUM(audio_seconds) AS audio_seconds
-            FROM chatgpttg.whisper_usage
-            WHERE user_id = $1 AND date_trunc('month', cdate) = date_trunc('month', current_date)
-        '''
-        record = await self.connection_pool.fetchrow(sql, user_id)
-        audio_seconds = record['audio_seconds']
-        if audio_seconds is None:
-            return 0
-        return audio_seconds
-
-    async def get_user_current_month_completion_usage(self, user_id):
-        sql = '''
-        SELECT model, 
-           SUM(prompt_tokens) AS prompt_tokens, 
-           SUM(completion_tokens) AS completion_tokens,
-           SUM(total_tokens) AS total_tokens,
-           SUM(price) AS price
-        FROM chatgpttg.completion_usage
-        WHERE user_id = $1 AND
-          date_trunc('month', cdate) = date_trunc('month', current_date)
-        GROUP BY model;
-        '''
-        records = await self.connection_pool.fetch(sql, user_id)
-        if not records:
-            return []
-        return [CompletionUsage(**dict(record)) for record in records]
-
-    async def get_user_current_month_image_generation_usage(self, user_id):
-        sql = '''
-        SELECT model, resolution, COUNT(*) AS usage_count
-        FROM chatgpttg.image_generation_usage
-        WHERE user_id = $1 AND
-          date_trunc('month', cdate) = date_trunc('month', current_date)
-        GROUP BY model, resolution;
-        '''
-        records = await self.connection_pool.fetch(sql, user_id)
-        if not records:
-            return []
-        return [{
-            'model': record['model'],
-            'resolution': record['resolution'],
-            'usage_count': record['usage_count'],
-        } for record in records]
-
-    async def get_user_current_month_tts_usage(self, user_id):
-        sql = '''
-        SELECT model, SUM(characters_count) AS characters_count
-        FROM chatgpttg.tts_usage
-        WHERE user_id = $1 AND
-          date_trunc('month', cdate) = date_trunc('month', current_date)
-        GROUP BY model;
+    async def get_user_current_month_usage(self, user_id) -> List[MonthlyUsage]:
+        await self.usage_recorder.flush_logged()
+        sql = '''SELECT * FROM chatgpttg.monthly_usage
+            WHERE month = date_trunc('month', current_date)::date AND user_id = $1
+            ORDER BY usage_type, model, resolution
         '''
         records = await self.connection_pool.fetch(sql, user_id)
-        if not records:
-            return []
-        return [{
-            'model': record['model'],
-            'characters_count': record['characters_count'],
-        } for record in records]
-
-    async def get_all_users_completion_usage(self, month_date: date = None):
+        return [MonthlyUsage(**record) for record in records]
+
+    async def get_all_users_usage(self, month_date: date = None) -> Dict[str, List[MonthlyUsage]]:
+        await self.usage_recorder.flush_logged()
         if not month_date:
             month_date = datetime.now(settings.POSTGRES_TIMEZONE).date()
 
-        year, month = month_date.year, month_date.month
-
-        sql = f'''
-        SELECT u.telegram_id, u.username, u.full_name, cu.model, 
-           SUM(cu.prompt_tokens) AS prompt_tokens, 
-           SUM(cu.completion_tokens) AS completion_tokens,
-           SUM(cu.total_tokens) AS total_tokens,
-           SUM(cu.price) AS price
-        FROM chatgpttg.completion_usage cu
-        JOIN chatgpttg.user u ON cu.user_id = u.id
-        WHERE EXTRACT(YEAR FROM cu.cdate) = {year} AND EXTRACT(MONTH FROM cu.cdate) = {month}
-        GROUP BY u.id, cu.model;
+        sql = '''SELECT u.telegram_id, u.username, u.full_name, mu.*
+            FROM chatgpttg.monthly_usage AS mu
+            JOIN chatgpttg.user AS u ON mu.user_id = u.id
+            WHERE mu.month = $1
+            ORDER BY u.telegram_id, mu.usage_type, mu.model, mu.resolution
         '''
-        records = await self.connection_pool.fetch(sql)
+        records = await self.connection_pool.fetch(sql, month_date.replace(day=1))
         result = defaultdict(list)
         for record in records:
             telegram_id = record['telegram_id']
@@ -254,93 +474,35 @@ class DB:
             username = f"@{record['username']}" if record['username'] else None
             name = ' - '.join([n for n in [full_name, username] if n is not None])
             name = f'[{telegram_id}] {name}' if name else f'[{telegram_id}]'
-            result[name].append(CompletionUsage(**dict(record)))
+            result[name].append(MonthlyUsage(**record))
         return result
 
-    async def get_all_users_whisper_usage(self, month_date: date = None):
-        if not month_date:
-            month_date = datetime.now(settings.POSTGRES_TIMEZONE).date()
+    async def create_month_partitions(self, table: str, months: List[date]):
+        sql = 'SELECT chatgpttg.create_month_partition($1, $2)'
+        await self.connection_pool.executemany(sql, [(table, month) for month in months])
 
-        year, month = month_date.year, month_date.month
-
-        sql = f'''
-        SELECT u.telegram_id, u.username, u.full_name, 
-           SUM(wu.audio_seconds) AS audio_seconds
-        FROM chatgpttg.whisper_usage wu
-        JOIN chatgpttg.user u ON wu.user_id = u.id
-        WHERE EXTRACT(YEAR FROM wu.cdate) = {year} AND EXTRACT(MONTH FROM wu.cdate) = {month}
-        GROUP BY u.id;
+    async def get_month_partitions(self, table: str) -> Dict[date, str]:
+        sql = '''SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = $1::regclass
         '''
-        records = await self.connection_pool.fetch(sql)
+        records = await self.connection_pool.fetch(sql, f'chatgpttg.{table}')
+        # the default partition has no month and is never returned
+        pattern = re.compile(rf'{table}_p(\d{{4}})_(\d{{2}})')
         result = {}
         for record in records:
-            telegram_id = record['telegram_id']
-            full_name = record['full_name'] if record['full_name'] else ''
-            username = f"@{record['username']}" if record['username'] else ''
-            name = ' - '.join([full_name, username])
-            name = f'[{telegram_id}] {name}' if name else f'[{telegram_id}]'
-            result[name] = record['audio_seconds']
-        return result
-
-    async def get_all_users_image_generation_usage(self, month_date: date = None):
-        if not month_date:
-            month_date = datetime.now(settings.POSTGRES_TIMEZONE).date()
-
-        year, month = month_date.year, month_date.month
+            match = pattern.fullmatch(record['relname'])
+            if match is not None:
+                result[date(int(match.group(1)), int(match.group(2)), 1)] = record['relname']
+        return dict(sorted(result.items()))
 
-        sql = f'''
-        SELECT u.telegram_id, u.username, u.full_name, COUNT(*) AS usage_count, igu.model, igu.resolution
-        FROM chatgpttg.user AS u
-        JOIN chatgpttg.image_generation_usage AS igu ON u.id = igu.user_id
-        WHERE EXTRACT(YEAR FROM igu.cdate) = {year} AND EXTRACT(MONTH FROM igu.cdate) = {month}
-        GROUP BY u.telegram_id, u.username, u.full_name, igu.model, igu.resolution
-        ORDER BY u.telegram_id, igu.model, igu.resolution;
-        '''
-        records = await self.connection_pool.fetch(sql)
-        result = defaultdict(list)
-        for record in records:
-            telegram_id = record['telegram_id']
-            full_name = record['full_name'] if record['full_name'] else ''
-            username = f"@{record['username']}" if record['username'] else ''
-            name = ' - '.join([full_name, username])
-            name = f'[{telegram_id}] {name}' if name else f'[{telegram_id}]'
-            result[name].append({
-                'model': record['model'],
-                'resolution': record['resolution'],
-                'usage_count': record['usage_count'],
-            })
-        return result
-
-    async def get_all_users_tts_usage(self, month_date: date = None):
-        if not month_date:
-            month_date = datetime.now(settings.POSTGRES_TIMEZONE).date()
-
-        year, month = month_date.year, month_date.month
-
-        sql = f'''
-        SELECT u.telegram_id, u.username, u.full_name, tu.model,
-           SUM(tu.characters_count) AS characters_count
-        FROM chatgpttg.tts_usage tu
-        JOIN chatgpttg.user u ON tu.user_id = u.id
-        WHERE EXTRACT(YEAR FROM tu.cdate) = {year} AND EXTRACT(MONTH FROM tu.cdate) = {month}
-        GROUP BY u.id, tu.model
-        ORDER BY u.telegram_id, tu.model;
-        '''
-        records = await self.connection_pool.fetch(sql)
-        result = defaultdict(list)
-        for record in records:
-            telegram_id = record['telegram_id']
-            full_name = record['full_name'] if record['full_name'] else ''
-            username = f"@{record['username']}" if record['username'] else ''
-            name = ' - '.join([full_name, username]).strip()
-            name = f'[{telegram_id}] {name}' if name else f'[{telegram_id}]'
-
-            result[name].append({
-                'model': record['model'],
-                'characters_count': record['characters_count'],
-            })
-
-        return result
+    async def remove_month_partition(self, table: str, partition: str, archive: bool):
+        async with self.connection_pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.execute(f'ALTER TABLE chatgpttg.{table} DETACH PARTITION chatgpttg.{partition}')
+                if archive:
+                    await connection.execute(f'ALTER TABLE chatgpttg.{partition} SET SCHEMA chatgpttg_archive')
+                else:
+                    await connection.execute(f'DROP TABLE chatgpttg.{partition}')
 
 
 class DBFactory:
@@ -350,7 +512,7 @@ class DBFactory:
     async def create_database(cls, user, password, host, port, database) -> DB:
         if cls.connection_pool is None:
             dsn = f'postgres://{user}:{password}@{host}:{port}/{database}'
-            cls.connection_pool = await asyncpg.create_pool(dsn)
+            cls.connection_pool = await create_connection_pool(dsn)
 
         return DB(cls.connection_pool)
 
@@ -0,0 +1,104 @@
+import logging
+import time
+
+import asyncpg
+
+from app.tasks import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+
+class PoolMetrics:
+    """
+    Utilisation of a connection pool: connections in use and time spent waiting for a connection.
+    Peaks and waits are accumulated since the previous report, reports are logged every interval seconds once started.
+    """
+    def __init__(self, pool: asyncpg.Pool, interval: float):
+        self.pool = pool
+        self.interval = interval
+        self.in_use = 0
+        self.in_use_max = 0
+        self.acquire_count = 0
+        self.acquire_wait_total = 0.0
+        self.acquire_wait_max = 0.0
+        self._reporting = PeriodicTask(self.report, interval)
+
+    def on_acquired(self, wait: float):
+        self.in_use += 1
+        self.in_use_max = max(self.in_use_max, self.in_use)
+        self.acquire_count += 1
+        self.acquire_wait_total += wait
+        self.acquire_wait_max = max(self.acquire_wait_max, wait)
+
+    def on_released(self):
+        self.in_use -= 1
+
+    def stats(self) -> dict:
+        return {
+            'size': self.pool.get_size(),
+            'max_size': self.pool.get_max_size(),
+            'in_use': self.in_use,
+            'in_use_max': self.in_use_max,
+            'acquire_count': self.acquire_count,
+            'acquire_wait_avg': self.acquire_wait_total / self.acquire_count if self.acquire_count else 0.0,
+            'acquire_wait_max': self.acquire_wait_max,
+        }
+
+    def reset(self):
+        self.in_use_max = self.in_use
+        self.acquire_count = 0
+        self.acquire_wait_total = 0.0
+        self.acquire_wait_max = 0.0
+
+    def report(self):
+        stats = self.stats()
+        logger.info(
+            'DB pool: %d/%d connections, %d in use (max %d), %d acquires, wait avg %.1f ms, max %.1f ms',
+            stats['size'], stats['max_size'], stats['in_use'], stats['in_use_max'], stats['acquire_count'],
+            stats['acquire_wait_avg'] * 1000, stats['acquire_wait_max'] * 1000,
+        )
+        self.reset()
+
+    def start(self):
+        self._reporting.start()
+
+    async def stop(self):
+        await self._reporting.stop()
+
+
+class _MeteredAcquireContext:
+    def __init__(self, context, metrics: PoolMetrics):
+        self.context = context
+        self.metrics = metrics
+
+    async def __aenter__(self):
+        start = time.monotonic()
+        connection = await self.context.__aenter__()
+        self.metrics.on_acquired(time.monotonic() - start)
+        return connection
+
+    async def __aexit__(self, *exc):
+        await self.context.__aexit__(*exc)
+
+    def __await__(self):
+        return self._acquire().__await__()
+
+    async def _acquire(self):
+        start = time.monotonic()
+        connection = await self.context
+        self.metrics.on_acquired(time.monotonic() - start)
+        return connection
+
+
+class MeteredPool(asyncpg.Pool):
+    """asyncpg pool keeping PoolMetrics of every acquire and release, including the ones made by pool shortcuts."""
+    def __init__(self, *connect_args, metrics_interval: float = 0, **kwargs):
+        super().__init__(*connect_args, **kwargs)
+        self.metrics = PoolMetrics(self, metrics_interval)
+
+    def acquire(self, *, timeout=None):
+        return _MeteredAcquireContext(super().acquire(timeout=timeout), self.metrics)
+
+    async def release(self, connection, *, timeout=None):
+        self.metrics.on_released()
+        await super().release(connection, timeout=timeout)
@@ -0,0 +1,107 @@
+import asyncio
+import datetime
+import logging
+from decimal import Decimal
+from typing import Dict, List
+
+import asyncpg
+
+from app.tasks import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+USAGE_TABLES_COLUMNS = {
+    'completion_usage': ('user_id', 'prompt_tokens', 'completion_tokens', 'total_tokens', 'model', 'price', 'cdate'),
+    'whisper_usage': ('user_id', 'audio_seconds', 'price', 'cdate'),
+    'image_generation_usage': ('user_id', 'model', 'resolution', 'price', 'cdate'),
+    'tts_usage': ('user_id', 'model', 'characters_count', 'price', 'cdate'),
+}
+
+
+class UsageRecorder:
+    """
+    Write-behind buffer of usage rows. Rows are written with COPY when batch_size rows are pending,
+    every flush_interval seconds once started, and on stop. Creation time is taken when the row is added.
+    Flushes run in background tasks, adding a row never waits for the database.
+    Rows of a table failing to be written are retried with the next flushes, after max_flush_attempts failed
+    flushes in a row they are dropped.
+    """
+    def __init__(self, connection_pool: asyncpg.Pool, batch_size: int, flush_interval: float,
+                 max_flush_attempts: int = 3):
+        self.connection_pool = connection_pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_flush_attempts = max_flush_attempts
+        self._rows: Dict[str, List[tuple]] = {table: [] for table in USAGE_TABLES_COLUMNS}
+        self._failed_attempts: Dict[str, int] = {table: 0 for table in USAGE_TABLES_COLUMNS}
+        self._pending_count = 0
+        self._flush_lock = asyncio.Lock()
+        self._flushing = PeriodicTask(self.flush_logged, flush_interval)
+        self._batch_flush_task = None
+
+    def __len__(self):
+        return self._pending_count
+
+    async def add(self, table: str, user_id: int, *values):
+        *values, price = values
+        if not isinstance(price, Decimal):
+            price = Decimal(str(price))
+        cdate = datetime.datetime.now(datetime.timezone.utc)
+        self._rows[table].append((user_id, *values, price, cdate))
+        self._pending_count += 1
+        if self._pending_count >= self.batch_size and self._batch_flush_task is None:
+            self._batch_flush_task = asyncio.create_task(self._flush_batch())
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending_count:
+                return
+            rows, self._rows = self._rows, {table: [] for table in USAGE_TABLES_COLUMNS}
+            self._pending_count = 0
+
+            error = None
+            for table, table_rows in rows.items():
+                if not table_rows:
+                    continue
+                try:
+                    await self.connection_pool.copy_records_to_table(
+                        table, records=table_rows, columns=USAGE_TABLES_COLUMNS[table], schema_name='chatgpttg',
+                    )
+                except Exception as e:
+                    error = e
+                    self._failed_attempts[table] += 1
+                    if self._failed_attempts[table] >= self.max_flush_attempts:
+                        logger.error(
+                            'Dropped %s %s rows after %s failed flushes', len(table_rows), table,
+                            self._failed_attempts[table],
+                        )
+                        self._failed_attempts[table] = 0
+                        continue
+                    # rows are kept to be written with the next flush
+                    self._rows[table][:0] = table_rows
+                    self._pending_count += len(table_rows)
+                else:
+                    self._failed_attempts[table] = 0
+            if error is not None:
+                raise error
+
+    async def flush_logged(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.exception('Failed to flush usage rows: %s', e)
+
+    async def _flush_batch(self):
+        try:
+            await self.flush_logged()
+        finally:
+            self._batch_flush_task = None
+
+    def start(self):
+        self._flushing.start()
+
+    async def stop(self):
+        await self._flushing.stop()
+        if self._batch_flush_task is not None:
+            await self._batch_flush_task
+        await self.flush_logged()
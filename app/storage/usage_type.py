@@ -0,0 +1,8 @@
+from enum import Enum
+
+
+class UsageType(Enum):
+    COMPLETION = 'completion'
+    WHISPER = 'whisper'
+    IMAGE_GENERATION = 'image_generation'
+    TTS = 'tts'
@@ -0,0 +1,40 @@
+import asyncio
+import inspect
+from typing import Any, Callable, Optional
+
+
+async def cancel_task(task: Optional[asyncio.Task]):
+    """Cancels the task and waits until it ends."""
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+class PeriodicTask:
+    """
+    Calls the function every interval seconds once started, coroutine functions are awaited.
+    An interval of 0 disables the task.
+    """
+    def __init__(self, function: Callable[[], Any], interval: float):
+        self.function = function
+        self.interval = interval
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            result = self.function()
+            if inspect.isawaitable(result):
+                await result
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        await cancel_task(self._task)
+        self._task = None
@@ -2,12 +2,13 @@ import logging
 
 import settings
 from app.bot.telegram_bot import TelegramBot
+from app.bot.telegram_rate_limiter import RateLimitedBot
 from app.bot.utils import get_image_proxy_url
 from app.openai_helpers.utils import OpenAIAsync
 
-from aiogram import Bot, Dispatcher
+from aiogram import Dispatcher
 
-bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
+bot = RateLimitedBot(token=settings.TELEGRAM_BOT_TOKEN)
 dp = Dispatcher(bot)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -24,6 +24,4 @@ CREATE TABLE IF NOT EXISTS chatgpttg.message
     tg_message_id bigint NOT NULL
 );
 
-CREATE INDEX IF NOT EXISTS message_user_id_idx ON chatgpttg.message USING hash(user_id);
 CREATE INDEX IF NOT EXISTS message_cdate_idx ON chatgpttg.message USING btree(cdate);
-CREATE INDEX IF NOT EXISTS message_tg_message_id_idx ON chatgpttg.message USING hash(tg_message_id);
@@ -0,0 +1,4 @@
+CREATE SCHEMA IF NOT EXISTS chatgpttg;
+
+-- token counts of message keyed by encoder family (e.g. {"cl100k_base": 42}), filled on message creation
+ALTER TABLE chatgpttg.message ADD COLUMN IF NOT EXISTS tokens_count jsonb NOT NULL DEFAULT '{}';
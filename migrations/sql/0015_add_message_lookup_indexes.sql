@@ -0,0 +1,13 @@
+CREATE SCHEMA IF NOT EXISTS chatgpttg;
+
+-- last message of the chat: WHERE user_id = $1 AND tg_chat_id = $2 ORDER BY cdate DESC, id DESC LIMIT 1
+CREATE INDEX IF NOT EXISTS message_user_id_tg_chat_id_cdate_id_idx ON chatgpttg.message USING btree(user_id, tg_chat_id, cdate DESC, id DESC);
+-- message by telegram reply: WHERE tg_chat_id = $1 AND tg_message_id = $2
+CREATE INDEX IF NOT EXISTS message_tg_chat_id_tg_message_id_idx ON chatgpttg.message USING btree(tg_chat_id, tg_message_id);
+
+-- single column hash indexes of databases created before 0000_init stopped creating them,
+-- superseded by the composite ones above
+DROP INDEX IF EXISTS chatgpttg.message_user_id_idx;
+DROP INDEX IF EXISTS chatgpttg.message_tg_message_id_idx;
+-- replaced by the index above, rows of one batch insert share cdate and are ordered by id
+DROP INDEX IF EXISTS chatgpttg.message_user_id_tg_chat_id_cdate_idx;
@@ -0,0 +1,37 @@
+CREATE SCHEMA IF NOT EXISTS chatgpttg;
+
+-- message chains are stored as parent pointers instead of full arrays of previous message ids:
+-- parent_id is the previous message of the branch, for summary messages it is the last summarized message,
+-- summary_id is the summary heading the branch, if any, ancestors covered by it are not loaded.
+-- Columns and backfill are added once, the backfill scans the whole message table (all partitions after 0018)
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = 'chatgpttg' AND table_name = 'message' AND column_name = 'parent_id'
+    ) THEN
+        RETURN;
+    END IF;
+
+    ALTER TABLE chatgpttg.message ADD COLUMN parent_id bigint;
+    ALTER TABLE chatgpttg.message ADD COLUMN IF NOT EXISTS summary_id bigint;
+
+    -- backfill: parent is the last of previous messages
+    UPDATE chatgpttg.message
+    SET parent_id = previous_message_ids[cardinality(previous_message_ids)]
+    WHERE parent_id IS NULL AND cardinality(previous_message_ids) > 0 AND message_type <> 'summary';
+
+    -- backfill: summary always was the first of previous messages
+    UPDATE chatgpttg.message AS m
+    SET summary_id = s.id
+    FROM chatgpttg.message AS s
+    WHERE m.summary_id IS NULL AND s.id = m.previous_message_ids[1] AND s.message_type = 'summary';
+
+    -- backfill: summary covers everything before the first message kept after it
+    UPDATE chatgpttg.message AS s
+    SET parent_id = kept.parent_id
+    FROM chatgpttg.message AS m
+    JOIN chatgpttg.message AS kept ON kept.id = m.previous_message_ids[2]
+    WHERE s.parent_id IS NULL AND s.message_type = 'summary' AND m.summary_id = s.id AND m.previous_message_ids[1] = s.id;
+END;
+$$;
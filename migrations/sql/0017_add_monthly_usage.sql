@@ -0,0 +1,133 @@
+CREATE SCHEMA IF NOT EXISTS chatgpttg;
+
+-- per-user, per-model monthly totals of all usage tables, read by /usage and /usage_all,
+-- kept up to date by statement level triggers on the usage tables (one upsert per COPY batch)
+CREATE TABLE IF NOT EXISTS chatgpttg.monthly_usage
+(
+    month date NOT NULL,
+    user_id bigint NOT NULL,
+    usage_type text NOT NULL,
+    model text NOT NULL DEFAULT '',
+    resolution text NOT NULL DEFAULT '',
+    prompt_tokens bigint NOT NULL DEFAULT 0,
+    completion_tokens bigint NOT NULL DEFAULT 0,
+    total_tokens bigint NOT NULL DEFAULT 0,
+    audio_seconds bigint NOT NULL DEFAULT 0,
+    characters_count bigint NOT NULL DEFAULT 0,
+    usage_count bigint NOT NULL DEFAULT 0,
+    price numeric(20, 10) NOT NULL DEFAULT 0.0000000000,
+    PRIMARY KEY (month, user_id, usage_type, model, resolution)
+);
+
+CREATE OR REPLACE FUNCTION chatgpttg.rollup_completion_usage() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO chatgpttg.monthly_usage AS mu
+        (month, user_id, usage_type, model, prompt_tokens, completion_tokens, total_tokens, usage_count, price)
+    SELECT date_trunc('month', cdate)::date, user_id, 'completion', model,
+           SUM(prompt_tokens), SUM(completion_tokens), SUM(total_tokens), COUNT(*), SUM(price)
+    FROM new_rows
+    GROUP BY 1, user_id, model
+    ON CONFLICT (month, user_id, usage_type, model, resolution) DO UPDATE SET
+        prompt_tokens = mu.prompt_tokens + EXCLUDED.prompt_tokens,
+        completion_tokens = mu.completion_tokens + EXCLUDED.completion_tokens,
+        total_tokens = mu.total_tokens + EXCLUDED.total_tokens,
+        usage_count = mu.usage_count + EXCLUDED.usage_count,
+        price = mu.price + EXCLUDED.price;
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION chatgpttg.rollup_whisper_usage() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO chatgpttg.monthly_usage AS mu (month, user_id, usage_type, audio_seconds, usage_count, price)
+    SELECT date_trunc('month', cdate)::date, user_id, 'whisper', SUM(audio_seconds), COUNT(*), SUM(price)
+    FROM new_rows
+    GROUP BY 1, user_id
+    ON CONFLICT (month, user_id, usage_type, model, resolution) DO UPDATE SET
+        audio_seconds = mu.audio_seconds + EXCLUDED.audio_seconds,
+        usage_count = mu.usage_count + EXCLUDED.usage_count,
+        price = mu.price + EXCLUDED.price;
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION chatgpttg.rollup_image_generation_usage() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO chatgpttg.monthly_usage AS mu (month, user_id, usage_type, model, resolution, usage_count, price)
+    SELECT date_trunc('month', cdate)::date, user_id, 'image_generation', model, resolution, COUNT(*), SUM(price)
+    FROM new_rows
+    GROUP BY 1, user_id, model, resolution
+    ON CONFLICT (month, user_id, usage_type, model, resolution) DO UPDATE SET
+        usage_count = mu.usage_count + EXCLUDED.usage_count,
+        price = mu.price + EXCLUDED.price;
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION chatgpttg.rollup_tts_usage() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO chatgpttg.monthly_usage AS mu (month, user_id, usage_type, model, characters_count, usage_count, price)
+    SELECT date_trunc('month', cdate)::date, user_id, 'tts', model, SUM(characters_count), COUNT(*), SUM(price)
+    FROM new_rows
+    GROUP BY 1, user_id, model
+    ON CONFLICT (month, user_id, usage_type, model, resolution) DO UPDATE SET
+        characters_count = mu.characters_count + EXCLUDED.characters_count,
+        usage_count = mu.usage_count + EXCLUDED.usage_count,
+        price = mu.price + EXCLUDED.price;
+    RETURN NULL;
+END;
+$$;
+
+-- triggers and backfill run once, while monthly_usage is empty: totals outlive raw rows removed by retention (0018),
+-- so they are never rebuilt from raw rows. Inserts are blocked meanwhile, so no row is counted twice or missed
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM chatgpttg.monthly_usage) THEN
+        RETURN;
+    END IF;
+    LOCK TABLE chatgpttg.completion_usage, chatgpttg.whisper_usage, chatgpttg.image_generation_usage, chatgpttg.tts_usage
+        IN SHARE ROW EXCLUSIVE MODE;
+    -- usage could be rolled up while waiting for the lock
+    IF EXISTS (SELECT 1 FROM chatgpttg.monthly_usage) THEN
+        RETURN;
+    END IF;
+
+    DROP TRIGGER IF EXISTS completion_usage_rollup ON chatgpttg.completion_usage;
+    CREATE TRIGGER completion_usage_rollup AFTER INSERT ON chatgpttg.completion_usage
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION chatgpttg.rollup_completion_usage();
+
+    DROP TRIGGER IF EXISTS whisper_usage_rollup ON chatgpttg.whisper_usage;
+    CREATE TRIGGER whisper_usage_rollup AFTER INSERT ON chatgpttg.whisper_usage
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION chatgpttg.rollup_whisper_usage();
+
+    DROP TRIGGER IF EXISTS image_generation_usage_rollup ON chatgpttg.image_generation_usage;
+    CREATE TRIGGER image_generation_usage_rollup AFTER INSERT ON chatgpttg.image_generation_usage
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION chatgpttg.rollup_image_generation_usage();
+
+    DROP TRIGGER IF EXISTS tts_usage_rollup ON chatgpttg.tts_usage;
+    CREATE TRIGGER tts_usage_rollup AFTER INSERT ON chatgpttg.tts_usage
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION chatgpttg.rollup_tts_usage();
+
+    INSERT INTO chatgpttg.monthly_usage
+        (month, user_id, usage_type, model, prompt_tokens, completion_tokens, total_tokens, usage_count, price)
+    SELECT date_trunc('month', cdate)::date, user_id, 'completion', model,
+           SUM(prompt_tokens), SUM(completion_tokens), SUM(total_tokens), COUNT(*), SUM(price)
+    FROM chatgpttg.completion_usage
+    GROUP BY 1, user_id, model;
+
+    INSERT INTO chatgpttg.monthly_usage (month, user_id, usage_type, audio_seconds, usage_count, price)
+    SELECT date_trunc('month', cdate)::date, user_id, 'whisper', SUM(audio_seconds), COUNT(*), SUM(price)
+    FROM chatgpttg.whisper_usage
+    GROUP BY 1, user_id;
+
+    INSERT INTO chatgpttg.monthly_usage (month, user_id, usage_type, model, resolution, usage_count, price)
+    SELECT date_trunc('month', cdate)::date, user_id, 'image_generation', model, resolution, COUNT(*), SUM(price)
+    FROM chatgpttg.image_generation_usage
+    GROUP BY 1, user_id, model, resolution;
+
+    INSERT INTO chatgpttg.monthly_usage (month, user_id, usage_type, model, characters_count, usage_count, price)
+    SELECT date_trunc('month', cdate)::date, user_id, 'tts', model, SUM(characters_count), COUNT(*), SUM(price)
+    FROM chatgpttg.tts_usage
+    GROUP BY 1, user_id, model;
+END;
+$$;
@@ -0,0 +1,98 @@
+CREATE SCHEMA IF NOT EXISTS chatgpttg;
+-- expired partitions are moved here when they are archived instead of dropped
+CREATE SCHEMA IF NOT EXISTS chatgpttg_archive;
+
+-- partition of chatgpttg.<parent> for one calendar month (UTC), named <parent>_pYYYY_MM
+CREATE OR REPLACE FUNCTION chatgpttg.create_month_partition(parent text, month date) RETURNS text LANGUAGE plpgsql AS $$
+DECLARE
+    partition text := format('%s_p%s', parent, to_char(month, 'YYYY_MM'));
+    month_start timestamp := date_trunc('month', month);
+BEGIN
+    IF to_regclass(format('chatgpttg.%I', partition)) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE chatgpttg.%I PARTITION OF chatgpttg.%I FOR VALUES FROM (%L) TO (%L)',
+            partition, parent,
+            month_start AT TIME ZONE 'UTC', (month_start + interval '1 month') AT TIME ZONE 'UTC'
+        );
+    END IF;
+    RETURN partition;
+END;
+$$;
+
+-- replaces chatgpttg.<parent> with a copy range partitioned by month on cdate, primary key becomes (id, cdate);
+-- partitions cover existing rows and the next months, the default partition catches rows outside of them;
+-- does nothing if the table is partitioned already, migrations are re-run on every start
+CREATE OR REPLACE FUNCTION chatgpttg.partition_by_month(parent text, months_ahead int) RETURNS void LANGUAGE plpgsql AS $$
+DECLARE
+    old_table text := parent || '_unpartitioned';
+    serial_column record;
+    month date;
+    last_month date := (date_trunc('month', NOW() AT TIME ZONE 'UTC') + make_interval(months => months_ahead))::date;
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'chatgpttg' AND c.relname = parent AND c.relkind = 'p'
+    ) THEN
+        RETURN;
+    END IF;
+    EXECUTE format('LOCK TABLE chatgpttg.%I IN ACCESS EXCLUSIVE MODE', parent);
+    EXECUTE format('ALTER TABLE chatgpttg.%I RENAME TO %I', parent, old_table);
+    EXECUTE format(
+        'CREATE TABLE chatgpttg.%I (LIKE chatgpttg.%I INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE (cdate)',
+        parent, old_table
+    );
+    EXECUTE format('ALTER TABLE chatgpttg.%I ADD PRIMARY KEY (id, cdate)', parent);
+
+    EXECUTE format('SELECT date_trunc(''month'', MIN(cdate) AT TIME ZONE ''UTC'')::date FROM chatgpttg.%I', old_table)
+        INTO month;
+    month := LEAST(COALESCE(month, last_month), date_trunc('month', NOW() AT TIME ZONE 'UTC')::date);
+    WHILE month <= last_month LOOP
+        PERFORM chatgpttg.create_month_partition(parent, month);
+        month := month + interval '1 month';
+    END LOOP;
+    EXECUTE format('CREATE TABLE chatgpttg.%I PARTITION OF chatgpttg.%I DEFAULT', parent || '_default', parent);
+
+    EXECUTE format('INSERT INTO chatgpttg.%I SELECT * FROM chatgpttg.%I', parent, old_table);
+    -- sequences of serial columns are owned by the old table and would be dropped with it
+    FOR serial_column IN
+        SELECT attname, pg_get_serial_sequence(attrelid::regclass::text, attname) AS sequence_name
+        FROM pg_attribute
+        WHERE attrelid = format('chatgpttg.%I', old_table)::regclass AND attnum > 0 AND NOT attisdropped
+    LOOP
+        IF serial_column.sequence_name IS NOT NULL THEN
+            EXECUTE format('ALTER SEQUENCE %s OWNED BY chatgpttg.%I.%I',
+                           serial_column.sequence_name, parent, serial_column.attname);
+        END IF;
+    END LOOP;
+    EXECUTE format('DROP TABLE chatgpttg.%I', old_table);
+END;
+$$;
+
+BEGIN;
+
+SELECT chatgpttg.partition_by_month('message', 3);
+-- same lookup indexes as 0015, created on every partition
+CREATE INDEX IF NOT EXISTS message_user_id_tg_chat_id_cdate_id_idx ON chatgpttg.message USING btree(user_id, tg_chat_id, cdate DESC, id DESC);
+CREATE INDEX IF NOT EXISTS message_tg_chat_id_tg_message_id_idx ON chatgpttg.message USING btree(tg_chat_id, tg_message_id);
+
+-- raw usage rows are only read by retention now, totals are kept in monthly_usage
+SELECT chatgpttg.partition_by_month('completion_usage', 3);
+SELECT chatgpttg.partition_by_month('whisper_usage', 3);
+SELECT chatgpttg.partition_by_month('image_generation_usage', 3);
+SELECT chatgpttg.partition_by_month('tts_usage', 3);
+
+-- rollup triggers of 0017 were dropped together with the old tables
+DROP TRIGGER IF EXISTS completion_usage_rollup ON chatgpttg.completion_usage;
+CREATE TRIGGER completion_usage_rollup AFTER INSERT ON chatgpttg.completion_usage
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION chatgpttg.rollup_completion_usage();
+DROP TRIGGER IF EXISTS whisper_usage_rollup ON chatgpttg.whisper_usage;
+CREATE TRIGGER whisper_usage_rollup AFTER INSERT ON chatgpttg.whisper_usage
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION chatgpttg.rollup_whisper_usage();
+DROP TRIGGER IF EXISTS image_generation_usage_rollup ON chatgpttg.image_generation_usage;
+CREATE TRIGGER image_generation_usage_rollup AFTER INSERT ON chatgpttg.image_generation_usage
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION chatgpttg.rollup_image_generation_usage();
+DROP TRIGGER IF EXISTS tts_usage_rollup ON chatgpttg.tts_usage;
+CREATE TRIGGER tts_usage_rollup AFTER INSERT ON chatgpttg.tts_usage
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION chatgpttg.rollup_tts_usage();
+
+COMMIT;
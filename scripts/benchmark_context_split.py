@@ -0,0 +1,80 @@
+"""
+Benchmark of DialogManager.split_context_by_token_length against the previous implementation,
+which re-tokenized the whole right part of the context for every split point.
+
+Usage: python scripts/benchmark_context_split.py
+"""
+import datetime
+import time
+from types import SimpleNamespace
+
+from app.context.dialog_manager import DialogManager
+from app.llm_models import LLMContextConfiguration
+from app.openai_helpers.chatgpt import DialogMessage
+from app.openai_helpers.count_tokens import count_dialog_messages_tokens
+from app.storage.db import Message, MessageType
+
+MODEL = 'gpt-4.1'
+BRANCH_SIZES = [50, 200, 1000]
+MESSAGE_TEXT = 'The quick brown fox jumps over the lazy dog. ' * 20
+REPEATS = 3
+
+
+def build_branch(size):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return [
+        Message(
+            id=i, user_id=1, cdate=now, activation_dtime=now, parent_id=i - 1 if i else None, tg_chat_id=1,
+            tg_message_id=i, message_type=MessageType.MESSAGE,
+            message=DialogMessage(role='user' if i % 2 else 'assistant', content=f'{i}: {MESSAGE_TEXT}'),
+        )
+        for i in range(size)
+    ]
+
+
+def legacy_split_context_by_token_length(messages, token_length):
+    for split_point in range(len(messages)):
+        right_dialog_messages = (d.message for d in messages[split_point:])
+        right_length = count_dialog_messages_tokens(right_dialog_messages, MODEL)
+        if right_length <= token_length:
+            return messages[:split_point], messages[split_point:]
+    else:
+        return messages, []
+
+
+def measure(function):
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    context_configuration = LLMContextConfiguration(
+        short_term_memory_tokens=32 * 1024, summary_length=8 * 1024, hard_max_context_size=64 * 1024,
+    )
+    user = SimpleNamespace(current_model=MODEL)
+    dialog_manager = DialogManager(None, user, context_configuration)
+    token_length = context_configuration.short_term_memory_tokens / 2
+
+    print(f'{"messages":>10} {"legacy, ms":>12} {"cold, ms":>12} {"warm, ms":>12}')
+    for size in BRANCH_SIZES:
+        legacy_time, legacy_result = measure(lambda: legacy_split_context_by_token_length(build_branch(size), token_length))
+
+        # cold: token counts are not stored yet, every message is tokenized once
+        cold_time, cold_result = measure(lambda: dialog_manager.split_context_by_token_length(build_branch(size)))
+
+        # warm: token counts are already stored with messages, as it happens for messages loaded from DB
+        branch = build_branch(size)
+        dialog_manager.split_context_by_token_length(branch)
+        warm_time, _ = measure(lambda: dialog_manager.split_context_by_token_length(branch))
+
+        assert len(legacy_result[0]) == len(cold_result[0]), 'split point differs from legacy implementation'
+        print(f'{size:>10} {legacy_time * 1000:>12.2f} {cold_time * 1000:>12.2f} {warm_time * 1000:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
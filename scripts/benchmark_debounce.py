@@ -0,0 +1,85 @@
+"""
+Benchmark of the batching debounce of BatchedInputHandler with many concurrent users: the previous Timer,
+which polled 100 times per window, against the current one rescheduling a single loop callback.
+Every simulated user sends a burst of messages, each one resetting the timer, and waits for the window to expire.
+Loop wakeups are counted as scheduled timer callbacks, the burst itself schedules the same number for both.
+
+Usage: python scripts/benchmark_debounce.py [users ...]
+"""
+import asyncio
+import sys
+import time
+
+from app.bot.utils import Timer
+
+TIMEOUT = 0.3
+BURST_SIZE = 3
+BURST_GAP = 0.05
+DEFAULT_USERS = (1000, 10000)
+
+
+class LegacyTimer:
+    def __init__(self, timeout=0.3):
+        self.timeout = timeout
+        self._current_timeout = timeout
+        self.step = timeout / 100
+
+    async def sleep(self):
+        while True:
+            await asyncio.sleep(self.step)
+            self._current_timeout -= self.step
+            if self._current_timeout <= 0:
+                break
+
+    def reset(self):
+        self._current_timeout = self.timeout
+
+
+class CountingEventLoop(asyncio.SelectorEventLoop):
+    def __init__(self):
+        super().__init__()
+        self.scheduled_callbacks = 0
+
+    def call_at(self, when, callback, *args, context=None):
+        self.scheduled_callbacks += 1
+        return super().call_at(when, callback, *args, context=context)
+
+
+async def simulate_user(timer_class):
+    timer = timer_class(TIMEOUT)
+    timer.reset()
+    window = asyncio.create_task(timer.sleep())
+    for _ in range(BURST_SIZE - 1):
+        await asyncio.sleep(BURST_GAP)
+        timer.reset()
+    await window
+
+
+async def simulate_users(timer_class, users):
+    await asyncio.gather(*[simulate_user(timer_class) for _ in range(users)])
+
+
+def measure(timer_class, users):
+    loop = CountingEventLoop()
+    try:
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        loop.run_until_complete(simulate_users(timer_class, users))
+        wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+        return loop.scheduled_callbacks, wall, cpu
+    finally:
+        loop.close()
+
+
+def main():
+    users_counts = [int(arg) for arg in sys.argv[1:]] or DEFAULT_USERS
+    window = TIMEOUT + BURST_GAP * (BURST_SIZE - 1)
+    print(f'{BURST_SIZE} messages per user {BURST_GAP}s apart, {TIMEOUT}s window (ideal {window:.2f}s)')
+    for users in users_counts:
+        for timer_class in (LegacyTimer, Timer):
+            callbacks, wall, cpu = measure(timer_class, users)
+            print(f'{users:6d} users {timer_class.__name__:12s} {callbacks:9d} wakeups '
+                  f'{wall:6.2f}s wall {cpu:6.2f}s cpu')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark of decoding a dialog branch read from the message table: the previous implementation which got
+jsonb columns as text and json.loads them into a copied dict, against records already decoded by the
+jsonb codec registered in init_connection.
+
+Usage: python scripts/benchmark_message_decoding.py
+"""
+import datetime
+import json
+import time
+
+from app.storage.db import Message, MessageType, _json_loads, orjson
+
+BRANCH_SIZE = 200
+MESSAGE_TEXT = 'The quick brown fox jumps over the lazy dog. ' * 20
+REPEATS = 20
+
+
+def build_raw_records(size):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return [
+        {
+            'id': i, 'user_id': 1, 'cdate': now, 'activation_dtime': now, 'parent_id': i - 1 if i else None,
+            'tg_chat_id': 1, 'tg_message_id': i, 'message_type': MessageType.MESSAGE.value,
+            'message': json.dumps({'role': 'user' if i % 2 else 'assistant', 'content': f'{i}: {MESSAGE_TEXT}'}),
+            'tokens_count': json.dumps({'o200k_base': 200}),
+        }
+        for i in range(size)
+    ]
+
+
+def legacy_decode(raw_records):
+    result = []
+    for record in raw_records:
+        record = dict(record)
+        record['message'] = json.loads(record['message'])
+        record['tokens_count'] = json.loads(record['tokens_count'])
+        result.append(record)
+    return [Message(**record) for record in result]
+
+
+def codec_decode(raw_records):
+    # asyncpg runs the registered decoder for every jsonb value while reading the rows
+    records = [
+        {**record, 'message': _json_loads(record['message']), 'tokens_count': _json_loads(record['tokens_count'])}
+        for record in raw_records
+    ]
+    return [Message(**record) for record in records]
+
+
+def measure(function, *args):
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    raw_records = build_raw_records(BRANCH_SIZE)
+    print(f'{BRANCH_SIZE} messages, JSON backend: {"orjson" if orjson is not None else "json"}')
+
+    legacy_time, legacy_messages = measure(legacy_decode, raw_records)
+    codec_time, codec_messages = measure(codec_decode, raw_records)
+    assert legacy_messages == codec_messages
+
+    print(f'legacy: {legacy_time * 1000:8.2f} ms')
+    print(f'codec:  {codec_time * 1000:8.2f} ms ({legacy_time / codec_time:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
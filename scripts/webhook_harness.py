@@ -0,0 +1,80 @@
+"""
+Local harness of the webhook mode: posts synthetic text message updates to a running bot (or a load balancer
+in front of several replicas) the way Telegram does, and reports accepted and refused (503) updates
+and response latencies.
+
+Usage: python scripts/webhook_harness.py [--url URL] [--updates N] [--users N] [--concurrency N] [--secret-token T]
+"""
+import argparse
+import asyncio
+import time
+from collections import Counter
+
+import aiohttp
+
+DEFAULT_URL = 'http://localhost:8080/telegram/webhook'
+
+
+def make_update(update_id: int, user_id: int) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Load', 'username': f'load_{user_id}'},
+            'chat': {'id': user_id, 'type': 'private'},
+            'date': int(time.time()),
+            'text': f'Synthetic message {update_id}',
+        },
+    }
+
+
+async def post_updates(url: str, updates: int, users: int, concurrency: int, secret_token: str):
+    statuses = Counter()
+    latencies = []
+    queue = asyncio.Queue()
+    for n in range(updates):
+        queue.put_nowait(make_update(n + 1, 1_000_000 + n % users))
+
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret_token} if secret_token else {}
+    async with aiohttp.ClientSession(headers=headers) as session:
+        async def worker():
+            while not queue.empty():
+                update = queue.get_nowait()
+                start = time.perf_counter()
+                try:
+                    async with session.post(url, json=update) as response:
+                        await response.read()
+                        statuses[response.status] += 1
+                except aiohttp.ClientError as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    return statuses, sorted(latencies), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=DEFAULT_URL)
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=40, help='like max_connections of the webhook')
+    parser.add_argument('--secret-token', default='')
+    args = parser.parse_args()
+
+    statuses, latencies, elapsed = asyncio.run(
+        post_updates(args.url, args.updates, args.users, args.concurrency, args.secret_token)
+    )
+    print(f'{args.updates} updates from {args.users} users in {elapsed:.2f}s ({args.updates / elapsed:.0f}/s)')
+    for status, count in sorted(statuses.items(), key=str):
+        print(f'  {status}: {count}')
+    if latencies:
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)]
+        print(f'  latency p50 {p50 * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -71,6 +71,77 @@ OPENAI_CHAT_COMPLETION_TEMPERATURE = 0.3
 MESSAGE_EXPIRATION_WINDOW = 60 * 60  # 1 hour
 POSTGRES_TIMEZONE = pytz.timezone('UTC')
 SUCCESSIVE_FUNCTION_CALLS_LIMIT = 12  # limit of successive function calls that model can make
+# Streaming answers are coalesced before they reach the transport: a new snapshot is produced
+# when this many seconds passed since the previous one or this many new characters arrived
+STREAMING_SNAPSHOT_INTERVAL = 0.25
+STREAMING_SNAPSHOT_MAX_CHARS = 512
+# Streamed Telegram messages are edited at most every STREAMING_EDIT_MIN_INTERVAL seconds, the interval grows by
+# one more minimum every STREAMING_EDIT_LENGTH_STEP characters of the message and doubles for every
+# STREAMING_EDIT_PRESSURE_STEP calls waiting for the Telegram rate limiter, up to STREAMING_EDIT_MAX_INTERVAL
+STREAMING_EDIT_MIN_INTERVAL = 1
+STREAMING_EDIT_MAX_INTERVAL = 5
+STREAMING_EDIT_LENGTH_STEP = 4000
+STREAMING_EDIT_PRESSURE_STEP = 30
+# In-process cache of user records, saves a DB round trip on every incoming update
+USER_CACHE_SIZE = 10000  # 0 disables the cache, it is disabled with several worker processes or replicas
+USER_CACHE_TTL = 60  # seconds
+# In-process cache of recent dialog branches, saves reloading of the branch on every turn
+BRANCH_CACHE_SIZE = 1000  # 0 disables the cache
+# Usage rows are written in batches in background, when this many rows are pending or every interval
+USAGE_FLUSH_BATCH_SIZE = 100
+USAGE_FLUSH_INTERVAL = 5  # seconds
+USAGE_FLUSH_MAX_ATTEMPTS = 3  # failed writes in a row after which pending rows of a table are dropped
+# Input batches are processed by at most this many concurrent turns, turns of one user run in order,
+# users waiting for a turn are served in proportion to the weight of their role
+TURN_SCHEDULER_WORKERS = 32
+TURN_SCHEDULER_ROLE_WEIGHTS = {UserRole.ADMIN: 4, UserRole.ADVANCED: 2, UserRole.BASIC: 1, UserRole.STRANGER: 1}
+TURN_SCHEDULER_METRICS_INTERVAL = 60  # seconds between turn queue log records, 0 disables them
+# Sizes of in-process registries (caches, per-user state) and RSS are logged with this interval, 0 disables it
+MEMORY_REPORT_INTERVAL = 60 * 60  # 1 hour
+# Outbound Bot API calls to chats are limited globally and per chat (calls per second),
+# a waiting edit of a message is replaced by a newer one, flood control errors are retried after the given delay
+TELEGRAM_GLOBAL_RATE_LIMIT = 30
+TELEGRAM_CHAT_RATE_LIMIT = 1
+TELEGRAM_CHAT_BURST = 3  # calls a chat can make at once after being idle
+TELEGRAM_RETRY_AFTER_MAX_RETRIES = 3
+TELEGRAM_RATE_LIMITER_METRICS_INTERVAL = 60  # seconds between outbound queue log records, 0 disables them
+# Updates are received by long polling ('polling') or by an HTTP endpoint ('webhook'), the webhook mode
+# lets several replicas run behind a load balancer available at WEBHOOK_URL, see WEBHOOK_REPLICA_URLS
+TELEGRAM_TRANSPORT = 'polling'
+WEBHOOK_URL = ''  # public https://host of the load balancer, empty leaves the registered webhook as is
+WEBHOOK_PATH = '/telegram/webhook'
+WEBHOOK_HOST = '0.0.0.0'
+WEBHOOK_PORT = 8080
+WEBHOOK_SECRET_TOKEN = ''  # checked in the X-Telegram-Bot-Api-Secret-Token header when set
+WEBHOOK_MAX_CONNECTIONS = 40  # parallel connections Telegram opens to the webhook
+# Updates accepted by a replica and not handled yet, more are refused with 503 and Retry-After
+WEBHOOK_MAX_IN_FLIGHT_UPDATES = 200
+WEBHOOK_RETRY_AFTER = 1  # seconds
+# Batching, turn order and the Stop button need all updates of a user in one replica, a load balancer can not
+# route by user: with several replicas list the webhook endpoints of all of them (same order on every replica),
+# a replica forwards an update to the replica of its user. Empty handles every update where it arrives
+WEBHOOK_REPLICA_URLS = []
+WEBHOOK_REPLICA_INDEX = 0  # position of this replica in WEBHOOK_REPLICA_URLS
+WEBHOOK_REPLICA_FORWARD_TIMEOUT = 5  # seconds, an update the owner replica did not accept gets 503
+# Monthly usage report, partition maintenance and bot commands are run by the primary instance only,
+# set to False on every replica but one
+BOT_PRIMARY_INSTANCE = True
+# More than 1 runs the bot in this many worker processes, updates are passed to them by user id
+# from the process receiving them, so all updates of a user (including the Stop button) reach the same worker
+BOT_WORKER_PROCESSES = 1
+BOT_WORKER_CHECK_INTERVAL = 5  # seconds, the bot stops if a worker process exited
+BOT_WORKER_STOP_TIMEOUT = 30  # seconds given to workers to finish queued updates on shutdown
+# A worker handles at most BOT_WORKER_MAX_IN_FLIGHT_UPDATES updates at once, more wait in its queue of
+# BOT_WORKER_QUEUE_SIZE updates; with a full queue the webhook refuses updates with 503 and polling waits
+BOT_WORKER_MAX_IN_FLIGHT_UPDATES = 100
+BOT_WORKER_QUEUE_SIZE = 100
+# Message and usage tables are partitioned by month, partitions are created this many months ahead
+PARTITION_PREMAKE_MONTHS = 3
+# Previous months of messages and raw usage rows to keep, None keeps everything.
+# Usage totals stay in the monthly usage rollup, replies to removed messages start a new dialog
+MESSAGE_RETENTION_MONTHS = None
+USAGE_RETENTION_MONTHS = None
+PARTITION_RETENTION_ARCHIVE = True  # expired partitions are moved to chatgpttg_archive schema instead of dropped
 
 # Database settings
 # Change these if you know what you're doing
@@ -79,6 +150,13 @@ POSTGRES_PORT = 5432
 POSTGRES_USER = 'postgres'
 POSTGRES_PASSWORD = 'password'
 POSTGRES_DATABASE = 'chatgpttg'
+# Connection pool sizing, connections idle for longer than the lifetime are closed (0 keeps them)
+POSTGRES_POOL_MIN_SIZE = 10
+POSTGRES_POOL_MAX_SIZE = 10
+POSTGRES_POOL_MAX_INACTIVE_CONNECTION_LIFETIME = 300.0  # seconds
+# Statements prepared implicitly by asyncpg and kept per connection, the hot ones are always prepared
+POSTGRES_STATEMENT_CACHE_SIZE = 100
+POSTGRES_POOL_METRICS_INTERVAL = 60  # seconds between pool utilisation log records, 0 disables them
 
 # Additional Image proxy settings
 # Change these if you know what you're doing
@@ -39,11 +39,13 @@ get_models.cache_clear()
 from aiogram import Bot, Dispatcher
 from aiogram.types.base import TelegramObject
 from app.bot.telegram_bot import TelegramBot
-from app.storage.db import DBFactory, DB
+from app.bot.utils import Timer
+from app.storage.db import DBFactory, DB, create_connection_pool
 from app.openai_helpers.llm_client_factory import LLMClientFactory
 from tests.helpers.bot_spy import BotSpy
 
-import asyncpg
+
+_timer_init = Timer.__init__
 
 # Store reference to the test bot for the property override
 _test_bot_ref = None
@@ -101,7 +103,7 @@ def event_loop():
 async def db_pool(event_loop):
     """Session-scoped connection pool."""
     dsn = f'postgres://{settings.POSTGRES_USER}:{settings.POSTGRES_PASSWORD}@{settings.POSTGRES_HOST}:{settings.POSTGRES_PORT}/{settings.POSTGRES_DATABASE}'
-    pool = await asyncpg.create_pool(dsn)
+    pool = await create_connection_pool(dsn)
     # Override DB default so test users get gpt-3.5-turbo (matches test mock setup)
     await pool.execute("ALTER TABLE chatgpttg.user ALTER COLUMN current_model SET DEFAULT 'gpt-3.5-turbo'")
     yield pool
@@ -114,22 +116,6 @@ async def db(db_pool):
     return DB(db_pool)
 
 
-@pytest_asyncio.fixture(autouse=True)
-async def clean_db(db_pool):
-    """Truncate all tables after each test."""
-    yield
-    tables = [
-        'chatgpttg.tts_usage',
-        'chatgpttg.image_generation_usage',
-        'chatgpttg.whisper_usage',
-        'chatgpttg.completion_usage',
-        'chatgpttg.message',
-        'chatgpttg.user',
-    ]
-    for table in tables:
-        await db_pool.execute(f'DELETE FROM {table}')
-
-
 @pytest.fixture
 def mock_bot():
     """Bot with mocked request method."""
@@ -150,11 +136,7 @@ async def bot_app(mock_bot, db, db_pool):
     telegram_bot = TelegramBot(mock_bot, dp)
 
     # Patch Timer to be near-instant
-    with patch('app.bot.utils.Timer.__init__', lambda self, timeout=0.3: (
-        setattr(self, 'timeout', 0.001) or
-        setattr(self, '_current_timeout', 0.001) or
-        setattr(self, 'step', 0.0001)
-    )):
+    with patch('app.bot.utils.Timer.__init__', lambda self, timeout=0.3: _timer_init(self, timeout=0.001)):
         # Clear LLM client cache
         old_clients = LLMClientFactory._model_clients.copy()
         LLMClientFactory._model_clients.clear()
@@ -187,6 +169,14 @@ async def bot_app(mock_bot, db, db_pool):
         # Stop scheduled tasks but DON'T close the DB pool
         if telegram_bot.monthly_usage_task:
             await telegram_bot.monthly_usage_task.stop()
+        if telegram_bot.partition_maintenance_task:
+            await telegram_bot.partition_maintenance_task.stop()
+        if telegram_bot.turn_scheduler:
+            await telegram_bot.turn_scheduler.stop()
+        if telegram_bot.memory_report:
+            await telegram_bot.memory_report.stop()
+        await telegram_bot.db.usage_recorder.stop()
+        await telegram_bot.db.pool_metrics.stop()
 
         LLMClientFactory._model_clients = old_clients
         get_models.cache_clear()
@@ -0,0 +1,18 @@
+import pytest_asyncio
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def clean_db(db_pool):
+    """Truncate all tables after each test."""
+    yield
+    tables = [
+        'chatgpttg.tts_usage',
+        'chatgpttg.image_generation_usage',
+        'chatgpttg.whisper_usage',
+        'chatgpttg.completion_usage',
+        'chatgpttg.monthly_usage',
+        'chatgpttg.message',
+        'chatgpttg.user',
+    ]
+    for table in tables:
+        await db_pool.execute(f'DELETE FROM {table}')
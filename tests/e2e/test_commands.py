@@ -94,3 +94,32 @@ class TestCommands:
 
         spy.assert_sent_text_contains('gpt-removed')
         spy.assert_sent_text_contains('$')
+
+    async def test_usage_all_counts_users_without_completions(self, bot_app, db_pool):
+        """/usage_all reads the monthly rollup, which includes usage of every kind."""
+        telegram_bot, dp, mock_bot = bot_app
+
+        update = make_command_message('usage')
+        await dp.process_update(update)
+        await asyncio.sleep(0.05)
+
+        user_id = await db_pool.fetchval(
+            "SELECT id FROM chatgpttg.user WHERE telegram_id = $1", 12345
+        )
+        await db_pool.executemany(
+            "INSERT INTO chatgpttg.whisper_usage (user_id, audio_seconds, price) VALUES ($1, $2, $3)",
+            [(user_id, 60, 0.006), (user_id, 120, 0.012)],
+        )
+        audio_seconds = await db_pool.fetchval(
+            "SELECT audio_seconds FROM chatgpttg.monthly_usage WHERE user_id = $1 AND usage_type = 'whisper'",
+            user_id,
+        )
+        assert audio_seconds == 180
+
+        spy = BotSpy(mock_bot)
+        update = make_command_message('usage_all')
+        await dp.process_update(update)
+        await asyncio.sleep(0.05)
+
+        spy.assert_sent_text_contains('[12345]')
+        spy.assert_sent_text_contains('Total: $0.018')
@@ -0,0 +1,31 @@
+import asyncio
+import datetime
+
+from app.storage.db import HOT_STATEMENTS
+
+
+class TestConnectionPool:
+
+    async def test_hot_statements_are_prepared(self, db_pool):
+        """Every pool connection has the hot statements prepared by the init hook."""
+        async with db_pool.acquire() as connection:
+            assert set(connection.hot_statements) == set(HOT_STATEMENTS)
+            prepared = await connection.fetch('SELECT statement FROM pg_prepared_statements')
+        prepared_sql = {record['statement'] for record in prepared}
+        assert all(sql in prepared_sql for sql in HOT_STATEMENTS.values())
+
+    async def test_pool_metrics_count_acquires(self, db, db_pool):
+        """Acquire waits and connections in use are tracked for shortcuts and explicit acquires."""
+        metrics = db_pool.metrics
+        metrics.reset()
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        await asyncio.gather(*[db.get_last_message(1, 1, now) for _ in range(5)])
+        async with db_pool.acquire():
+            assert metrics.in_use == 1
+
+        stats = metrics.stats()
+        assert stats['acquire_count'] == 6
+        assert stats['in_use'] == 0
+        assert 1 <= stats['in_use_max'] <= stats['max_size']
+        assert stats['acquire_wait_max'] >= stats['acquire_wait_avg'] >= 0
@@ -4,7 +4,9 @@ import datetime
 import pytest
 
 import settings
+from app.openai_helpers.chatgpt import DialogMessage
 from app.openai_helpers.llm_client_factory import LLMClientFactory
+from app.storage.db import MessageType
 from tests.helpers.mock_llm_client import MockLLMClient
 from tests.helpers.telegram_factory import make_text_message, make_command_message
 from tests.helpers.bot_spy import BotSpy
@@ -112,7 +114,8 @@ class TestContextManagement:
         # Since mock returns dicts, we need the message_id from the return value
         # Let's get it from DB instead
         user = await telegram_bot.db.get_user(user_id)
-        last_msg = await telegram_bot.db.get_last_message(user.id, user_id)
+        an_hour_ago = datetime.datetime.now(settings.POSTGRES_TIMEZONE) - datetime.timedelta(hours=1)
+        last_msg = await telegram_bot.db.get_last_message(user.id, user_id, an_hour_ago)
         bot_response_tg_msg_id = last_msg.tg_message_id
 
         # /reset to clear linear context
@@ -150,3 +153,38 @@ class TestContextManagement:
             f"Expected 'Branch A' in reply context, got: {all_content}"
         assert 'Branch B' not in all_content, \
             f"Expected 'Branch B' NOT in reply context, got: {all_content}"
+
+    async def test_message_tokens_count_stored(self, bot_app, db_pool):
+        """Messages are stored with their token count keyed by encoder family."""
+        telegram_bot, dp, mock_bot = bot_app
+
+        user_id = 66669
+
+        mock_llm = MockLLMClient()
+        mock_llm.add_response("Counted response")
+        LLMClientFactory._model_clients['gpt-3.5-turbo'] = mock_llm
+
+        update = make_text_message('Count my tokens', user_id=user_id)
+        await dp.process_update(update)
+        await asyncio.sleep(0.1)
+
+        user = await telegram_bot.db.get_user(user_id)
+        an_hour_ago = datetime.datetime.now(settings.POSTGRES_TIMEZONE) - datetime.timedelta(hours=1)
+        last_msg = await telegram_bot.db.get_last_message(user.id, user_id, an_hour_ago)
+        assert last_msg.tokens_count.get('cl100k_base', 0) > 0, \
+            f"Expected stored token count for cl100k_base, got: {last_msg.tokens_count}"
+
+    async def test_last_message_of_batch_is_its_tip(self, db):
+        """Rows of one batch insert share cdate, the last message of the chat is the last row of the batch."""
+        user = await db.create_user(66670, settings.USER_ROLE_DEFAULT)
+        items = [
+            (n, DialogMessage(role='user', content=f'Batch {n}'), MessageType.MESSAGE, {})
+            for n in range(1, 6)
+        ]
+        created = await db.create_messages(user.id, 66670, items)
+        assert len({m.cdate for m in created}) == 1
+
+        last_msg = await db.get_last_message(user.id, 66670, created[0].cdate)
+        assert last_msg.id == created[-1].id
+        branch = await db.get_message_branch(last_msg)
+        assert [m.message.content for m in branch] == [f'Batch {n}' for n in range(1, 6)]
@@ -0,0 +1,86 @@
+import datetime
+
+import pytest
+from dateutil.relativedelta import relativedelta
+
+import settings
+from app.bot.scheduled_tasks import build_partition_maintenance_task
+from app.storage.db import HOT_STATEMENTS
+from tests.helpers.query_plans import explain
+
+
+def _month_start(months_offset):
+    current_month = datetime.datetime.now(datetime.timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return current_month + relativedelta(months=months_offset)
+
+
+@pytest.fixture
+async def expired_message_partition(db, db_pool):
+    month = _month_start(-24)
+    partition = f'message_p{month:%Y_%m}'
+    await db.create_month_partitions('message', [month.date()])
+    await db_pool.execute(
+        """INSERT INTO chatgpttg.message (user_id, tg_chat_id, tg_message_id, message, cdate)
+           VALUES (1, 1, 1, '{"role": "user", "content": "hi"}', $1)""",
+        month + datetime.timedelta(days=1),
+    )
+    yield partition
+    await db_pool.execute(f'DROP TABLE IF EXISTS chatgpttg_archive.{partition}')
+    await db_pool.execute(f'DROP TABLE IF EXISTS chatgpttg.{partition}')
+
+
+def _assert_pruned(nodes, partitions):
+    scanned = {node['Relation Name'] for node in nodes if 'Relation Name' in node}
+    assert scanned, nodes
+    assert not scanned & set(partitions), scanned
+    # a generic plan prunes partitions when the executor starts
+    assert any(node.get('Subplans Removed', 0) >= len(partitions) for node in nodes), nodes
+
+
+@pytest.fixture
+async def past_message_partitions(db, db_pool):
+    existing = await db.get_month_partitions('message')
+    months = [_month_start(offset).date() for offset in (-3, -2, -1)]
+    await db.create_month_partitions('message', months)
+    partitions = await db.get_month_partitions('message')
+    yield [partitions[month] for month in months]
+    for month in months:
+        if month not in existing:
+            await db_pool.execute(f'DROP TABLE IF EXISTS chatgpttg.{partitions[month]}')
+
+
+class TestPartitions:
+
+    async def test_maintenance_creates_future_partitions(self, db):
+        """Partitions of every partitioned table exist for the configured months ahead."""
+        task = build_partition_maintenance_task(db)
+        await task.task_function()
+
+        last_month = _month_start(settings.PARTITION_PREMAKE_MONTHS).date()
+        for table in ('message', 'completion_usage', 'whisper_usage', 'image_generation_usage', 'tts_usage'):
+            partitions = await db.get_month_partitions(table)
+            assert last_month in partitions, (table, partitions)
+
+    async def test_maintenance_archives_expired_partitions(self, db, db_pool, expired_message_partition, monkeypatch):
+        """Partitions older than the retention are detached into the archive schema with their rows."""
+        monkeypatch.setattr(settings, 'MESSAGE_RETENTION_MONTHS', 12)
+        monkeypatch.setattr(settings, 'PARTITION_RETENTION_ARCHIVE', True)
+
+        task = build_partition_maintenance_task(db)
+        await task.task_function()
+
+        assert await db_pool.fetchval('SELECT COUNT(*) FROM chatgpttg.message') == 0
+        archived_count = await db_pool.fetchval(f'SELECT COUNT(*) FROM chatgpttg_archive.{expired_message_partition}')
+        assert archived_count == 1
+        partitions = await db.get_month_partitions('message')
+        assert _month_start(-24).date() not in partitions
+
+    async def test_last_message_skips_past_partitions(self, db_pool, past_message_partitions):
+        """Last chat message lookup is bounded by cdate, partitions of earlier months are pruned."""
+        nodes = await explain(db_pool, HOT_STATEMENTS['get_last_message'], 1, 1, _month_start(0))
+        _assert_pruned(nodes, past_message_partitions)
+
+    async def test_telegram_message_skips_past_partitions(self, db_pool, past_message_partitions):
+        """Lookup by telegram message id is bounded by cdate, partitions of earlier months are pruned."""
+        nodes = await explain(db_pool, HOT_STATEMENTS['get_telegram_message'], 1, 1, _month_start(0))
+        _assert_pruned(nodes, past_message_partitions)
@@ -0,0 +1,50 @@
+import datetime
+
+import pytest
+
+from app.storage.db import HOT_STATEMENTS
+from tests.helpers.query_plans import explain
+
+
+SEED_MESSAGES_COUNT = 50000
+SEED_CHATS_COUNT = 500
+
+LAST_MESSAGE_SQL = HOT_STATEMENTS['get_last_message']
+TELEGRAM_MESSAGE_SQL = HOT_STATEMENTS['get_telegram_message']
+
+
+def _day_ago():
+    return datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=1)
+
+
+@pytest.fixture
+async def seeded_messages(db_pool):
+    await db_pool.execute(
+        """INSERT INTO chatgpttg.message (user_id, tg_chat_id, tg_message_id, message, cdate)
+           SELECT i % $2, i % $2, i, '{"role": "user", "content": "hi"}',
+                  NOW() - make_interval(secs => $1 - i)
+           FROM generate_series(1, $1) AS i""",
+        SEED_MESSAGES_COUNT, SEED_CHATS_COUNT,
+    )
+    await db_pool.execute('ANALYZE chatgpttg.message')
+
+
+class TestQueryPlans:
+
+    async def test_last_message_uses_composite_index(self, db_pool, seeded_messages):
+        """Last chat message is read from the index in cdate order, without a seq scan or sort."""
+        nodes = await explain(db_pool, LAST_MESSAGE_SQL, 42, 42, _day_ago())
+        node_types = [node['Node Type'] for node in nodes]
+
+        assert 'Seq Scan' not in node_types, node_types
+        assert 'Sort' not in node_types, node_types
+        # indexes of the monthly partitions are named after the partition
+        assert any(node.get('Index Name', '').endswith('user_id_tg_chat_id_cdate_id_idx') for node in nodes), nodes
+
+    async def test_telegram_message_uses_composite_index(self, db_pool, seeded_messages):
+        """Lookup by telegram chat and message id is a single index scan."""
+        nodes = await explain(db_pool, TELEGRAM_MESSAGE_SQL, 42, 42, _day_ago())
+        node_types = [node['Node Type'] for node in nodes]
+
+        assert 'Seq Scan' not in node_types, node_types
+        assert any(node.get('Index Name', '').endswith('tg_chat_id_tg_message_id_idx') for node in nodes), nodes
@@ -1,7 +1,9 @@
 import asyncio
+import datetime
 
 import pytest
 
+import settings
 from app.openai_helpers.llm_client_factory import LLMClientFactory
 from tests.helpers.mock_llm_client import MockLLMClient
 from tests.helpers.telegram_factory import make_text_message
@@ -59,7 +61,8 @@ class TestSimpleMessage:
 
         user = await telegram_bot.db.get_user(user_id)
         assert user is not None
-        last_msg = await telegram_bot.db.get_last_message(user.id, user_id)
+        an_hour_ago = datetime.datetime.now(settings.POSTGRES_TIMEZONE) - datetime.timedelta(hours=1)
+        last_msg = await telegram_bot.db.get_last_message(user.id, user_id, an_hour_ago)
         assert last_msg is not None
 
     async def test_llm_receives_user_message(self, bot_app, mock_llm):
@@ -2,6 +2,7 @@ import asyncio
 import json
 
 import pytest
+from aiogram.utils.exceptions import MessageNotModified
 
 from app.openai_helpers.llm_client_factory import LLMClientFactory
 from tests.helpers.mock_llm_client import MockLLMClient
@@ -147,3 +148,86 @@ class TestStreaming:
         # Verify DB was updated by the function
         user = await telegram_bot.db.get_user(user_id)
         assert user.system_prompt_settings == 'Name: StreamTest'
+
+    async def test_long_streaming_answer_continues_in_new_message(self, bot_app):
+        """A streamed answer longer than one Telegram message continues in a new message instead of freezing."""
+        telegram_bot, dp, mock_bot = bot_app
+        spy = BotSpy(mock_bot)
+
+        user_id = 55558
+
+        # Create user
+        mock_llm = MockLLMClient()
+        mock_llm.add_response("Hello!")
+        LLMClientFactory._model_clients['gpt-3.5-turbo'] = mock_llm
+
+        update = make_text_message('Hi', user_id=user_id)
+        await dp.process_update(update)
+        await asyncio.sleep(0.1)
+
+        # Enable streaming
+        user = await telegram_bot.db.get_user(user_id)
+        user.streaming_answers = True
+        await telegram_bot.db.update_user(user)
+
+        # ~5400 characters, every chunk is big enough for its own snapshot
+        mock_llm2 = MockLLMClient()
+        mock_llm2.add_streaming_response(content_chunks=[f'part{n} ' + 'word ' * 180 for n in range(6)])
+        LLMClientFactory._model_clients['gpt-3.5-turbo'] = mock_llm2
+
+        update2 = make_text_message('Tell me a long story', user_id=user_id)
+        await dp.process_update(update2)
+        await asyncio.sleep(0.3)
+
+        sent_texts = spy.get_all_sent_texts()
+        all_texts = sent_texts + spy.get_all_edited_texts()
+        # "Hello!", the first streamed message and its continuation
+        assert len(sent_texts) == 3, f"Expected a continuation message, got: {sent_texts}"
+        assert all(len(t) <= 4080 for t in all_texts)
+        assert not any('⏳' in t for t in all_texts)
+        # Final answer is split over the two streamed messages
+        final_edits = spy.get_edited_messages()[-2:]
+        assert all(edit.get('parse_mode', '').lower() == 'markdown' for edit in final_edits)
+        assert 'part5' in final_edits[-1]['text']
+
+    async def test_filled_message_not_modified_does_not_fail_turn(self, bot_app):
+        """Telegram refusing the final edit of a filled streamed message as not modified does not break the answer."""
+        telegram_bot, dp, mock_bot = bot_app
+        spy = BotSpy(mock_bot)
+
+        user_id = 55559
+
+        # Create user
+        mock_llm = MockLLMClient()
+        mock_llm.add_response("Hello!")
+        LLMClientFactory._model_clients['gpt-3.5-turbo'] = mock_llm
+
+        update = make_text_message('Hi', user_id=user_id)
+        await dp.process_update(update)
+        await asyncio.sleep(0.1)
+
+        # Enable streaming
+        user = await telegram_bot.db.get_user(user_id)
+        user.streaming_answers = True
+        await telegram_bot.db.update_user(user)
+
+        # edits without keyboard or parse mode are the ones finishing a filled message
+        default_request = mock_bot.request.side_effect
+
+        async def request(method, data=None, **kwargs):
+            if method == 'editMessageText' and 'reply_markup' not in data and 'parse_mode' not in data:
+                raise MessageNotModified('Message is not modified')
+            return await default_request(method, data, **kwargs)
+
+        mock_bot.request.side_effect = request
+
+        mock_llm2 = MockLLMClient()
+        mock_llm2.add_streaming_response(content_chunks=[f'part{n} ' + 'word ' * 180 for n in range(6)])
+        LLMClientFactory._model_clients['gpt-3.5-turbo'] = mock_llm2
+
+        update2 = make_text_message('Tell me a long story', user_id=user_id)
+        await dp.process_update(update2)
+        await asyncio.sleep(0.3)
+
+        assert len(spy.get_all_sent_texts()) == 3
+        assert 'part5' in spy.get_edited_messages()[-1]['text']
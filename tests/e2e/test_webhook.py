@@ -0,0 +1,150 @@
+import asyncio
+import queue
+
+from aiogram import Dispatcher
+from aiogram.dispatcher.webhook import BOT_DISPATCHER_KEY
+from aiohttp.test_utils import TestClient, TestServer, unused_port
+
+from app.bot.cancellation_manager import CANCELLATION_PREFIX
+from app.bot.sharding import ShardingDispatcher
+from app.bot.webhook import BackpressureWebhookHandler, ReplicaRouter, build_webhook_app, WEBHOOK_BACKPRESSURE_KEY
+from app.openai_helpers.llm_client_factory import LLMClientFactory
+from tests.helpers.bot_spy import BotSpy
+from tests.helpers.mock_llm_client import MockLLMClient
+from tests.helpers.telegram_factory import make_callback_query, make_text_message
+
+WEBHOOK_PATH = '/telegram/webhook'
+
+
+def _make_client(dp, max_in_flight=10, secret_token='', replica_router=None, port=None):
+    app = build_webhook_app(max_in_flight, 1, secret_token, replica_router)
+    app[BOT_DISPATCHER_KEY] = dp
+    app.router.add_route('*', WEBHOOK_PATH, BackpressureWebhookHandler)
+    return TestClient(TestServer(app, port=port))
+
+
+class TestWebhook:
+
+    async def test_webhook_update_gets_response(self, bot_app):
+        """An update posted to the webhook is acknowledged at once and handled like a polled one."""
+        telegram_bot, dp, mock_bot = bot_app
+        spy = BotSpy(mock_bot)
+
+        mock_llm = MockLLMClient()
+        mock_llm.add_response("Hello from webhook!")
+        LLMClientFactory._model_clients['gpt-3.5-turbo'] = mock_llm
+
+        async with _make_client(dp) as client:
+            response = await client.post(WEBHOOK_PATH, json=make_text_message('Hi').to_python())
+            assert response.status == 200
+            await client.app[WEBHOOK_BACKPRESSURE_KEY].wait_closed()
+            await asyncio.sleep(0.1)
+
+        spy.assert_sent_text_contains("Hello from webhook!")
+
+    async def test_updates_over_limit_are_refused(self, mock_bot):
+        """Updates over max_in_flight get 503 with Retry-After until the accepted ones are handled."""
+        dp = Dispatcher(mock_bot)
+        release = asyncio.Event()
+        handled = []
+
+        async def blocking_handler(message):
+            await release.wait()
+            handled.append(message.text)
+
+        dp.register_message_handler(blocking_handler)
+
+        async with _make_client(dp, max_in_flight=1) as client:
+            backpressure = client.app[WEBHOOK_BACKPRESSURE_KEY]
+            first = await client.post(WEBHOOK_PATH, json=make_text_message('first').to_python())
+            refused = await client.post(WEBHOOK_PATH, json=make_text_message('refused').to_python())
+            assert first.status == 200
+            assert refused.status == 503
+            assert refused.headers['Retry-After'] == '1'
+
+            release.set()
+            await backpressure.wait_closed()
+            second = await client.post(WEBHOOK_PATH, json=make_text_message('second').to_python())
+            assert second.status == 200
+            await backpressure.wait_closed()
+
+        assert handled == ['first', 'second']
+        assert backpressure.stats()['rejected_count'] == 1
+
+    async def test_stop_is_accepted_over_limit(self, mock_bot):
+        """A callback query is not counted against max_in_flight, a Stop press reaches a full replica."""
+        dp = Dispatcher(mock_bot)
+        release = asyncio.Event()
+
+        async def blocking_handler(message):
+            await release.wait()
+
+        async def stop_handler(callback_query):
+            release.set()
+
+        dp.register_message_handler(blocking_handler)
+        dp.register_callback_query_handler(stop_handler)
+
+        async with _make_client(dp, max_in_flight=1) as client:
+            backpressure = client.app[WEBHOOK_BACKPRESSURE_KEY]
+            turn = await client.post(WEBHOOK_PATH, json=make_text_message('turn').to_python())
+            assert backpressure.is_full()
+            stop = await client.post(
+                WEBHOOK_PATH, json=make_callback_query(f'{CANCELLATION_PREFIX}.cancel', message_id=1).to_python(),
+            )
+            await asyncio.wait_for(backpressure.wait_closed(), timeout=5)
+
+        assert turn.status == 200
+        assert stop.status == 200
+        assert backpressure.stats()['rejected_count'] == 0
+        assert backpressure.in_flight == 0
+
+    async def test_wrong_secret_token_is_forbidden(self, mock_bot):
+        """Requests without the configured secret token are not handled."""
+        dp = Dispatcher(mock_bot)
+
+        async with _make_client(dp, secret_token='secret') as client:
+            response = await client.post(WEBHOOK_PATH, json=make_text_message('Hi').to_python())
+            assert response.status == 403
+            response = await client.post(
+                WEBHOOK_PATH, json=make_text_message('Hi').to_python(),
+                headers={'X-Telegram-Bot-Api-Secret-Token': 'secret'},
+            )
+            assert response.status == 200
+
+    async def test_update_is_handled_by_replica_of_its_user(self, mock_bot):
+        """An update of another replica's user is forwarded to it, an update of its own user is handled locally."""
+        ports = [unused_port(), unused_port()]
+        replica_urls = [f'http://127.0.0.1:{port}{WEBHOOK_PATH}' for port in ports]
+        handled = [[], []]
+        clients = []
+        for index, port in enumerate(ports):
+            dp = Dispatcher(mock_bot)
+
+            async def handler(message, index=index):
+                handled[index].append(message.from_user.id)
+
+            dp.register_message_handler(handler)
+            clients.append(_make_client(dp, replica_router=ReplicaRouter(replica_urls, index), port=port))
+
+        async with clients[0] as first, clients[1] as second:
+            for user_id in (2, 3):
+                response = await first.post(WEBHOOK_PATH, json=make_text_message('Hi', user_id=user_id).to_python())
+                assert response.status == 200
+            await first.app[WEBHOOK_BACKPRESSURE_KEY].wait_closed()
+            await second.app[WEBHOOK_BACKPRESSURE_KEY].wait_closed()
+
+        assert handled == [[2], [3]]
+
+    async def test_full_worker_queue_is_refused(self, mock_bot):
+        """In the sharded mode an update for a worker with a full queue gets 503."""
+        worker_queue = queue.Queue(1)
+        ingress = ShardingDispatcher(mock_bot, [worker_queue], [queue.Queue()])
+
+        async with _make_client(ingress) as client:
+            accepted = await client.post(WEBHOOK_PATH, json=make_text_message('first').to_python())
+            refused = await client.post(WEBHOOK_PATH, json=make_text_message('second').to_python())
+
+        assert accepted.status == 200
+        assert refused.status == 503
+        assert worker_queue.get_nowait()['message']['text'] == 'first'
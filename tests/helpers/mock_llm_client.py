@@ -132,7 +132,7 @@ def _build_response(resp_data, model):
 
 
 class MockDelta:
-    """Delta object that supports dict() conversion for merge_dicts."""
+    """Delta object that supports dict() conversion."""
     def __init__(self, content=None, function_call=None, tool_calls=None):
         self.content = content
         self.function_call = function_call
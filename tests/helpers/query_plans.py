@@ -0,0 +1,18 @@
+import json
+
+
+def _plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from _plan_nodes(child)
+
+
+async def explain(db_pool, sql, *args):
+    """Returns all nodes of the generic plan of the statement, as a prepared hot statement ends up with."""
+    async with db_pool.acquire() as connection:
+        await connection.execute("SET plan_cache_mode = 'force_generic_plan'")
+        try:
+            result = await connection.fetchval(f'EXPLAIN (FORMAT JSON) {sql}', *args)
+        finally:
+            await connection.execute('RESET plan_cache_mode')
+    return list(_plan_nodes(json.loads(result)[0]['Plan']))
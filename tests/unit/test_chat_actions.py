@@ -0,0 +1,64 @@
+import asyncio
+
+from app.bot.chat_actions import ChatActionService
+
+
+class _Bot:
+    def __init__(self, slow_chats=()):
+        self.actions = []
+        self.slow_chats = slow_chats
+
+    async def send_chat_action(self, chat_id, action):
+        if chat_id in self.slow_chats:
+            # like a chat blocked by flood control
+            await asyncio.sleep(0.3)
+        self.actions.append((chat_id, action))
+
+
+class TestChatActionService:
+
+    async def test_nested_reasons_share_one_action_per_interval(self):
+        """Nested reasons of a chat send one action per interval, the latest reason's action is shown."""
+        bot = _Bot()
+        chat_actions = ChatActionService(bot, interval=0.05)
+
+        async with chat_actions.active(1):
+            async with chat_actions.active(1):
+                async with chat_actions.active(2):
+                    await asyncio.sleep(0.01)
+                    assert bot.actions == [(1, 'typing'), (2, 'typing')]
+                    await asyncio.sleep(0.07)
+                    assert bot.actions.count((1, 'typing')) == 2
+            async with chat_actions.active(1, ChatActionService.ACTION_RECORD_VOICE):
+                await asyncio.sleep(0.01)
+                assert bot.actions[-1] == (1, 'record_voice')
+            assert len(chat_actions) == 1
+
+        await asyncio.sleep(0.06)
+        assert len(chat_actions) == 0
+        assert chat_actions._task is None
+
+    async def test_actions_stop_after_timeout(self):
+        """A chat gets no more actions once its latest reason is older than the timeout."""
+        bot = _Bot()
+        chat_actions = ChatActionService(bot, interval=0.01, timeout=0.03)
+
+        async with chat_actions.active(1):
+            await asyncio.sleep(0.1)
+            sent = len(bot.actions)
+            assert 2 <= sent <= 5
+            await asyncio.sleep(0.05)
+            assert len(bot.actions) == sent
+        await chat_actions.stop()
+
+    async def test_slow_chat_does_not_hold_back_others(self):
+        """A chat whose sends are held by the rate limiter does not delay the actions of other chats."""
+        bot = _Bot(slow_chats=(1,))
+        chat_actions = ChatActionService(bot, interval=0.02)
+
+        async with chat_actions.active(1):
+            async with chat_actions.active(2):
+                await asyncio.sleep(0.2)
+                assert bot.actions.count((2, 'typing')) >= 5
+                assert (1, 'typing') not in bot.actions
+        await chat_actions.stop()
@@ -0,0 +1,114 @@
+import asyncio
+import queue
+
+from aiogram import Dispatcher
+
+from app.bot.cancellation_manager import CANCELLATION_PREFIX
+from app.bot.sharding import ShardingDispatcher, _consume_updates, get_shard
+from tests.helpers.telegram_factory import make_callback_query, make_text_message
+
+
+class TestSharding:
+
+    async def test_user_updates_reach_one_worker_in_order(self, mock_bot):
+        """Messages of a user are queued for the same worker in the order received, the Stop button too."""
+        worker_queues = [queue.Queue() for _ in range(3)]
+        control_queues = [queue.Queue() for _ in range(3)]
+        ingress = ShardingDispatcher(mock_bot, worker_queues, control_queues)
+
+        await ingress.process_updates([
+            make_text_message('first', user_id=301),
+            make_text_message('other user', user_id=302),
+            make_text_message('second', user_id=301),
+            make_callback_query(f'{CANCELLATION_PREFIX}.cancel', message_id=1, user_id=301),
+        ])
+
+        user_queue = worker_queues[get_shard(301, 3)]
+        routed = [user_queue.get_nowait() for _ in range(user_queue.qsize())]
+        assert [update['message']['text'] for update in routed] == ['first', 'second']
+        assert control_queues[get_shard(301, 3)].get_nowait()['callback_query']['from']['id'] == 301
+        other_queue = worker_queues[get_shard(302, 3)]
+        assert other_queue.get_nowait()['message']['text'] == 'other user'
+        assert get_shard(None, 3) == 0
+
+    async def test_worker_handles_queued_updates_in_order(self, mock_bot):
+        """A worker starts handling queued updates in the order received and stops at the stop marker."""
+        dispatcher = Dispatcher(mock_bot)
+        handled = []
+
+        async def handler(message):
+            handled.append(message.text)
+
+        dispatcher.register_message_handler(handler)
+        worker_queue = queue.Queue()
+        for text in ['one', 'two', 'three']:
+            worker_queue.put(make_text_message(text, user_id=301).to_python())
+        worker_queue.put(None)
+
+        await asyncio.wait_for(_consume_updates(dispatcher, worker_queue, asyncio.Event(), 10), timeout=5)
+
+        assert handled == ['one', 'two', 'three']
+
+    async def test_busy_worker_fills_its_queue(self, mock_bot):
+        """A worker at its in-flight limit leaves updates queued, the ingress then refuses updates of its users."""
+        dispatcher = Dispatcher(mock_bot)
+        release = asyncio.Event()
+        handled = []
+
+        async def handler(message):
+            await release.wait()
+            handled.append(message.text)
+
+        dispatcher.register_message_handler(handler)
+        worker_queues = [queue.Queue(1), queue.Queue(1)]
+        ingress = ShardingDispatcher(mock_bot, worker_queues, [queue.Queue(), queue.Queue()])
+        worker = asyncio.create_task(_consume_updates(dispatcher, worker_queues[0], asyncio.Event(), 1))
+
+        assert ingress.try_route(make_text_message('handled', user_id=2))
+        await asyncio.sleep(0.1)
+        assert ingress.try_route(make_text_message('queued', user_id=2))
+        assert not ingress.try_route(make_text_message('refused', user_id=2))
+        # other workers are not affected
+        assert ingress.try_route(make_text_message('other worker', user_id=3))
+
+        release.set()
+        await asyncio.sleep(0.1)
+        worker_queues[0].put_nowait(None)
+        await asyncio.wait_for(worker, timeout=5)
+        assert handled == ['handled', 'queued']
+
+    async def test_stop_is_handled_while_turns_hold_every_slot(self, mock_bot):
+        """A Stop press reaches its handler while running turns hold every in-flight slot of the worker."""
+        dispatcher = Dispatcher(mock_bot)
+        release = asyncio.Event()
+        stopped = []
+
+        async def turn_handler(message):
+            await release.wait()
+
+        async def stop_handler(callback_query):
+            stopped.append(callback_query.data)
+            release.set()
+
+        dispatcher.register_message_handler(turn_handler)
+        dispatcher.register_callback_query_handler(stop_handler)
+        worker_queue, control_queue = queue.Queue(1), queue.Queue()
+        ingress = ShardingDispatcher(mock_bot, [worker_queue], [control_queue])
+        stopping = asyncio.Event()
+        consumers = asyncio.gather(
+            _consume_updates(dispatcher, worker_queue, stopping, 1),
+            _consume_updates(dispatcher, control_queue, stopping, 1),
+        )
+
+        assert ingress.try_route(make_text_message('turn', user_id=2))
+        await asyncio.sleep(0.1)
+        assert ingress.try_route(make_text_message('queued', user_id=2))
+        assert not ingress.try_route(make_text_message('refused', user_id=2))
+        assert ingress.try_route(make_callback_query(f'{CANCELLATION_PREFIX}.cancel', message_id=1, user_id=2))
+
+        await asyncio.wait_for(release.wait(), timeout=5)
+        assert stopped == [f'{CANCELLATION_PREFIX}.cancel']
+        await asyncio.sleep(0.1)
+        worker_queue.put_nowait(None)
+        control_queue.put_nowait(None)
+        await asyncio.wait_for(consumers, timeout=5)
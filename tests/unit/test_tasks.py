@@ -0,0 +1,30 @@
+import asyncio
+
+from app.tasks import PeriodicTask
+
+
+class TestPeriodicTask:
+
+    async def test_function_is_called_every_interval_until_stopped(self):
+        """Plain and coroutine functions are called every interval once started, not after stop."""
+        calls = []
+
+        async def flush():
+            calls.append('flush')
+
+        reporting = PeriodicTask(lambda: calls.append('report'), 0.05)
+        flushing = PeriodicTask(flush, 0.05)
+        disabled = PeriodicTask(lambda: calls.append('disabled'), 0)
+        for task in (reporting, flushing, disabled):
+            task.start()
+
+        await asyncio.sleep(0.12)
+        for task in (reporting, flushing, disabled):
+            await task.stop()
+        count = len(calls)
+        await asyncio.sleep(0.06)
+
+        assert calls.count('report') == 2
+        assert calls.count('flush') == 2
+        assert 'disabled' not in calls
+        assert len(calls) == count
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+from aiogram.utils.exceptions import RetryAfter
+
+from app.bot.telegram_rate_limiter import TelegramRateLimiter
+
+
+class _Api:
+    """Fake Bot API recording the calls in the order they are sent."""
+    def __init__(self, failures=0):
+        self.sent = []
+        self.failures = failures
+
+    def request(self, limiter, method, data):
+        async def send():
+            if self.failures:
+                self.failures -= 1
+                raise RetryAfter(0.01)
+            self.sent.append((asyncio.get_running_loop().time(), method, dict(data or {})))
+            return data.get('text') if data else method
+        return limiter.call(method, data, send)
+
+
+class TestTelegramRateLimiter:
+
+    async def test_chat_calls_are_spaced_by_chat_rate(self):
+        """Calls to one chat are sent in order at the chat rate, other chats are not held back by it."""
+        limiter = TelegramRateLimiter(global_rate=100, chat_rate=20, chat_burst=1, max_retries=0)
+        api = _Api()
+
+        await asyncio.gather(
+            *[api.request(limiter, 'sendMessage', {'chat_id': 1, 'text': f'm{n}'}) for n in range(3)],
+            api.request(limiter, 'sendMessage', {'chat_id': 2, 'text': 'other'}),
+        )
+
+        chat_calls = [(sent_time, data['text']) for sent_time, _, data in api.sent if data['chat_id'] == 1]
+        assert [text for _, text in chat_calls] == ['m0', 'm1', 'm2']
+        assert chat_calls[2][0] - chat_calls[0][0] >= 2 / 20 * 0.9
+        other_time = next(sent_time for sent_time, _, data in api.sent if data['chat_id'] == 2)
+        assert other_time < chat_calls[1][0]
+        assert limiter.stats()['sent_count'] == 4
+        assert limiter.stats()['queued'] == 0
+
+    async def test_waiting_edits_are_superseded(self):
+        """Only the latest waiting edit of a message is sent, every caller gets its result."""
+        limiter = TelegramRateLimiter(global_rate=100, chat_rate=20, chat_burst=1, max_retries=0)
+        api = _Api()
+        await api.request(limiter, 'sendMessage', {'chat_id': 1, 'text': 'start'})
+
+        results = await asyncio.gather(*[
+            api.request(limiter, 'editMessageText', {'chat_id': 1, 'message_id': 10, 'text': f'v{n}'})
+            for n in range(4)
+        ])
+
+        assert [data['text'] for _, method, data in api.sent if method == 'editMessageText'] == ['v3']
+        assert results == ['v3'] * 4
+        assert limiter.stats()['superseded_count'] == 3
+
+    async def test_cancelled_caller_does_not_cancel_superseding_edit(self):
+        """The newer edit is sent to the caller that replaced a cancelled one, a call nobody waits for is dropped."""
+        limiter = TelegramRateLimiter(global_rate=100, chat_rate=20, chat_burst=1, max_retries=0)
+        api = _Api()
+        await api.request(limiter, 'sendMessage', {'chat_id': 1, 'text': 'start'})
+
+        first = asyncio.create_task(
+            api.request(limiter, 'editMessageText', {'chat_id': 1, 'message_id': 10, 'text': 'old'})
+        )
+        await asyncio.sleep(0)
+        second = asyncio.create_task(
+            api.request(limiter, 'editMessageText', {'chat_id': 1, 'message_id': 10, 'text': 'new'})
+        )
+        await asyncio.sleep(0)
+        first.cancel()
+
+        assert await second == 'new'
+        assert first.cancelled()
+
+        dropped = asyncio.create_task(
+            api.request(limiter, 'editMessageText', {'chat_id': 1, 'message_id': 10, 'text': 'dropped'})
+        )
+        await asyncio.sleep(0)
+        dropped.cancel()
+        await asyncio.sleep(0.1)
+        assert [data['text'] for _, method, data in api.sent if method == 'editMessageText'] == ['new']
+        assert limiter.stats()['queued'] == 0
+
+    async def test_retry_after_is_honoured(self):
+        """A call hitting flood control is sent again after retry_after, then the chat is forgotten."""
+        limiter = TelegramRateLimiter(global_rate=100, chat_rate=100, chat_burst=1, max_retries=2)
+        api = _Api(failures=1)
+        start = asyncio.get_running_loop().time()
+
+        assert await api.request(limiter, 'sendMessage', {'chat_id': 1, 'text': 'hello'}) == 'hello'
+
+        assert api.sent[0][0] - start >= 0.01 * 0.9
+        assert limiter.stats()['retry_after_count'] == 1
+        assert limiter.stats()['sent_count'] == 1
+        await asyncio.sleep(0.05)
+        assert len(limiter) == 0
+
+        with pytest.raises(RetryAfter):
+            await _Api(failures=3).request(limiter, 'sendMessage', {'chat_id': 1, 'text': 'hello'})
@@ -0,0 +1,97 @@
+import asyncio
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.bot.cancellation_manager import CancellationManager
+from app.bot.turn_scheduler import TurnScheduler
+from app.storage.user_role import UserRole
+
+
+class _Turns:
+    """Turns recording the order they finished in and the peak number of concurrently running ones."""
+    def __init__(self):
+        self.finished = []
+        self.running = 0
+        self.peak = 0
+
+    def make(self, tag):
+        async def turn(is_cancelled):
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            await asyncio.sleep(0.01)
+            self.finished.append(tag)
+            self.running -= 1
+            return tag
+        return turn
+
+
+def _make_scheduler(workers, role_weights=None):
+    cancellation_manager = CancellationManager(MagicMock(), MagicMock())
+    return TurnScheduler(workers, role_weights or {}, cancellation_manager)
+
+
+class TestTurnScheduler:
+
+    async def test_user_turns_run_in_order_within_worker_limit(self):
+        """Turns of one user never overlap and keep submission order, total concurrency is bounded."""
+        scheduler = _make_scheduler(2)
+        turns = _Turns()
+
+        results = await asyncio.gather(*[
+            scheduler.run(user_id, UserRole.BASIC, user_id, turns.make((user_id, n)))
+            for n in range(3) for user_id in range(4)
+        ])
+
+        assert results == [(user_id, n) for n in range(3) for user_id in range(4)]
+        assert turns.peak == 2
+        for user_id in range(4):
+            assert [n for u, n in turns.finished if u == user_id] == [0, 1, 2]
+        assert scheduler.stats()['queue_depth'] == 0
+
+    async def test_roles_share_workers_by_weight(self):
+        """With a single worker, a user with double weight is served twice as often."""
+        scheduler = _make_scheduler(1, {UserRole.ADMIN: 2, UserRole.BASIC: 1})
+        turns = _Turns()
+
+        await asyncio.gather(*[
+            scheduler.run(user_id, role, user_id, turns.make(role))
+            for _ in range(6) for user_id, role in ((1, UserRole.ADMIN), (2, UserRole.BASIC))
+        ])
+
+        assert turns.finished[:6].count(UserRole.ADMIN) == 4
+
+    async def test_turn_exception_is_raised_to_submitter(self):
+        """A failing turn raises in its submitter and does not block the user's next turns."""
+        scheduler = _make_scheduler(1)
+
+        async def failing_turn(is_cancelled):
+            raise ValueError('turn failed')
+
+        with pytest.raises(ValueError, match='turn failed'):
+            await scheduler.run(1, UserRole.BASIC, 1, failing_turn)
+        assert await scheduler.run(1, UserRole.BASIC, 1, _Turns().make('next')) == 'next'
+
+    async def test_cancellation_token_lives_with_turn(self):
+        """Stop cancels the running turn of the user only, the token is disposed when the turn ends."""
+        scheduler = _make_scheduler(2)
+        cancellation_manager = scheduler.cancellation_manager
+        started = asyncio.Event()
+
+        async def long_turn(is_cancelled):
+            started.set()
+            while not is_cancelled():
+                await asyncio.sleep(0.001)
+            return 'cancelled'
+
+        turn = asyncio.create_task(scheduler.run(1, UserRole.BASIC, 12345, long_turn))
+        await started.wait()
+        assert len(cancellation_manager) == 1
+
+        cancellation_manager.cancel(54321)
+        assert not turn.done()
+        cancellation_manager.cancel(12345)
+
+        assert await turn == 'cancelled'
+        assert len(cancellation_manager) == 0
+        assert len(scheduler) == 0
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from app.storage.usage_recorder import UsageRecorder
+
+
+class _Pool:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.copies = []
+
+    async def copy_records_to_table(self, table, records, columns, schema_name):
+        if self.fail:
+            raise RuntimeError('copy failed')
+        self.copies.append((table, list(records)))
+
+
+class TestUsageRecorder:
+
+    async def test_failing_rows_are_dropped_after_max_attempts(self):
+        """Rows failing to be written are retried, then dropped, a failed write does not break logged flushes."""
+        pool = _Pool(fail=True)
+        recorder = UsageRecorder(pool, batch_size=100, flush_interval=60, max_flush_attempts=3)
+        await recorder.add('whisper_usage', 1, 10, 0.1)
+
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                await recorder.flush()
+            assert len(recorder) == 1
+
+        await recorder.flush_logged()
+        assert len(recorder) == 0
+
+        pool.fail = False
+        await recorder.add('whisper_usage', 1, 20, 0.2)
+        await recorder.flush()
+        assert len(recorder) == 0
+        assert [len(records) for _, records in pool.copies] == [1]
+
+    async def test_failed_batch_flush_does_not_raise_on_add(self):
+        """A failing background flush of a full batch keeps adding rows working."""
+        pool = _Pool(fail=True)
+        recorder = UsageRecorder(pool, batch_size=2, flush_interval=60, max_flush_attempts=2)
+        await recorder.add('tts_usage', 1, 'tts-1', 10, 0.1)
+        await recorder.add('tts_usage', 1, 'tts-1', 10, 0.1)
+        await asyncio.sleep(0)
+        await recorder.add('tts_usage', 1, 'tts-1', 10, 0.1)
+        await recorder.stop()
+        assert len(recorder) == 0
+        assert pool.copies == []